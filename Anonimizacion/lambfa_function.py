@@ -1,5 +1,4 @@
 import json
-import boto3
 import re
 import concurrent.futures
 from typing import List, Dict, Any, Union, Tuple
@@ -13,9 +12,23 @@ from division import (
     create_empty_result_template_combined
 )
 
-bedrock_runtime = boto3.client('bedrock-runtime', region_name='eu-central-1')
+try:
+    import boto3
+except ImportError:  # Fuera de AWS (benchmarks locales): se inyecta el cliente con set_bedrock_client
+    boto3 = None
+
+bedrock_runtime = boto3.client('bedrock-runtime', region_name='eu-central-1') if boto3 is not None else None
 CHUNK_SIZE = 25  # Número de párrafos por chunk
 MAX_WORKERS = 15  # Número máximo de hilos concurrentes
+
+def set_bedrock_client(client):
+    """
+    Sustituye el cliente de Bedrock que usan todas las llamadas al modelo
+    (p. ej. por un LocalBedrockClient para ejecutar la Lambda sin red).
+    """
+    global bedrock_runtime
+    bedrock_runtime = client
+
 def lambda_handler(event, context):
     """
     Manejador principal de la función Lambda que dirige las peticiones según el tipo de función solicitada.
@@ -0,0 +1,257 @@
+import math
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from distance_engine import normalize_rows
+
+# Por debajo de este tamaño el kNN se calcula exacto por bloques (más rápido que construir árboles)
+EXACT_KNN_MAX_POINTS = 2048
+# Tope de elementos de los tensores intermedios (float32) al procesar hojas y refinamientos
+MAX_WORK_ELEMENTS = 2 ** 24
+
+
+class RandomProjectionForest:
+    """
+    Índice aproximado de vecinos más cercanos (distancia coseno) hecho solo con NumPy.
+
+    Cada árbol parte el espacio recursivamente por la mediana de la proyección sobre una
+    dirección aleatoria, hasta hojas de ~`leaf_size` puntos. Los candidatos de un punto son
+    los que comparten hoja con él en algún árbol; una ronda opcional de refinamiento
+    (vecinos de vecinos, como NN-descent) recupera los que los cortes separaron.
+    """
+
+    def __init__(self, n_trees=8, leaf_size=64, seed=0):
+        self.n_trees = n_trees
+        self.leaf_size = leaf_size
+        self.seed = seed
+        self.X = None
+        self.trees = []
+
+    def fit(self, embeddings):
+        self.X = normalize_rows(embeddings)
+        n = self.X.shape[0]
+        self.trees = []
+        if n > EXACT_KNN_MAX_POINTS:
+            rng = np.random.default_rng(self.seed)
+            for _ in range(self.n_trees):
+                self.trees.append(self._build_tree(rng))
+        return self
+
+    def _build_tree(self, rng):
+        X = self.X
+        n, d = X.shape
+        depth = max(0, math.ceil(math.log2(n / self.leaf_size)))
+        node = np.zeros(n, dtype=np.int64)
+        directions, thresholds = [], []
+
+        for level in range(depth):
+            n_nodes = 2 ** level
+            dirs = rng.standard_normal((n_nodes, d)).astype(np.float32)
+            proj = _rowwise_dot(X, dirs, node)
+
+            # Mediana de la proyección dentro de cada nodo: la mitad superior va a la derecha
+            order = np.lexsort((proj, node))
+            counts = np.bincount(node, minlength=n_nodes)
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            rank = np.empty(n, dtype=np.int64)
+            rank[order] = np.arange(n) - np.repeat(starts, counts)
+            right = rank >= (counts // 2)[node]
+
+            thr = np.zeros(n_nodes, dtype=np.float32)
+            nonempty = counts > 0
+            thr[nonempty] = proj[order[starts[nonempty] + counts[nonempty] // 2]]
+
+            directions.append(dirs)
+            thresholds.append(thr)
+            node = 2 * node + right
+
+        return {
+            "directions": directions,
+            "thresholds": thresholds,
+            "leaves": _padded_groups(node, 2 ** depth),
+        }
+
+    def knn_graph(self, k, refine_iters=1):
+        """
+        Grafo kNN aproximado de los puntos indexados (sin el propio punto).
+
+        Returns:
+            (indices, distances): np.ndarray (n, k) int64 y float32, ordenados por distancia.
+            Si un punto tiene menos de k candidatos, los huecos llevan índice -1 y distancia inf.
+        """
+        n = self.X.shape[0]
+        k = min(k, n - 1)
+        if k <= 0:
+            return np.empty((n, 0), dtype=np.int64), np.empty((n, 0), dtype=np.float32)
+        if not self.trees:
+            return _exact_knn(self.X, k)
+
+        best_idx = np.full((n, k), -1, dtype=np.int64)
+        best_dist = np.full((n, k), np.inf, dtype=np.float32)
+        for tree in self.trees:
+            cand_idx, cand_dist = self._leaf_candidates(tree["leaves"], k)
+            best_idx, best_dist = _merge_candidates(best_idx, best_dist, cand_idx, cand_dist, k)
+
+        for _ in range(refine_iters):
+            cand_idx, cand_dist = self._neighbors_of_neighbors(best_idx, k)
+            best_idx, best_dist = _merge_candidates(best_idx, best_dist, cand_idx, cand_dist, k)
+
+        return _sort_rows(best_idx, best_dist)
+
+    def query(self, queries, k):
+        """
+        Vecinos aproximados de vectores nuevos (no indexados).
+
+        Returns:
+            (indices, distances): np.ndarray (m, k) ordenados por distancia creciente.
+        """
+        Q = normalize_rows(queries)
+        n = self.X.shape[0]
+        k = min(k, n)
+        if not self.trees:
+            distances = 1.0 - Q @ self.X.T
+            return _top_k(np.broadcast_to(np.arange(n), distances.shape), distances, k)
+
+        candidates = []
+        for tree in self.trees:
+            node = np.zeros(len(Q), dtype=np.int64)
+            for dirs, thr in zip(tree["directions"], tree["thresholds"]):
+                proj = _rowwise_dot(Q, dirs, node)
+                node = 2 * node + (proj >= thr[node])
+            candidates.append(tree["leaves"][node])
+        cand = np.concatenate(candidates, axis=1)
+        cand_dist = np.where(cand >= 0, 1.0 - np.einsum("md,mcd->mc", Q, self.X[np.maximum(cand, 0)]), np.inf)
+        cand, cand_dist = _dedupe_rows(cand, cand_dist.astype(np.float32))
+        return _top_k(cand, cand_dist, k)
+
+    def _leaf_candidates(self, leaves, k):
+        """Top-k de cada punto entre los puntos de su hoja."""
+        X = self.X
+        n, d = X.shape
+        n_leaves, m = leaves.shape
+        kk = min(k, m - 1)
+        cand_idx = np.full((n, k), -1, dtype=np.int64)
+        cand_dist = np.full((n, k), np.inf, dtype=np.float32)
+        if kk <= 0:
+            return cand_idx, cand_dist
+
+        step = max(1, MAX_WORK_ELEMENTS // (m * max(m, d)))
+        for start in range(0, n_leaves, step):
+            idx = leaves[start:start + step]
+            valid = idx >= 0
+            V = X[np.maximum(idx, 0)]
+            dist = 1.0 - np.matmul(V, V.transpose(0, 2, 1))
+            dist[~valid[:, None, :].repeat(m, axis=1)] = np.inf
+            dist[:, np.arange(m), np.arange(m)] = np.inf
+
+            part = np.argpartition(dist, kk - 1, axis=2)[:, :, :kk]
+            part_dist = np.take_along_axis(dist, part, axis=2)
+            part_idx = np.take_along_axis(idx[:, None, :].repeat(m, axis=1), part, axis=2)
+
+            rows = idx[valid]
+            cand_idx[rows, :kk] = part_idx[valid]
+            cand_dist[rows, :kk] = part_dist[valid]
+        cand_idx[~np.isfinite(cand_dist)] = -1
+        return cand_idx, cand_dist
+
+    def _neighbors_of_neighbors(self, best_idx, k):
+        X = self.X
+        n, d = X.shape
+        width = k * k
+        step = max(1, MAX_WORK_ELEMENTS // (width * d))
+        cand_idx = np.full((n, width), -1, dtype=np.int64)
+        cand_dist = np.full((n, width), np.inf, dtype=np.float32)
+        for start in range(0, n, step):
+            end = min(start + step, n)
+            first = best_idx[start:end]
+            second = np.where(first[:, :, None] >= 0, best_idx[np.maximum(first, 0)], -1).reshape(end - start, width)
+            own = np.arange(start, end)[:, None]
+            valid = (second >= 0) & (second != own)
+            dist = 1.0 - np.einsum("cd,cwd->cw", X[start:end], X[np.maximum(second, 0)])
+            cand_idx[start:end] = np.where(valid, second, -1)
+            cand_dist[start:end] = np.where(valid, dist, np.inf)
+        return cand_idx, cand_dist
+
+
+def knn_distance_matrix(indices, distances, n=None, min_distance=1e-8):
+    """
+    Matriz dispersa CSR simétrica (n, n) con las distancias del grafo kNN.
+    Las distancias nulas (duplicados exactos) se sustituyen por `min_distance` para que no
+    desaparezcan como ceros implícitos de la matriz dispersa.
+    """
+    n = indices.shape[0] if n is None else n
+    rows = np.repeat(np.arange(indices.shape[0]), indices.shape[1])
+    cols = indices.ravel()
+    vals = np.maximum(distances.ravel().astype(np.float64), min_distance)
+    keep = (cols >= 0) & np.isfinite(vals)
+    rows, cols, vals = rows[keep], cols[keep], vals[keep]
+    graph = csr_matrix((vals, (rows, cols)), shape=(n, n))
+    # Simetrizar quedándonos con la distancia de la arista que exista en cualquier sentido
+    return graph.maximum(graph.T)
+
+
+def _rowwise_dot(X, dirs, node):
+    proj = np.empty(X.shape[0], dtype=np.float32)
+    step = max(1, MAX_WORK_ELEMENTS // max(1, X.shape[1]))
+    for start in range(0, X.shape[0], step):
+        end = start + step
+        proj[start:end] = np.einsum("ij,ij->i", X[start:end], dirs[node[start:end]])
+    return proj
+
+
+def _padded_groups(labels, n_groups):
+    """Matriz (n_groups, max_tamaño) con los índices de cada grupo, rellena con -1."""
+    order = np.argsort(labels, kind="stable")
+    counts = np.bincount(labels, minlength=n_groups)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    position = np.arange(len(labels)) - np.repeat(starts, counts)
+    groups = np.full((n_groups, max(1, counts.max())), -1, dtype=np.int64)
+    groups[labels[order], position] = order
+    return groups
+
+
+def _exact_knn(X, k):
+    n = X.shape[0]
+    indices = np.empty((n, k), dtype=np.int64)
+    distances = np.empty((n, k), dtype=np.float32)
+    step = max(1, MAX_WORK_ELEMENTS // max(1, n))
+    for start in range(0, n, step):
+        end = min(start + step, n)
+        dist = 1.0 - X[start:end] @ X.T
+        dist[np.arange(end - start), np.arange(start, end)] = np.inf
+        indices[start:end], distances[start:end] = _top_k(
+            np.broadcast_to(np.arange(n), dist.shape), dist, k
+        )
+    return indices, distances
+
+
+def _top_k(indices, distances, k):
+    part = np.argpartition(distances, k - 1, axis=1)[:, :k] if k < distances.shape[1] else \
+        np.broadcast_to(np.arange(distances.shape[1]), distances.shape)
+    return _sort_rows(np.take_along_axis(indices, part, axis=1), np.take_along_axis(distances, part, axis=1))
+
+
+def _sort_rows(indices, distances):
+    order = np.argsort(distances, axis=1, kind="stable")
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(distances, order, axis=1)
+
+
+def _dedupe_rows(indices, distances):
+    """Marca como inválidas (-1, inf) las repeticiones de un mismo índice dentro de cada fila."""
+    order = np.argsort(indices, axis=1, kind="stable")
+    sorted_idx = np.take_along_axis(indices, order, axis=1)
+    duplicate = np.zeros_like(sorted_idx, dtype=bool)
+    duplicate[:, 1:] = sorted_idx[:, 1:] == sorted_idx[:, :-1]
+    duplicate_mask = np.empty_like(duplicate)
+    np.put_along_axis(duplicate_mask, order, duplicate, axis=1)
+    return np.where(duplicate_mask, -1, indices), np.where(duplicate_mask, np.inf, distances)
+
+
+def _merge_candidates(best_idx, best_dist, cand_idx, cand_dist, k):
+    indices, distances = _dedupe_rows(
+        np.concatenate([best_idx, cand_idx], axis=1),
+        np.concatenate([best_dist, cand_dist], axis=1)
+    )
+    distances = np.where(indices >= 0, distances, np.inf).astype(np.float32)
+    part = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(indices, part, axis=1), np.take_along_axis(distances, part, axis=1)
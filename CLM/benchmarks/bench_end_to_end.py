@@ -0,0 +1,247 @@
+"""
+Benchmark de extremo a extremo sin red: el pipeline de generate_kg_main, las consultas de
+run_query.run y el lambda_handler de la anonimización, con los clientes deterministas de
+local_clients.py en lugar de OpenAI y Bedrock.
+
+Cada repetición se mide con instrumentation.py; al final se muestran, por etapa, la
+latencia p50/p95/p99 y el throughput (párrafos, consultas o peticiones por segundo).
+
+Uso:
+    python benchmarks/bench_end_to_end.py --paragraphs 400 --repeats 5 --queries 20 --lambda-requests 20
+    python benchmarks/bench_end_to_end.py --latency 0.05 --jitter 0.02 --failure-rate 0.02
+    python benchmarks/bench_end_to_end.py --json resultados.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import contextlib
+import numpy as np
+
+CLM_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CLM_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(CLM_DIR), "Anonimizacion"))
+
+import instrumentation  # noqa: E402
+from local_clients import LocalOpenAIClient, LocalBedrockClient  # noqa: E402
+from pipeline_runner import PipelineRunner  # noqa: E402
+import generate_kg_main as kg_main  # noqa: E402
+
+TOPICS = [
+    ("payment", "The Owner shall pay the Contract Price in instalments against each approved invoice within {n} days."),
+    ("delay", "If the Contractor fails to achieve Substantial Completion, delay liquidated damages accrue at {p}% per week."),
+    ("force majeure", "Neither Party is liable for delay caused by a Force Majeure Event notified within {n} days."),
+    ("warranty", "The Contractor warrants the Works free from defects for {n} months after Final Acceptance."),
+    ("termination", "The Owner may terminate the Agreement upon {n} days written notice for Contractor default."),
+    ("insurance", "The Contractor shall maintain all-risk insurance for not less than {p}% of the Contract Price."),
+    ("permits", "The Contractor shall obtain all permits required for the Works within {n} days of the Effective Date."),
+    ("performance", "Performance tests shall demonstrate output of at least {p}% of the Guaranteed Capacity."),
+]
+QUERY_TEMPLATES = [
+    "When do delay liquidated damages start accruing?",
+    "What is the deadline to notify a Force Majeure Event?",
+    "When must the Owner pay each invoice?",
+    "How long is the defects warranty period?",
+    "What notice is required to terminate for Contractor default?",
+    "When must the Contractor obtain the permits?",
+]
+EVENT_PROMPT = "Context:\n{{ context }}\n\nNotice to proceed: {{ notice_date }}\nQuestion: {{ query }}\nReturn the events as JSON."
+
+
+def synthetic_contract(n_paragraphs, seed=0):
+    """Párrafos de contrato EPC sintéticos (un tema por párrafo, con números de cláusula)."""
+    rng = random.Random(seed)
+    lines = []
+    for k in range(n_paragraphs):
+        topic, template = TOPICS[rng.randrange(len(TOPICS))]
+        lines.append(f"Clause {k // 10 + 1}.{k % 10 + 1} ({topic}). "
+                     + template.format(n=rng.choice([5, 10, 14, 28, 30, 60]), p=rng.choice([0.5, 1, 5, 10, 95])))
+    return "\n".join(lines)
+
+
+def synthetic_personal_document(n_paragraphs, seed=0):
+    """Documento con datos personales y contextuales para la Lambda (párrafos separados por \\r)."""
+    rng = random.Random(seed)
+    names = ["Juan García López", "María Fernández Ruiz", "Pedro Martín Gil", "Lucía Sánchez Mora"]
+    paragraphs = []
+    for k in range(n_paragraphs):
+        paragraphs.append(
+            f"D. {rng.choice(names)}, con DNI {rng.randrange(10**7, 10**8)}Z, domiciliado en Calle Mayor {k + 1}, "
+            f"C.P. 280{k % 90 + 10} Madrid, teléfono 6{rng.randrange(10**7, 10**8)}, "
+            f"email usuario{k}@example.com, adquiere el {rng.choice([5, 10, 25])}% de Ejemplo {k % 7} S.L. "
+            f"por 1.{rng.randrange(100, 999)}.000 € el 1{k % 9}/0{k % 9 + 1}/2023."
+        )
+    return "\r".join(paragraphs)
+
+
+def percentiles(values):
+    values = np.asarray(values, dtype=np.float64)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"n": len(values), "mean": float(values.mean()), "p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    """Silencia los print y barras de tqdm de las etapas medidas."""
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        yield
+
+
+def bench_pipeline(workdir, contract_path, client, repeats, verbose=False):
+    """Ejecuta todas las etapas de generate_kg_main `repeats` veces, sin cachés. Devuelve las rutas de la última."""
+    paths = None
+    for r in range(repeats):
+        paths = kg_main.artifact_paths(os.path.join(workdir, "pipeline"), contract_path)
+        shutil.rmtree(paths["base"], ignore_errors=True)
+        os.makedirs(paths["base"])
+        runner = PipelineRunner(kg_main.build_stages(paths), paths["state"])
+        ctx = {"client": client, "paths": paths, "embedding_cache": False, "label_cache": False, "relation_cache": False}
+        with quiet(not verbose), instrumentation.stage("pipeline", repeat=r):
+            runner.run(force=True, ctx=ctx)
+    return paths
+
+
+def bench_queries(paths, client, n_queries, prompt_path, verbose=False):
+    import run_query
+    from retriever import HybridRetriever
+
+    with quiet(not verbose), instrumentation.stage("load_retriever"):
+        retriever = HybridRetriever(client, base_path=paths["base"], cache=False)
+    failures = 0
+    for k in range(n_queries):
+        query = QUERY_TEMPLATES[k % len(QUERY_TEMPLATES)]
+        # Un fallo del servicio (p. ej. con --failure-rate) cuenta como consulta fallida y no corta la serie
+        try:
+            with quiet(not verbose), instrumentation.stage("query", index=k):
+                run_query.run(query, client=client, retriever=retriever, prompt_path=prompt_path)
+        except Exception as e:
+            failures += 1
+            if verbose:
+                print(f"Query {k} failed: {type(e).__name__}: {e}")
+    return failures
+
+
+def bench_lambda(bedrock, n_requests, paragraphs, verbose=False):
+    import lambfa_function
+
+    lambfa_function.set_bedrock_client(bedrock)
+    document = synthetic_personal_document(paragraphs)
+    failures = 0
+    for k in range(n_requests):
+        function, texto = ("claudia", f"Resume la cláusula {k}") if k % 5 == 4 else ("detectSensitiveData", document)
+        event = {"body": json.dumps({"function": function, "texto": texto})}
+        try:
+            with quiet(not verbose), instrumentation.stage(f"lambda:{function}", index=k):
+                response = lambfa_function.lambda_handler(event, None)
+                if response["statusCode"] != 200:
+                    # Se marca la etapa como fallida para que cuente en la tasa de error
+                    raise RuntimeError(f"status {response['statusCode']}")
+        except Exception as e:
+            failures += 1
+            if verbose:
+                print(f"Lambda request {k} failed: {type(e).__name__}: {e}")
+    return failures
+
+
+def summarize(report, units):
+    """
+    Percentiles, throughput y tasa de error (ejecuciones que terminaron con excepción) por
+    nombre de etapa. Los percentiles incluyen las ejecuciones fallidas.
+    `units`: etapa → (elementos procesados por ejecución, unidad); por defecto (1, "runs/s").
+    """
+    walls, errors = {}, {}
+    for s in report["stages"]:
+        walls.setdefault(s["name"], []).append(s["wall_seconds"])
+        errors[s["name"]] = errors.get(s["name"], 0) + (s.get("status", "ok") != "ok")
+    summary = {}
+    for name, values in walls.items():
+        stats = percentiles(values)
+        stats["errors"] = errors[name]
+        stats["error_rate"] = errors[name] / len(values)
+        items, unit = units.get(name, (1, "runs/s"))
+        stats["throughput"] = items * len(values) / sum(values) if sum(values) > 0 else None
+        stats["unit"] = unit
+        summary[name] = stats
+    return summary
+
+
+def print_summary(summary):
+    print(f"{'stage':28s} {'n':>4s} {'mean s':>9s} {'p50 s':>9s} {'p95 s':>9s} {'p99 s':>9s} {'errors':>7s} "
+          f"{'throughput':>16s}")
+    for name, s in summary.items():
+        throughput = f"{s['throughput']:.1f} {s['unit']}" if s["throughput"] else "-"
+        print(f"{name:28s} {s['n']:4d} {s['mean']:9.4f} {s['p50']:9.4f} {s['p95']:9.4f} {s['p99']:9.4f} "
+              f"{s['error_rate']:6.1%} {throughput:>16s}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--paragraphs", type=int, default=400, help="párrafos del contrato sintético")
+    parser.add_argument("--repeats", type=int, default=3, help="repeticiones del pipeline completo")
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--lambda-requests", type=int, default=20)
+    parser.add_argument("--lambda-paragraphs", type=int, default=100, help="párrafos por documento de la Lambda")
+    parser.add_argument("--latency", type=float, default=0.0, help="latencia simulada por llamada (s)")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="probabilidad de fallo por llamada")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="guarda el resumen y el informe de instrumentación en este fichero")
+    parser.add_argument("--verbose", action="store_true", help="no silencia la salida de las etapas")
+    args = parser.parse_args(argv)
+
+    client_args = dict(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate, seed=args.seed)
+    recorder = instrumentation.enable("bench_end_to_end")
+    client = instrumentation.instrument_client(LocalOpenAIClient(**client_args))
+    bedrock = LocalBedrockClient(**client_args)
+
+    workdir = tempfile.mkdtemp(prefix="clm_bench_")
+    try:
+        contract_path = os.path.join(workdir, "contract.txt")
+        with open(contract_path, "w", encoding="utf-8") as f:
+            f.write(synthetic_contract(args.paragraphs, args.seed))
+        prompt_path = os.path.join(workdir, "generate_event_prompt.txt")
+        with open(prompt_path, "w", encoding="utf-8") as f:
+            f.write(EVENT_PROMPT)
+
+        start = time.perf_counter()
+        paths = bench_pipeline(workdir, contract_path, client, args.repeats, args.verbose)
+        query_failures = bench_queries(paths, client, args.queries, prompt_path, args.verbose) if args.queries else 0
+        lambda_failures = bench_lambda(bedrock, args.lambda_requests, args.lambda_paragraphs, args.verbose) \
+            if args.lambda_requests else 0
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        instrumentation.disable()
+
+    report = recorder.report()
+    pipeline_stages = [stage.name for stage in kg_main.build_stages()] + ["pipeline"]
+    units = {name: (args.paragraphs, "paragraphs/s") for name in pipeline_stages}
+    units.update({"query": (1, "queries/s"), "lambda:detectSensitiveData": (1, "requests/s"),
+                  "lambda:claudia": (1, "requests/s")})
+    summary = summarize(report, units)
+    print(f"\n{args.paragraphs} paragraphs x {args.repeats} repeats, {args.queries} queries, "
+          f"{args.lambda_requests} lambda requests in {elapsed:.1f}s "
+          f"(latency {args.latency}s ± {args.jitter}s, failure rate {args.failure_rate})\n")
+    print_summary(summary)
+    print(f"\nOpenAI stand-in: {client.client.stats()}  Bedrock stand-in: {bedrock.stats()}  "
+          f"failed queries: {query_failures}  lambda failures: {lambda_failures}")
+    for key, m in report["models"].items():
+        print(f"  {key}: {m['calls']} calls, p50 {m['latency_p50']:.4f}s, p95 {m['latency_p95']:.4f}s, "
+              f"{m['input_tokens']} tokens in")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "summary": summary, "report": report}, f, ensure_ascii=False, indent=2)
+        print(f"Resultados guardados en '{args.json}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark del agrupamiento: backend denso (matriz n×n) frente a backend kNN aproximado.
+
+Genera embeddings sintéticos con clusters conocidos, ejecuta cluster_labels con ambos
+backends y compara el acuerdo entre particiones (ARI / AMI) y el tiempo de pared.
+
+Uso:
+    python benchmarks/bench_knn_clustering.py --sizes 1000 5000 10000 --dim 256
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from sklearn.metrics import adjusted_rand_score, adjusted_mutual_info_score
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generate_semantic_groups import cluster_labels  # noqa: E402
+from distance_engine import clear_distance_cache  # noqa: E402
+
+
+def synthetic_embeddings(n, dim, n_topics, noise=0.35, outlier_ratio=0.05, seed=0):
+    """Embeddings normalizados alrededor de `n_topics` centros más un porcentaje de outliers."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_topics, dim)).astype(np.float32)
+    topics = rng.integers(0, n_topics, n)
+    X = centers[topics] + noise * rng.standard_normal((n, dim)).astype(np.float32)
+    outliers = rng.random(n) < outlier_ratio
+    X[outliers] = rng.standard_normal((outliers.sum(), dim)).astype(np.float32)
+    topics[outliers] = -1
+    X /= np.linalg.norm(X, axis=1, keepdims=True)
+    return X, topics
+
+
+def run_backend(X, backend, **kwargs):
+    clear_distance_cache()
+    start = time.perf_counter()
+    labels, _ = cluster_labels(X, backend=backend, **kwargs)
+    return labels, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 10000])
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--chunks-per-topic", type=int, default=25)
+    parser.add_argument("--n-neighbors", type=int, default=15)
+    parser.add_argument("--min-cluster-size", type=int, default=2)
+    parser.add_argument("--min-samples", type=int, default=1)
+    parser.add_argument("--skip-dense-above", type=int, default=30000,
+                        help="no ejecutar el backend denso por encima de este tamaño (memoria O(n²))")
+    args = parser.parse_args()
+
+    header = f"{'n':>8} {'dense_s':>9} {'knn_s':>9} {'speedup':>8} {'ARI':>6} {'AMI':>6} {'clusters d/k':>14} {'ARI_truth d/k':>14}"
+    print(header)
+    print("-" * len(header))
+    for n in args.sizes:
+        X, truth = synthetic_embeddings(n, args.dim, max(2, n // args.chunks_per_topic))
+        params = dict(min_cluster_size=args.min_cluster_size, min_samples=args.min_samples)
+
+        knn_labels, knn_time = run_backend(X, "knn", n_neighbors=args.n_neighbors, **params)
+        n_knn = len(set(knn_labels)) - (1 if -1 in knn_labels else 0)
+        truth_knn = adjusted_rand_score(truth, knn_labels)
+
+        if n > args.skip_dense_above:
+            print(f"{n:>8} {'-':>9} {knn_time:>9.2f} {'-':>8} {'-':>6} {'-':>6} {'-':>6}/{n_knn:<7} {'-':>6}/{truth_knn:<7.3f}")
+            continue
+
+        dense_labels, dense_time = run_backend(X, "dense", **params)
+        n_dense = len(set(dense_labels)) - (1 if -1 in dense_labels else 0)
+        print(
+            f"{n:>8} {dense_time:>9.2f} {knn_time:>9.2f} {dense_time / knn_time:>7.1f}x "
+            f"{adjusted_rand_score(dense_labels, knn_labels):>6.3f} "
+            f"{adjusted_mutual_info_score(dense_labels, knn_labels):>6.3f} "
+            f"{n_dense:>6}/{n_knn:<7} {adjusted_rand_score(truth, dense_labels):>6.3f}/{truth_knn:<7.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Benchmark de escalado: cada etapa del pipeline sobre corpus sintéticos de tamaño creciente
+(por defecto 1k, 10k, 100k y 1M chunks, ver synthetic_corpus.py), sin red gracias a
+LocalOpenAIClient.
+
+Por tamaño y etapa se mide el tiempo de pared y el pico de memoria (instrumentation.py).
+Entre tamaños consecutivos se calcula el exponente empírico log(t2/t1) / log(n2/n1):
+~1 es lineal, ~2 cuadrático; las etapas por encima de --warn-exponent se marcan.
+
+Las etapas cuadráticas por diseño (distancias exactas, HDBSCAN sobre la matriz densa)
+tienen un tamaño máximo configurable con --max-n etapa=n; por encima se omiten.
+Con matplotlib instalado se guardan las gráficas log-log de tiempo y memoria.
+
+Uso:
+    python benchmarks/bench_scaling.py --sizes 1000 10000 --json escalado.json
+    python benchmarks/bench_scaling.py --max-n distances=1000000 --plot escalado
+"""
+import os
+import sys
+import json
+import math
+import shutil
+import argparse
+import tempfile
+
+CLM_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CLM_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import instrumentation  # noqa: E402
+import synthetic_corpus  # noqa: E402
+import generate_kg_main as kg_main  # noqa: E402
+from local_clients import LocalOpenAIClient  # noqa: E402
+from embedding_store import load_embedding_store  # noqa: E402
+from distance_engine import clear_distance_cache  # noqa: E402
+from generate_semantic_groups import calculate_distances, agrupamiento_semantico  # noqa: E402
+from naming_semantic_groups import generate_titles  # noqa: E402
+from generate_meta_labels import construir_meta_etiqueta  # noqa: E402
+from generate_relations import definir_relaciones  # noqa: E402
+from kg_graph import build_knowledge_graph  # noqa: E402
+from retriever_index import build_retriever_index  # noqa: E402
+from bench_end_to_end import QUERY_TEMPLATES, quiet  # noqa: E402
+
+try:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+except ImportError:
+    plt = None
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+STAGES = ["generate", "load", "distances", "clustering_dense", "clustering_knn", "naming", "meta_labels",
+          "relations", "graph", "index", "retriever_load", "retriever_query"]
+# Tamaño máximo por etapa (None = sin límite)
+DEFAULT_MAX_N = {"distances": 100_000, "clustering_dense": 10_000}
+
+
+def run_size(n, workdir, client, args, max_n):
+    """Ejecuta todas las etapas para un corpus de `n` chunks; devuelve las etapas omitidas."""
+    base = os.path.join(workdir, f"n{n}")
+    paths = kg_main.artifact_paths(base, os.path.join(base, "contract.txt"))
+    skipped = [name for name in STAGES if max_n.get(name) is not None and n > max_n[name]]
+    ctx = {}
+
+    def stage(name, fn):
+        if name in skipped:
+            return
+        with quiet(not args.verbose), instrumentation.stage(name, n=n):
+            fn()
+
+    def generate():
+        synthetic_corpus.generate_corpus(n, base, n_topics=args.topics and max(2, n // args.topics),
+                                         dim=args.dim, seed=args.seed)
+
+    def load():
+        store = load_embedding_store(paths["embeddings"])
+        ctx["embeddings"] = store.matrix
+        ctx["buffer"] = list(store.texts)
+
+    def clustering(backend, save_path):
+        clear_distance_cache()
+        _, _, ctx["neighbor_groups"] = agrupamiento_semantico(
+            ctx["embeddings"], ctx["buffer"], min_cluster_size=kg_main.MIN_CLUSTER_SIZE,
+            min_samples=kg_main.MIN_SAMPLES, save_path=save_path, backend=backend)
+        clear_distance_cache()
+
+    def naming():
+        ctx["group_labels"] = generate_titles(
+            ctx["neighbor_groups"], client, ctx["buffer"], model=kg_main.NAMING_MODEL,
+            semantic_groups_path=paths["semantic_groups"], batch_token_budget=kg_main.NAMING_BATCH_TOKENS,
+            label_cache=False, journal=False)
+
+    def meta_labels():
+        ctx["meta_labels"] = construir_meta_etiqueta(ctx["buffer"], ctx["embeddings"], ctx["group_labels"],
+                                                     save_path=paths["meta_labels"])
+
+    def relations():
+        definir_relaciones(
+            ctx["meta_labels"], ctx["embeddings"], ctx["buffer"], client, output_file=paths["relations"],
+            similarity_threshold=kg_main.SIMILARITY_THRESHOLD,
+            batch_token_budget=kg_main.RELATIONS_BATCH_TOKENS, top_k_neighbors=kg_main.RELATIONS_TOP_K,
+            relation_cache=False, journal=False)
+
+    def retriever_load():
+        from retriever import HybridRetriever
+        ctx["retriever"] = HybridRetriever(client, base_path=base, cache=False)
+
+    def retriever_query():
+        for k in range(args.queries):
+            ctx["retriever"].retrieve_context(QUERY_TEMPLATES[k % len(QUERY_TEMPLATES)])
+
+    stage("generate", generate)
+    stage("load", load)
+    stage("distances", lambda: calculate_distances(ctx["embeddings"], ctx["buffer"], save_path=paths["distances"],
+                                                   top_k=kg_main.NEIGHBORS_PER_CHUNK))
+    stage("clustering_dense", lambda: clustering("dense", os.path.join(base, "semantic_groups_dense.json")))
+    # El resto del pipeline sigue con los grupos del backend kNN, el único que llega a 1M
+    stage("clustering_knn", lambda: clustering("knn", paths["semantic_groups"]))
+    stage("naming", naming)
+    stage("meta_labels", meta_labels)
+    stage("relations", relations)
+    stage("graph", lambda: build_knowledge_graph(paths["relations"], paths["meta_labels"], paths["semantic_groups"],
+                                                 save_path=paths["kg_graph"]))
+    stage("index", lambda: build_retriever_index(base, save_path=paths["retriever_index"]))
+    stage("retriever_load", retriever_load)
+    stage("retriever_query", retriever_query)
+    ctx.clear()
+    if not args.keep:
+        shutil.rmtree(base, ignore_errors=True)
+    return skipped
+
+
+def scaling_table(report):
+    """etapa → {n: {"wall_seconds", "peak_rss_mb"}} a partir de las etapas del informe."""
+    table = {}
+    for s in report["stages"]:
+        if s["name"] in STAGES:
+            table.setdefault(s["name"], {})[s["n"]] = {"wall_seconds": s["wall_seconds"],
+                                                     "peak_rss_mb": s.get("peak_rss_mb")}
+    return table
+
+
+def exponents(points, min_seconds=0.05):
+    """Exponente empírico entre tamaños consecutivos; None si algún tiempo es demasiado pequeño para medirlo."""
+    sizes = sorted(points)
+    result = {}
+    for n1, n2 in zip(sizes, sizes[1:]):
+        t1, t2 = points[n1]["wall_seconds"], points[n2]["wall_seconds"]
+        result[n2] = round(math.log(t2 / t1) / math.log(n2 / n1), 2) if min(t1, t2) >= min_seconds else None
+    return result
+
+
+def print_table(table, sizes, warn_exponent):
+    print(f"{'stage':18s}" + "".join(f"{n:>22,d}" for n in sizes))
+    warnings = []
+    for name in STAGES:
+        points = table.get(name, {})
+        slopes = exponents(points)
+        cells = []
+        for n in sizes:
+            if n not in points:
+                cells.append(f"{'-':>22s}")
+                continue
+            p, slope = points[n], slopes.get(n)
+            rss = f"{p['peak_rss_mb']:.0f}MB" if p["peak_rss_mb"] is not None else "?"
+            mark = f" ^{slope:.1f}" if slope is not None else ""
+            if slope is not None and slope >= warn_exponent:
+                mark += "!"
+                warnings.append((name, n, slope))
+            cells.append(f"{p['wall_seconds']:9.2f}s {rss:>6s}{mark:>6s}")
+        print(f"{name:18s}" + "".join(f"{c:>22s}" for c in cells))
+    print("\n^x = exponente empírico respecto al tamaño anterior (1 lineal, 2 cuadrático)")
+    for name, n, slope in warnings:
+        print(f"  AVISO: '{name}' crece como n^{slope} hasta n={n:,}")
+    return warnings
+
+
+def plot(table, prefix):
+    """Gráficas log-log de tiempo y pico de memoria por etapa (`<prefix>_time.png`, `<prefix>_memory.png`)."""
+    if plt is None:
+        print("matplotlib no está instalado: se omiten las gráficas")
+        return []
+    saved = []
+    for metric, ylabel, suffix in (("wall_seconds", "tiempo (s)", "time"), ("peak_rss_mb", "pico de memoria (MB)", "memory")):
+        fig, ax = plt.subplots(figsize=(8, 5))
+        for name in STAGES:
+            points = sorted((n, p[metric]) for n, p in table.get(name, {}).items() if p[metric])
+            if points:
+                ax.plot(*zip(*points), marker="o", label=name)
+        ax.set_xscale("log")
+        ax.set_yscale("log")
+        ax.set_xlabel("chunks")
+        ax.set_ylabel(ylabel)
+        ax.grid(True, which="both", alpha=0.3)
+        ax.legend(fontsize=8)
+        path = f"{prefix}_{suffix}.png"
+        fig.savefig(path, dpi=120, bbox_inches="tight")
+        plt.close(fig)
+        saved.append(path)
+    print(f"Gráficas guardadas: {', '.join(saved)}")
+    return saved
+
+
+def parse_max_n(values):
+    max_n = dict(DEFAULT_MAX_N)
+    for value in values or []:
+        name, _, n = value.partition("=")
+        if name not in STAGES:
+            raise SystemExit(f"Etapa desconocida '{name}' (disponibles: {', '.join(STAGES)})")
+        max_n[name] = int(n) if n and n.lower() != "none" else None
+    return max_n
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--dim", type=int, default=synthetic_corpus.DEFAULT_DIM)
+    parser.add_argument("--topics", type=int, default=synthetic_corpus.CHUNKS_PER_TOPIC, help="chunks por tema")
+    parser.add_argument("--queries", type=int, default=20, help="consultas del retriever por tamaño")
+    parser.add_argument("--max-n", action="append", metavar="ETAPA=N",
+                        help=f"tamaño máximo de una etapa (por defecto {DEFAULT_MAX_N}; N=none sin límite)")
+    parser.add_argument("--warn-exponent", type=float, default=1.6)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="directorio de los corpus (por defecto uno temporal)")
+    parser.add_argument("--keep", action="store_true", help="conserva los corpus generados")
+    parser.add_argument("--json", help="guarda la tabla de escalado y el informe en este fichero")
+    parser.add_argument("--plot", help="prefijo de las gráficas (p. ej. 'escalado' → escalado_time.png)")
+    parser.add_argument("--verbose", action="store_true", help="no silencia la salida de las etapas")
+    args = parser.parse_args(argv)
+    max_n = parse_max_n(args.max_n)
+    sizes = sorted(args.sizes)
+
+    recorder = instrumentation.enable("bench_scaling")
+    client = LocalOpenAIClient(dim=args.dim, seed=args.seed)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="clm_scaling_")
+    skipped = {}
+    try:
+        for n in sizes:
+            print(f"Corpus de {n:,} chunks...", flush=True)
+            skipped[n] = run_size(n, workdir, client, args, max_n)
+    finally:
+        instrumentation.disable()
+        if not args.workdir and not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = recorder.report()
+    table = scaling_table(report)
+    print()
+    warnings = print_table(table, sizes, args.warn_exponent)
+    for n, names in skipped.items():
+        if names:
+            print(f"  n={n:,}: omitidas {', '.join(names)} (--max-n)")
+    if args.plot:
+        plot(table, args.plot)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "max_n": max_n, "table": table,
+                       "exponents": {name: exponents(points) for name, points in table.items()},
+                       "warnings": warnings, "report": report}, f, ensure_ascii=False, indent=2, default=str)
+        print(f"Resultados guardados en '{args.json}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""
+Construcción de un corpus de contratos: ejecuta el pipeline de generate_kg_main.py para
+cada contrato de un directorio o de un manifiesto, con un directorio de artefactos propio
+por contrato (models/corpus/<contrato>/).
+
+- Varios contratos avanzan a la vez, cada uno en su hilo y con su PipelineRunner, así que
+  un contrato ya construido se salta y uno interrumpido reanuda donde se quedó.
+- Las etapas de CPU (chunking, agrupamiento, distancias y layout del grafo) se mandan a un
+  pool de procesos compartido, que se recrea si muere un worker (ver CpuPool).
+- Todas las llamadas al LLM y a la API de embeddings pasan por un único RateLimitedClient,
+  y las cachés de embeddings, etiquetas y relaciones se comparten entre contratos.
+- El fallo de un contrato se registra y no detiene a los demás; el resumen queda en
+  models/corpus/corpus_report.json.
+
+Uso:
+    python corpus_build.py contratos/                      # todos los .txt del directorio
+    python corpus_build.py manifest.json --contracts 8     # lista de contratos (JSON o txt)
+    python corpus_build.py contratos/ --from-stage relations
+    python corpus_build.py contratos/ --status
+
+El manifiesto es una lista JSON de rutas o de objetos {"path": ..., "name": ...}, o un .txt
+con una ruta por línea. Las rutas relativas se resuelven desde el manifiesto.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+import traceback
+import unicodedata
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+from dotenv import load_dotenv
+from openai import OpenAI
+
+import generate_kg_main as kg_main
+from pipeline_runner import PipelineRunner
+from label_cache import resolve_label_cache
+from relation_cache import resolve_relation_cache
+from rate_limit import RateLimitedClient
+import instrumentation
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CORPUS_DIR = os.path.join(BASE_DIR, "models", "corpus")
+REPORT_FILE = "corpus_report.json"
+CONTRACTS_IN_FLIGHT = 4  # contratos en curso a la vez (sus llamadas comparten el rate limit)
+CPU_PROCESSES = max(1, (os.cpu_count() or 2) - 1)
+
+
+def slugify(name):
+    """Nombre de directorio seguro para un contrato ("Contrato Nº 7.txt" → "contrato_no_7")."""
+    name = unicodedata.normalize("NFKD", os.path.splitext(os.path.basename(name))[0])
+    name = name.encode("ascii", "ignore").decode("ascii").lower()
+    return re.sub(r"[^a-z0-9]+", "_", name).strip("_") or "contrato"
+
+
+def discover_contracts(source):
+    """
+    Contratos de un directorio (sus .txt, en orden alfabético) o de un manifiesto.
+
+    Returns:
+        lista de {"name": slug único, "path": ruta absoluta}
+    """
+    source = os.path.abspath(source)
+    if os.path.isdir(source):
+        entries = [{"path": os.path.join(source, f)} for f in sorted(os.listdir(source)) if f.lower().endswith(".txt")]
+    else:
+        root = os.path.dirname(source)
+        with open(source, "r", encoding="utf-8") as f:
+            if source.lower().endswith(".json"):
+                data = json.load(f)
+                data = data.get("contracts", []) if isinstance(data, dict) else data
+                entries = [item if isinstance(item, dict) else {"path": item} for item in data]
+            else:
+                entries = [{"path": line.strip()} for line in f if line.strip() and not line.lstrip().startswith("#")]
+        for entry in entries:
+            entry["path"] = os.path.normpath(os.path.join(root, entry["path"]))
+
+    contracts, used = [], set()
+    for entry in entries:
+        slug = base = slugify(entry.get("name") or entry["path"])
+        n = 2
+        while slug in used:
+            slug, n = f"{base}_{n}", n + 1
+        used.add(slug)
+        contracts.append({"name": slug, "path": entry["path"]})
+    return contracts
+
+
+class CorpusProgress:
+    """Estado de cada contrato (pendiente / en curso / ok / fallido) con un resumen por línea."""
+
+    def __init__(self, contracts):
+        self.total = len(contracts)
+        self.status = {c["name"]: "pendiente" for c in contracts}
+        self._lock = threading.Lock()
+
+    def update(self, name, status, detail=""):
+        with self._lock:
+            self.status[name] = status
+            counts = {s: list(self.status.values()).count(s) for s in ("ok", "fallido", "en curso")}
+            print(f"[corpus {counts['ok'] + counts['fallido']}/{self.total} | {counts['en curso']} en curso | "
+                  f"{counts['fallido']} fallidos] {name}: {status}{' - ' + detail if detail else ''}")
+
+
+class CpuPool:
+    """
+    Pool de procesos compartido por los contratos que se recrea si un worker muere.
+
+    Un worker caído (p. ej. el sistema lo mata por memoria en un contrato grande) rompe el
+    ProcessPoolExecutor y, sin recrearlo, todas las tareas siguientes de todos los contratos
+    fallarían con BrokenProcessPool. Las tareas que estaban en curso se reintentan una vez,
+    cada una en un proceso propio: la que mató al worker solo puede romper su reintento, y el
+    error llega solo a su contrato.
+    """
+
+    def __init__(self, processes):
+        self.processes = processes
+        self._lock = threading.Lock()
+        self._pool = self._new_pool(processes)
+
+    @staticmethod
+    def _new_pool(processes):
+        # spawn: los procesos no heredan los hilos ni los locks del proceso principal
+        return concurrent.futures.ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"))
+
+    def _replace(self, broken):
+        with self._lock:
+            # Solo el primer hilo que ve el pool roto lo sustituye
+            if self._pool is broken:
+                print("CPU process pool broken (a worker died); starting a new one")
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._pool = self._new_pool(self.processes)
+
+    def run(self, fn, *args):
+        """Ejecuta fn(*args) en un proceso del pool y devuelve su resultado."""
+        pool = self._pool
+        try:
+            return pool.submit(fn, *args).result()
+        except BrokenProcessPool:
+            self._replace(pool)
+        with self._new_pool(1) as isolated:
+            return isolated.submit(fn, *args).result()
+
+    def shutdown(self):
+        with self._lock:
+            self._pool.shutdown()
+
+
+def build_contract(contract, corpus_dir, shared_ctx, from_stage=None, force=False):
+    """
+    Ejecuta el pipeline de un contrato en su directorio. No lanza excepciones: devuelve
+    el registro del informe con "status" = "ok" o "fallido".
+    """
+    paths = kg_main.artifact_paths(os.path.join(corpus_dir, contract["name"]), contract["path"])
+    record = {"name": contract["name"], "path": contract["path"], "namespace": paths["base"]}
+    start = time.time()
+    try:
+        os.makedirs(paths["base"], exist_ok=True)
+        runner = PipelineRunner(kg_main.build_stages(paths), paths["state"], name=f"[{contract['name']}]")
+        runner.run(from_stage=from_stage, force=force, ctx={**shared_ctx, "paths": paths})
+        record["status"] = "ok"
+        record["stages"] = {name: s["seconds"] for name, s in runner.state["stages"].items()}
+    except Exception as e:
+        record["status"] = "fallido"
+        record["error"] = f"{type(e).__name__}: {e}"
+        record["traceback"] = traceback.format_exc()
+    record["seconds"] = round(time.time() - start, 3)
+    return record
+
+
+def build_corpus(source, client, corpus_dir=CORPUS_DIR, contracts_in_flight=CONTRACTS_IN_FLIGHT,
+                 processes=CPU_PROCESSES, from_stage=None, force=False, rate_limits=None,
+                 label_cache=None, relation_cache=None):
+    """
+    Construye (o pone al día) los artefactos de todos los contratos de `source`.
+
+    Args:
+        source: directorio con los .txt o manifiesto de contratos
+        client: cliente OpenAI; se envuelve en un RateLimitedClient compartido
+        contracts_in_flight: contratos procesados a la vez
+        processes: procesos del pool de CPU (0 = todo en el proceso principal)
+        rate_limits: límites por endpoint para RateLimitedClient (None = DEFAULT_LIMITS)
+        label_cache, relation_cache: cachés compartidas (None = las de models/, False = sin caché)
+
+    Returns:
+        dict con el informe (también se guarda en <corpus_dir>/corpus_report.json)
+    """
+    contracts = discover_contracts(source)
+    if not contracts:
+        print(f"No contracts found in '{source}'")
+        return {"contracts": []}
+    print(f"Building {len(contracts)} contracts into '{corpus_dir}' "
+          f"({contracts_in_flight} in flight, {processes} CPU processes)")
+
+    # El rate limit va por fuera: la latencia registrada no incluye la espera por presupuesto
+    limited_client = RateLimitedClient(instrumentation.instrument_client(client), rate_limits)
+    shared_ctx = {
+        "client": limited_client,
+        "label_cache": resolve_label_cache(label_cache) or False,
+        "relation_cache": resolve_relation_cache(relation_cache) or False,
+    }
+    progress = CorpusProgress(contracts)
+    started_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+    start = time.time()
+
+    pool = None
+    if processes:
+        pool = CpuPool(processes)
+        shared_ctx["process_pool"] = pool
+
+    def run_one(contract):
+        progress.update(contract["name"], "en curso")
+        record = build_contract(contract, corpus_dir, shared_ctx, from_stage=from_stage, force=force)
+        progress.update(contract["name"], record["status"], record.get("error", f"{record['seconds']:.1f}s"))
+        return record
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=contracts_in_flight) as executor:
+            records = list(executor.map(run_one, contracts))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    report = {
+        "started_at": started_at,
+        "seconds": round(time.time() - start, 3),
+        "ok": sum(r["status"] == "ok" for r in records),
+        "failed": sum(r["status"] == "fallido" for r in records),
+        "api": limited_client.stats(),
+        "contracts": records,
+    }
+    _save_report(report, os.path.join(corpus_dir, REPORT_FILE))
+    print(f"\nCorpus: {report['ok']} ok, {report['failed']} fallidos en {report['seconds']:.1f}s")
+    for record in records:
+        if record["status"] != "ok":
+            print(f"  ✗ {record['name']}: {record['error']}")
+    return report
+
+
+def corpus_status(source, corpus_dir=CORPUS_DIR):
+    """Dict contrato → {etapa: al día} sin ejecutar nada."""
+    status = {}
+    for contract in discover_contracts(source):
+        paths = kg_main.artifact_paths(os.path.join(corpus_dir, contract["name"]), contract["path"])
+        status[contract["name"]] = PipelineRunner(kg_main.build_stages(paths), paths["state"]).status()
+    return status
+
+
+def _save_report(report, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera los grafos de conocimiento de un corpus de contratos.")
+    parser.add_argument("source", help="directorio con los contratos (.txt) o manifiesto (.json / .txt)")
+    parser.add_argument("--out", default=CORPUS_DIR, help="directorio de artefactos del corpus")
+    parser.add_argument("--contracts", type=int, default=CONTRACTS_IN_FLIGHT, help="contratos en curso a la vez")
+    parser.add_argument("--processes", type=int, default=CPU_PROCESSES, help="procesos para las etapas de CPU")
+    parser.add_argument("--from-stage", help="fuerza esta etapa y las posteriores en todos los contratos")
+    parser.add_argument("--force", action="store_true", help="ejecuta todas las etapas")
+    parser.add_argument("--status", action="store_true", help="muestra qué contratos están al día y sale")
+    parser.add_argument("--instrument", action="store_true", help="guarda un informe de tiempos y tokens en models/runs/")
+    args = parser.parse_args(argv)
+
+    if args.status:
+        for name, stages in corpus_status(args.source, args.out).items():
+            pending = [stage for stage, current in stages.items() if not current]
+            print(f"{name:30s} {'al día' if not pending else 'pendiente: ' + ', '.join(pending)}")
+        return
+
+    load_dotenv()
+    if args.instrument:
+        instrumentation.enable("corpus_build")
+    else:
+        instrumentation.enable_from_env("corpus_build")
+    try:
+        report = build_corpus(args.source, OpenAI(), corpus_dir=args.out, contracts_in_flight=args.contracts,
+                              processes=args.processes, from_stage=args.from_stage, force=args.force)
+    finally:
+        instrumentation.save_report()
+    return 1 if report.get("failed") else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
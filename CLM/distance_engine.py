@@ -0,0 +1,101 @@
+import threading
+import numpy as np
+
+from fingerprints import array_fingerprint
+
+# Filas por bloque al calcular la matriz; el bloque intermedio nunca supera 2**24 float32 (64 MB)
+DEFAULT_BLOCK_ROWS = 1024
+MAX_BLOCK_ELEMENTS = 2 ** 24
+
+_cache = {"fingerprint": None, "matrix": None}
+_cache_lock = threading.Lock()
+
+
+def normalize_rows(embeddings):
+    """Copia float32 de los embeddings con filas de norma 1 (las filas nulas se dejan a cero)."""
+    X = np.array(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    X /= norms
+    return X
+
+
+def block_rows_for(n, block_rows=DEFAULT_BLOCK_ROWS):
+    """Filas por bloque para que un bloque (filas × n) no pase de MAX_BLOCK_ELEMENTS."""
+    return max(1, min(block_rows, MAX_BLOCK_ELEMENTS // max(1, n)))
+
+
+def iter_distance_blocks(embeddings, block_rows=DEFAULT_BLOCK_ROWS):
+    """
+    Recorre la matriz de distancias coseno por bloques de filas sin materializarla entera.
+    Si la matriz de estos embeddings ya está en caché se devuelven vistas de ella en lugar de recalcular.
+
+    Yields:
+        (start, end, block) con block = distancias float32 de las filas [start, end) contra todas
+    """
+    n = len(embeddings)
+    cached = peek_distance_matrix(embeddings)
+    X = normalize_rows(embeddings) if cached is None else None
+    step = block_rows_for(n, block_rows)
+    for start in range(0, n, step):
+        end = min(start + step, n)
+        if cached is not None:
+            yield start, end, cached[start:end]
+        else:
+            block = X[start:end] @ X.T
+            np.subtract(1.0, block, out=block)
+            np.maximum(block, 0.0, out=block)
+            yield start, end, block
+
+
+def cosine_distance_matrix(embeddings, block_rows=DEFAULT_BLOCK_ROWS):
+    """
+    Matriz de distancias coseno n×n en float32, calculada por bloques sobre un único buffer
+    (sin la matriz de similitud intermedia ni copias float64). Diagonal a 0 y valores >= 0.
+    """
+    X = normalize_rows(embeddings)
+    n = X.shape[0]
+    D = np.empty((n, n), dtype=np.float32)
+    step = block_rows_for(n, block_rows)
+    for start in range(0, n, step):
+        end = min(start + step, n)
+        out = D[start:end]
+        np.matmul(X[start:end], X.T, out=out)
+        np.subtract(1.0, out, out=out)
+        np.maximum(out, 0.0, out=out)
+    np.fill_diagonal(D, 0.0)
+    return D
+
+
+def get_distance_matrix(embeddings, block_rows=DEFAULT_BLOCK_ROWS):
+    """
+    Devuelve la matriz de distancias coseno del conjunto de embeddings, calculándola una sola vez.
+    La matriz se cachea por la huella del conjunto (una entrada: la del último conjunto pedido)
+    y se devuelve de solo lectura, porque el mismo buffer lo comparten HDBSCAN, la exportación
+    de distancias y cualquier otro consumidor.
+    """
+    fingerprint = array_fingerprint(embeddings)
+    with _cache_lock:
+        if _cache["fingerprint"] == fingerprint:
+            return _cache["matrix"]
+        # Liberar la matriz anterior antes de reservar la nueva
+        _cache["fingerprint"], _cache["matrix"] = None, None
+
+        D = cosine_distance_matrix(embeddings, block_rows)
+        D.flags.writeable = False
+        _cache["fingerprint"], _cache["matrix"] = fingerprint, D
+        return D
+
+
+def peek_distance_matrix(embeddings):
+    """Matriz cacheada para estos embeddings, o None si no se ha calculado (no calcula nada)."""
+    with _cache_lock:
+        if _cache["matrix"] is None or _cache["matrix"].shape[0] != len(embeddings):
+            return None
+        cached_fingerprint, matrix = _cache["fingerprint"], _cache["matrix"]
+    return matrix if array_fingerprint(embeddings) == cached_fingerprint else None
+
+
+def clear_distance_cache():
+    with _cache_lock:
+        _cache["fingerprint"], _cache["matrix"] = None, None
@@ -0,0 +1,149 @@
+import os
+import time
+import sqlite3
+import threading
+from array import array
+
+from fingerprints import normalize_text, content_hash
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CACHE_PATH = os.path.join(BASE_DIR, "models", "embedding_cache.sqlite")
+DEFAULT_MAX_ENTRIES = 100_000  # ~600 MB con vectores de 1536 dimensiones en float32
+
+
+class EmbeddingCache:
+    """
+    Caché persistente de embeddings direccionada por contenido.
+
+    La clave es un hash de (modelo, texto normalizado), de modo que el mismo párrafo
+    en distintas ejecuciones o contratos se embebe una sola vez. Los vectores se guardan
+    como float32 en una base SQLite con tope de entradas y expulsión LRU. Una misma
+    instancia puede compartirse entre los hilos de los ThreadPoolExecutor del pipeline.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, embedding BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def key(text, model):
+        return content_hash(model, normalize_text(text))
+
+    def get_many(self, texts, model):
+        """
+        Busca varios textos a la vez. Devuelve una lista alineada con `texts`
+        con el embedding (List[float]) o None si no está en caché.
+        """
+        keys = [self.key(t, model) for t in texts]
+        found = {}
+        with self._lock:
+            unique_keys = list(set(keys))
+            # SQLite limita el número de parámetros por consulta
+            for start in range(0, len(unique_keys), 500):
+                chunk = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, embedding FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, k) for k in found]
+                )
+                self._conn.commit()
+            results = [self._decode(found[k]) if k in found else None for k in keys]
+            n_hits = sum(1 for r in results if r is not None)
+            self.hits += n_hits
+            self.misses += len(results) - n_hits
+        return results
+
+    def get(self, text, model):
+        return self.get_many([text], model)[0]
+
+    def put_many(self, texts, model, embeddings):
+        now = time.time()
+        rows = [(self.key(t, model), self._encode(e), now) for t, e in zip(texts, embeddings)]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, embedding, last_used) VALUES (?, ?, ?)", rows
+            )
+            self._evict()
+            self._conn.commit()
+
+    def put(self, text, model, embedding):
+        self.put_many([text], model, [embedding])
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (excess,)
+            )
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": size,
+                "max_entries": self.max_entries,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _encode(embedding):
+        return array("f", embedding).tobytes()
+
+    @staticmethod
+    def _decode(blob):
+        values = array("f")
+        values.frombytes(blob)
+        return values.tolist()
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """Devuelve la caché compartida del proceso (se crea en models/ la primera vez)."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = EmbeddingCache()
+        return _default_cache
+
+
+def resolve_cache(cache):
+    """
+    Traduce el argumento `cache` de las funciones de embeddings:
+    None → caché compartida por defecto, False → sin caché, o la instancia recibida.
+    """
+    if cache is False:
+        return None
+    if cache is None:
+        return get_default_cache()
+    return cache
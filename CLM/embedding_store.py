@@ -0,0 +1,110 @@
+import os
+import json
+import numpy as np
+
+
+class EmbeddingStore:
+    """
+    Almacén compacto de embeddings: una matriz float32 contigua en un fichero .npy
+    (abierta con mmap, sin parsear) y un sidecar JSON pequeño con los ids y textos.
+
+    - matrix: np.ndarray (n, d) float32, fila k ↔ ids[k]
+    - ids: List[int]
+    - texts: List[str]
+    """
+
+    def __init__(self, matrix, ids, texts):
+        self.matrix = matrix
+        self.ids = ids
+        self.texts = texts
+        self._row_of = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def dim(self):
+        return self.matrix.shape[1] if self.matrix.ndim == 2 else 0
+
+    def row_of(self, chunk_id):
+        """Fila de la matriz correspondiente a un id de chunk."""
+        if self._row_of is None:
+            self._row_of = {int(i): k for k, i in enumerate(self.ids)}
+        return self._row_of[int(chunk_id)]
+
+    def rows(self, chunk_ids):
+        """Submatriz con los embeddings de los ids dados (copia en memoria)."""
+        return self.matrix[[self.row_of(i) for i in chunk_ids]]
+
+    def to_records(self):
+        """Formato antiguo de embeddings.json: List[Dict] con 'id', 'text', 'embedding'."""
+        return [
+            {"id": i, "text": t, "embedding": self.matrix[k].tolist()}
+            for k, (i, t) in enumerate(zip(self.ids, self.texts))
+        ]
+
+
+def store_paths(path):
+    """
+    Devuelve (ruta .npy, ruta sidecar) para una ruta de store. Acepta la ruta con o sin
+    extensión, o la antigua ruta `.json`, para que los llamadores no tengan que cambiar.
+    """
+    base, ext = os.path.splitext(path)
+    if ext not in (".npy", ".json"):
+        base = path
+    return base + ".npy", base + ".ids.json"
+
+
+def save_embedding_store(path, ids, texts, embeddings):
+    """
+    Guarda los embeddings como matriz float32 (.npy) más un sidecar con ids y textos.
+    Los ficheros se escriben en temporales y se renombran para no dejar un store a medias.
+
+    Args:
+        path: str, ruta del store (ver store_paths)
+        ids: List[int], id de cada fila
+        texts: List[str], texto de cada fila
+        embeddings: List[List[float]] o np.ndarray (n, d)
+
+    Returns:
+        EmbeddingStore abierto con mmap sobre lo escrito
+    """
+    matrix_path, sidecar_path = store_paths(path)
+    os.makedirs(os.path.dirname(os.path.abspath(matrix_path)), exist_ok=True)
+
+    matrix = np.ascontiguousarray(np.asarray(embeddings, dtype=np.float32))
+    if matrix.ndim != 2:
+        matrix = matrix.reshape(len(ids), -1) if len(ids) else matrix.reshape(0, 0)
+
+    tmp_matrix = matrix_path + ".tmp"
+    with open(tmp_matrix, "wb") as f:
+        np.save(f, matrix)
+    tmp_sidecar = sidecar_path + ".tmp"
+    with open(tmp_sidecar, "w", encoding="utf-8") as f:
+        json.dump({"ids": [int(i) for i in ids], "texts": list(texts)}, f, ensure_ascii=False)
+
+    os.replace(tmp_matrix, matrix_path)
+    os.replace(tmp_sidecar, sidecar_path)
+    return load_embedding_store(path)
+
+
+def load_embedding_store(path, mmap=True):
+    """
+    Abre un store de embeddings. Con mmap=True la matriz no se lee a memoria hasta que se accede.
+    Si no existe el .npy pero sí el antiguo embeddings.json, se carga desde él.
+
+    Returns:
+        EmbeddingStore
+    """
+    matrix_path, sidecar_path = store_paths(path)
+    if os.path.exists(matrix_path):
+        matrix = np.load(matrix_path, mmap_mode="r" if mmap else None)
+        with open(sidecar_path, "r", encoding="utf-8") as f:
+            sidecar = json.load(f)
+        return EmbeddingStore(matrix, sidecar["ids"], sidecar["texts"])
+
+    legacy_path = os.path.splitext(matrix_path)[0] + ".json"
+    with open(legacy_path, "r", encoding="utf-8") as f:
+        records = json.load(f)
+    matrix = np.asarray([r["embedding"] for r in records], dtype=np.float32)
+    return EmbeddingStore(matrix, [int(r["id"]) for r in records], [r["text"] for r in records])
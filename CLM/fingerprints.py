@@ -0,0 +1,38 @@
+import hashlib
+import numpy as np
+
+
+def normalize_text(text):
+    """
+    Normaliza un texto antes de calcular su huella: colapsa saltos de línea y espacios repetidos.
+    """
+    return " ".join(text.split())
+
+
+def content_hash(*parts):
+    """
+    Devuelve un hash sha256 hexadecimal estable de las partes dadas (se convierten a str).
+    Las partes se separan con un carácter de control para que ("ab", "c") != ("a", "bc").
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\x1f")
+    return h.hexdigest()
+
+
+def member_hashes(texts):
+    """Huellas de un conjunto de textos (independientes del orden y de los índices)."""
+    return frozenset(content_hash(normalize_text(t)) for t in texts)
+
+
+def array_fingerprint(array):
+    """
+    Huella de una matriz de embeddings: hash de su forma y de sus valores en float32
+    (la misma matriz en float64 o float32 da la misma huella).
+    """
+    data = np.ascontiguousarray(np.asarray(array, dtype=np.float32))
+    h = hashlib.sha256()
+    h.update(str(data.shape).encode("utf-8"))
+    h.update(data.tobytes())
+    return h.hexdigest()
@@ -1,83 +1,331 @@
-import os
-import json
-import concurrent.futures
-from tqdm import tqdm
-
-
-
-def extracting_and_chunking():     
-    content_clean = []
-    # Open the file and read its content
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    file_path = os.path.join(base_dir, "Listado de párrafos EPC.txt")
-    with open(file_path, "r", encoding="utf-8") as file:
-        content = file.read()
-        content = content.splitlines()
-    # Remove empty lines and lines with less than 3 characters
-    for line in content: 
-        if len(line) > 3:
-            content_clean.append(line)
-    # Generate chunks of 2 paragraphs each 
-    buffer = []
-    for i in range(0, len(content_clean), 2):
-        buffer.append(" ".join(content_clean[i:i+2]))
-
-    return buffer
-
-
-def get_embedding(text, client, model="text-embedding-3-small"):
-    """
-    Llama el endpoint de embeddings de OpenAI para un texto dado.
-    - text: str, texto al que calcular embedding.
-    - client: instancia de OpenAI client configurada con tu API key.
-    - model: nombre del modelo de embeddings.
-    Returns: List[float] embedding de dimensión d.
-    """
-    clean_text = text.replace("\n", " ")
-    resp = client.embeddings.create(input=[clean_text], model=model)
-    return resp.data[0].embedding
-
-def calculate_chunk_embeddings(buffer, client, model="text-embedding-3-small", save_path="chunk_embeddings.json", max_workers=10):
-    """
-    Calcula los embeddings para cada chunk de texto de forma concurrente y los guarda en un JSON en el mismo directorio del script.
-
-    Args:
-        buffer: List[str], chunks de texto
-        client: instancia de OpenAI client
-        model: modelo de embeddings
-        save_path: nombre del archivo de salida (solo nombre, no path)
-        max_workers: número máximo de hilos a usar
-
-    Returns:
-        List[Dict] con campos 'id', 'text', 'embedding'
-    """
-    def embed_chunk(i_text):
-        i, text = i_text
-        try:
-            emb = get_embedding(text, client, model)
-            return {
-                "id": i,
-                "text": text,
-                "embedding": emb
-            }
-        except Exception as e:
-            print(f"Error embedding chunk {i}: {e}")
-            return None
-
-    print(f"Generando embeddings con {max_workers} hilos...")
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        results = list(tqdm(executor.map(embed_chunk, enumerate(buffer)), total=len(buffer)))
-
-    # Filtramos posibles None por errores
-    results = [r for r in results if r is not None]
-
-    # Guardar archivo en el mismo directorio del script
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    full_path = os.path.join(base_dir, save_path)
-
-    with open(full_path, 'w', encoding='utf-8') as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
-
-    print(f"Guardados {len(results)} chunks embebidos en '{full_path}'")
-    return results
+import os
+import time
+import concurrent.futures
+from tqdm import tqdm
+
+from embedding_cache import resolve_cache
+from embedding_store import save_embedding_store
+from fingerprints import content_hash
+from journal import resolve_journal, encode_vector, decode_vector
+
+# Límites por petición del modo por lotes. La API admite hasta 2048 textos y
+# ~300k tokens por llamada; nos quedamos muy por debajo para no rozar los límites
+# de rate limit (se estima ~4 caracteres por token).
+MAX_BATCH_CHARS = 100_000
+MAX_BATCH_ITEMS = 256
+MAX_RETRIES = 3
+MAX_BATCH_SLEEP = 30.0  # segundos de espera máximos entre reintentos de un mismo lote
+
+
+def extracting_and_chunking(file_path=None):
+    # Open the file and read its content (by default the contract next to this script)
+    if file_path is None:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        file_path = os.path.join(base_dir, "Listado de párrafos EPC.txt")
+    with open(file_path, "r", encoding="utf-8") as file:
+        content = file.read()
+        content = content.splitlines()
+    return chunk_lines(content)
+
+
+def chunk_lines(content):
+    """
+    Aplica el chunking del pipeline a una lista de líneas: descarta las de 3 caracteres
+    o menos y une el resto de dos en dos.
+    """
+    content_clean = []
+    # Remove empty lines and lines with less than 3 characters
+    for line in content: 
+        if len(line) > 3:
+            content_clean.append(line)
+    # Generate chunks of 2 paragraphs each 
+    buffer = []
+    for i in range(0, len(content_clean), 2):
+        buffer.append(" ".join(content_clean[i:i+2]))
+
+    return buffer
+
+
+def get_embedding(text, client, model="text-embedding-3-small", cache=None):
+    """
+    Llama el endpoint de embeddings de OpenAI para un texto dado.
+    - text: str, texto al que calcular embedding.
+    - client: instancia de OpenAI client configurada con tu API key.
+    - model: nombre del modelo de embeddings.
+    - cache: EmbeddingCache a usar; None usa la caché compartida y False la desactiva.
+    Returns: List[float] embedding de dimensión d.
+    """
+    cache = resolve_cache(cache)
+    if cache is not None:
+        cached = cache.get(text, model)
+        if cached is not None:
+            return cached
+
+    clean_text = text.replace("\n", " ")
+    resp = client.embeddings.create(input=[clean_text], model=model)
+    embedding = resp.data[0].embedding
+
+    if cache is not None:
+        cache.put(text, model, embedding)
+    return embedding
+
+
+def get_embeddings(texts, client, model="text-embedding-3-small", cache=None):
+    """
+    Llama el endpoint de embeddings de OpenAI con varios textos en una sola petición.
+    Solo se envían los textos que no estén ya en caché.
+    - texts: List[str], textos a embeber.
+    - client: instancia de OpenAI client.
+    - model: nombre del modelo de embeddings.
+    - cache: EmbeddingCache a usar; None usa la caché compartida y False la desactiva.
+    Returns: List[List[float]] en el mismo orden que `texts`.
+    """
+    cache = resolve_cache(cache)
+    results = cache.get_many(texts, model) if cache is not None else [None] * len(texts)
+    missing = [k for k, r in enumerate(results) if r is None]
+    if not missing:
+        return results
+
+    clean_texts = [texts[k].replace("\n", " ") for k in missing]
+    resp = client.embeddings.create(input=clean_texts, model=model)
+    # La API devuelve un índice por texto; no asumimos que venga ordenado
+    data = sorted(resp.data, key=lambda d: d.index)
+    if len(data) != len(clean_texts):
+        raise ValueError(f"Expected {len(clean_texts)} embeddings, got {len(data)}")
+
+    for k, d in zip(missing, data):
+        results[k] = d.embedding
+    if cache is not None:
+        cache.put_many([texts[k] for k in missing], model, [d.embedding for d in data])
+    return results
+
+
+def make_batches(items, max_chars=MAX_BATCH_CHARS, max_items=MAX_BATCH_ITEMS):
+    """
+    Agrupa pares (id, texto) en lotes consecutivos acotados por número de caracteres y de textos.
+    Un texto que por sí solo supera `max_chars` va en un lote propio.
+
+    Returns:
+        List[List[Tuple[int, str]]]
+    """
+    batches = []
+    current, current_chars = [], 0
+    for i, text in items:
+        if current and (current_chars + len(text) > max_chars or len(current) >= max_items):
+            batches.append(current)
+            current, current_chars = [], 0
+        current.append((i, text))
+        current_chars += len(text)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def embed_batch(batch, client, model="text-embedding-3-small", retries=MAX_RETRIES, backoff=1.0, cache=False,
+                max_sleep=MAX_BATCH_SLEEP):
+    """
+    Embebe un lote de pares (id, texto). Los fallos se tratan según su causa (ver error_kind):
+
+    - "input" (400/413, p. ej. un texto demasiado largo): el lote se divide en dos mitades que
+      se reintentan por separado, sin espera, hasta aislar los textos problemáticos.
+    - "fatal" (clave inválida, permisos, cuota agotada): se relanza la excepción sin reintentar.
+    - "transient" (rate limit, timeouts, 5xx): se reintenta el lote entero con espera exponencial.
+
+    Todos los reintentos de un lote (incluidas sus mitades) comparten un presupuesto de
+    `retries` reintentos y `max_sleep` segundos de espera; agotado, los textos pendientes se
+    dan por fallidos en lugar de seguir insistiendo contra una API que está rechazando peticiones.
+
+    Los embeddings obtenidos se guardan en `cache` (por defecto no se usa caché; se asume
+    que el llamador ya ha filtrado los textos cacheados).
+
+    Returns:
+        Tuple[List[Tuple[int, List[float]]], List[int]] con los embeddings obtenidos y los ids fallidos.
+    """
+    budget = {"retries": retries, "sleep": max_sleep}
+    return _embed_batch(batch, client, model, backoff, cache, budget)
+
+
+def error_kind(error):
+    """Clasifica un error de la API: "fatal", "input" o "transient" (por código HTTP y código de error)."""
+    status = getattr(error, "status_code", None)
+    code = getattr(error, "code", None)
+    if status in (401, 403, 404) or code == "insufficient_quota":
+        return "fatal"
+    if status in (400, 413):
+        return "input"
+    return "transient"
+
+
+def _embed_batch(batch, client, model, backoff, cache, budget):
+    try:
+        texts = [text for _, text in batch]
+        embeddings = get_embeddings(texts, client, model, cache=False)
+        store = resolve_cache(cache)
+        if store is not None:
+            store.put_many(texts, model, embeddings)
+        return [(i, emb) for (i, _), emb in zip(batch, embeddings)], []
+    except Exception as e:
+        kind = error_kind(e)
+        if kind == "fatal":
+            print(f"Error no recuperable embebiendo un lote de {len(batch)} chunks: {e}")
+            raise
+        if kind == "input" and len(batch) > 1:
+            print(f"Error embedding batch of {len(batch)} chunks ({e}); splitting and retrying")
+            mid = len(batch) // 2
+            done_a, failed_a = _embed_batch(batch[:mid], client, model, backoff, cache, budget)
+            done_b, failed_b = _embed_batch(batch[mid:], client, model, backoff, cache, budget)
+            return done_a + done_b, failed_a + failed_b
+        if kind == "transient" and budget["retries"] > 0 and budget["sleep"] >= backoff:
+            budget["retries"] -= 1
+            budget["sleep"] -= backoff
+            time.sleep(backoff)
+            return _embed_batch(batch, client, model, backoff * 2, cache, budget)
+        print(f"Error embedding {len(batch)} chunks starting at {batch[0][0]}: {e}")
+        return [], [i for i, _ in batch]
+
+
+def calculate_chunk_embeddings(buffer, client, model="text-embedding-3-small", save_path="chunk_embeddings.npy", max_workers=10,
+                               batched=True, max_batch_chars=MAX_BATCH_CHARS, max_batch_items=MAX_BATCH_ITEMS, cache=None,
+                               journal=None):
+    """
+    Calcula los embeddings para cada chunk de texto de forma concurrente y los guarda como
+    embedding store (matriz float32 .npy + sidecar .ids.json, ver embedding_store) en el mismo directorio del script.
+
+    En modo por lotes (por defecto) se empaquetan varios chunks por petición, acotados por
+    `max_batch_chars` y `max_batch_items`, y los lotes se lanzan en paralelo. Un lote que falla
+    se divide y se reintenta. En los dos modos, si algún chunk no llega a embeberse se lanza
+    RuntimeError en vez de descartarlo, para no desalinear los ids con el buffer.
+
+    Antes de llamar a la API se consulta la caché de embeddings, así que al reindexar un
+    contrato solo se embeben los párrafos nuevos o modificados.
+
+    Cada embedding obtenido se añade a un diario (`<save_path>.journal.jsonl`, ver journal.py);
+    si la ejecución se interrumpe, la siguiente reutiliza lo ya embebido. El diario se borra
+    al guardar el store.
+
+    Args:
+        buffer: List[str], chunks de texto
+        client: instancia de OpenAI client
+        model: modelo de embeddings
+        save_path: nombre del store de salida (solo nombre, no path)
+        max_workers: número máximo de hilos a usar
+        batched: si es False se hace una petición por chunk (modo original)
+        max_batch_chars: máximo de caracteres por petición en modo por lotes
+        max_batch_items: máximo de chunks por petición en modo por lotes
+        cache: EmbeddingCache a usar; None usa la caché compartida y False la desactiva
+        journal: Journal a usar; None usa el diario junto al store y False lo desactiva
+
+    Returns:
+        List[Dict] con campos 'id', 'text', 'embedding', ordenados por 'id'
+    """
+    cache = resolve_cache(cache)
+    # Guardar archivo en el mismo directorio del script
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    full_path = os.path.join(base_dir, save_path)
+    journal = resolve_journal(journal, full_path, signature=content_hash("embeddings", model))
+
+    if batched:
+        results = _calculate_batched(buffer, client, model, max_workers, max_batch_chars, max_batch_items, cache, journal)
+    else:
+        results = _calculate_per_chunk(buffer, client, model, max_workers, cache, journal)
+    if cache is not None:
+        stats = cache.stats()
+        print(f"Caché de embeddings: {stats['hits']} aciertos, {stats['misses']} fallos, {stats['entries']} entradas")
+
+    save_embedding_store(
+        full_path,
+        [r["id"] for r in results],
+        [r["text"] for r in results],
+        [r["embedding"] for r in results]
+    )
+
+    if journal is not None:
+        journal.discard()
+
+    print(f"Guardados {len(results)} chunks embebidos en '{full_path}'")
+    return results
+
+
+def _calculate_batched(buffer, client, model, max_workers, max_batch_chars, max_batch_items, cache, journal=None):
+    embeddings = embed_texts(buffer, client, model, max_workers, max_batch_chars, max_batch_items, cache or False,
+                             journal=journal)
+    return [{"id": i, "text": text, "embedding": embeddings[i]} for i, text in enumerate(buffer)]
+
+
+def embed_texts(texts, client, model="text-embedding-3-small", max_workers=10,
+                max_batch_chars=MAX_BATCH_CHARS, max_batch_items=MAX_BATCH_ITEMS, cache=None, journal=None):
+    """
+    Embebe una lista de textos en modo por lotes (con caché) sin escribir nada a disco.
+    Con `journal` (ver journal.py) se reutilizan los embeddings ya registrados y cada lote
+    terminado se añade al diario.
+
+    Returns:
+        List[List[float]] alineada con `texts`. Lanza RuntimeError si algún texto no se pudo embeber.
+    """
+    cache = resolve_cache(cache)
+    embeddings = {}
+    if cache is not None:
+        cached = cache.get_many(texts, model)
+        embeddings = {i: emb for i, emb in enumerate(cached) if emb is not None}
+    if journal is not None:
+        embeddings.update(_replay_embeddings(journal, texts, skip=embeddings))
+    pending = [(i, text) for i, text in enumerate(texts) if i not in embeddings]
+
+    batches = make_batches(pending, max_chars=max_batch_chars, max_items=max_batch_items)
+    print(f"Generando embeddings de {len(pending)} chunks ({len(embeddings)} en caché) en {len(batches)} lotes con {max_workers} hilos...")
+
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(embed_batch, batch, client, model, cache=cache or False) for batch in batches]
+        for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures)):
+            done, batch_failed = future.result()
+            embeddings.update(done)
+            failed.extend(batch_failed)
+            if journal is not None:
+                for i, emb in done:
+                    journal.append({"id": i, "text_hash": content_hash(texts[i]), "embedding": encode_vector(emb)})
+
+    if failed:
+        raise RuntimeError(f"No se pudieron embeber {len(failed)} chunks: {sorted(failed)}")
+
+    return [embeddings[i] for i in range(len(texts))]
+
+
+def _replay_embeddings(journal, texts, skip=()):
+    """Embeddings del diario cuyo texto sigue siendo el mismo en esa posición."""
+    replayed = {}
+    for record in journal.replay():
+        i = record["id"]
+        if i < len(texts) and i not in skip and record["text_hash"] == content_hash(texts[i]):
+            replayed[i] = decode_vector(record["embedding"])
+    return replayed
+
+
+def _calculate_per_chunk(buffer, client, model, max_workers, cache, journal=None):
+    replayed = _replay_embeddings(journal, buffer) if journal is not None else {}
+
+    def embed_chunk(i_text):
+        i, text = i_text
+        if i in replayed:
+            return {"id": i, "text": text, "embedding": replayed[i]}
+        emb = cache.get_many([text], model)[0] if cache is not None else None
+        if emb is None:
+            # Un lote de un solo chunk: mismos reintentos acotados y clasificación de errores que el modo por lotes
+            done, _ = embed_batch([(i, text)], client, model, cache=cache or False)
+            if not done:
+                return {"id": i, "text": text, "embedding": None}
+            emb = done[0][1]
+        if journal is not None:
+            journal.append({"id": i, "text_hash": content_hash(text), "embedding": encode_vector(emb)})
+        return {"id": i, "text": text, "embedding": emb}
+
+    print(f"Generando embeddings con {max_workers} hilos...")
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(tqdm(executor.map(embed_chunk, enumerate(buffer)), total=len(buffer)))
+
+    # Un chunk sin embedding no se descarta: desalinearía los ids del store con el buffer
+    failed = [r["id"] for r in results if r["embedding"] is None]
+    if failed:
+        raise RuntimeError(f"No se pudieron embeber {len(failed)} chunks: {failed}")
+    return results
@@ -1,10 +1,128 @@
 import json
+import threading
 import numpy as np
+from collections.abc import Mapping
 from pyvis.network import Network
-from generate_embeddings import get_embedding
+from pyvis.edge import Edge
+from generate_embeddings import embed_texts
+from graph_layout import pca_projection, force_layout, ring_positions
+from distance_engine import normalize_rows, block_rows_for
 
+# Pixels per unit of the precomputed layout and radius of collapsed loneliners around their parent
+NODE_SPACING = 150
+LONELINER_RING_RADIUS = 60
+# Zoom level from which collapsed loneliners are shown
+EXPAND_ZOOM_SCALE = 1.5
+# Pseudo-group that meta_labels gives to chunks without a named group (see construir_meta_etiqueta)
+LONELINER_GROUP = "loneliners"
 
-def generate_kgraph(relations, meta_labels, client, group_labels, save_path="kgraph.html"):
+STATIC_OPTIONS = """
+{
+    "nodes": {
+        "font": {
+            "size": 14,
+            "strokeWidth": 3
+        }
+    },
+    "edges": {
+        "color": {"inherit": "both"},
+        "font": {"size": 10},
+        "smooth": false
+    },
+    "physics": {
+        "enabled": false
+    },
+    "interaction": {
+        "hideEdgesOnDrag": true
+    },
+    "layout": {
+        "improvedLayout": false
+    }
+}
+"""
+
+EXPAND_SCRIPT = """
+<script type="text/javascript">
+    // Collapsed loneliners: double-click a group to expand/collapse them, or zoom in to show all
+    (function () {
+        var children = %(children)s;
+        var childEdges = %(child_edges)s;
+        var expandScale = %(expand_scale)s;
+        var expanded = {};
+        var zoomedIn = false;
+
+        function show(parent, visible) {
+            nodes.update(children[parent].map(function (id) { return {id: id, hidden: !visible}; }));
+            edges.update(childEdges[parent].map(function (id) { return {id: id, hidden: !visible}; }));
+        }
+
+        network.on("doubleClick", function (params) {
+            if (params.nodes.length === 0) { return; }
+            var parent = params.nodes[0];
+            if (!(parent in children)) { return; }
+            expanded[parent] = !expanded[parent];
+            show(parent, expanded[parent] || zoomedIn);
+        });
+
+        network.on("zoom", function (params) {
+            var visible = params.scale >= expandScale;
+            if (visible === zoomedIn) { return; }
+            zoomedIn = visible;
+            for (var parent in children) {
+                if (!expanded[parent]) { show(parent, visible); }
+            }
+        });
+    })();
+</script>
+"""
+
+
+class LazyGroupEmbeddings(Mapping):
+    """
+    Read-only mapping group name -> embedding that calls the API only when first read.
+
+    The first access embeds every name not yet computed in one batched, cache-backed
+    call (see embed_texts); later reads are plain dictionary lookups.
+    """
+
+    def __init__(self, group_names, client=None, model="text-embedding-3-small", cache=None):
+        self.group_names = sorted(group_names)
+        self._name_set = set(self.group_names)
+        self.client = client
+        self.model = model
+        self.cache = cache
+        self._embeddings = None
+        self._lock = threading.Lock()
+
+    def _compute(self):
+        with self._lock:
+            if self._embeddings is None:
+                if self.client is None:
+                    raise RuntimeError("Group embeddings requested but generate_kgraph was called without a client")
+                vectors = embed_texts(self.group_names, self.client, model=self.model, cache=self.cache)
+                self._embeddings = dict(zip(self.group_names, vectors))
+        return self._embeddings
+
+    @property
+    def computed(self):
+        return self._embeddings is not None
+
+    def __getitem__(self, group_name):
+        return self._compute()[group_name]
+
+    def __iter__(self):
+        return iter(self.group_names)
+
+    def __len__(self):
+        return len(self.group_names)
+
+    def __contains__(self, group_name):
+        return group_name in self._name_set
+
+
+def generate_kgraph(relations, meta_labels, client=None, group_labels=None, save_path="kgraph.html", cache=None,
+                    embedding_model="text-embedding-3-small", static_layout=False, embeddings=None,
+                    collapse_loneliners=None):
     """
     Generate a knowledge graph visualization that includes all semantic groups,
     including those containing only a single chunk ("loneliners").
@@ -12,9 +130,20 @@ def generate_kgraph(relations, meta_labels, client, group_labels, save_path="kgr
     Parameters:
     - relations: dict, relationships between groups {group_a: {group_b: relation_type, ...}, ...}
     - meta_labels: dict, metadata for chunks with group information
-    - client: client for generating embeddings
+    - client: client for generating group-name embeddings (optional; rendering itself is offline)
     - group_labels: dict, additional information about groups (optional)
     - save_path: str, path to save the HTML visualization
+    - cache: EmbeddingCache for group-name embeddings (None uses the shared cache, False disables it)
+    - embedding_model: model for the group-name embeddings
+    - static_layout: compute node positions in Python (force layout seeded from a PCA of the
+      group centroids) and disable physics in the browser; recommended for large graphs
+    - embeddings: chunk embedding matrix used to seed the static layout (optional)
+    - collapse_loneliners: hide loneliners behind their parent group until the user double-clicks
+      the parent or zooms in (defaults to static_layout). With `embeddings`, each chunk of the
+      "loneliners" pseudo-group becomes its own node under the nearest named group
+
+    The returned "group_embeddings" is a LazyGroupEmbeddings: nothing is embedded unless a
+    caller reads it.
     """
     # 1. Collect all unique groups from relations and meta_labels
     unique_groups = set()
@@ -33,23 +162,60 @@ def generate_kgraph(relations, meta_labels, client, group_labels, save_path="kgr
     
     print(f"Found {len(unique_groups)} unique groups, including loneliners")
     
-    # 2. Calculate embeddings for each group
-    group_embeddings = {}
-    for group_name in unique_groups:
-        embedding = get_embedding(group_name, client)
-        group_embeddings[group_name] = embedding
-    
-    # 3. Compile chunks that belong to each group
+    # 2. Compile chunks that belong to each group
     group_chunks = {group: [] for group in unique_groups}
     for chunk_id, data in meta_labels.items():
         if "meta" in data and "groups_related" in data["meta"]:
             for group in data["meta"]["groups_related"]:
                 if group in group_chunks:
                     group_chunks[group].append(chunk_id)
+
+    # Chunks of the "loneliners" pseudo-group become one node each (group_loneliner_<id>, as in
+    # semantic_groups.json) attached to the named group with the nearest centroid, so they can
+    # be collapsed behind it. Needs the chunk embeddings; otherwise the pseudo-group stays a node.
+    if collapse_loneliners is None:
+        collapse_loneliners = static_layout
+    nearest_parents = {}
+    if collapse_loneliners and embeddings is not None and group_chunks.get(LONELINER_GROUP):
+        named = sorted(g for g, chunks in group_chunks.items() if g != LONELINER_GROUP and len(chunks) > 1)
+        if named:
+            lonely_chunks = group_chunks.pop(LONELINER_GROUP)
+            unique_groups.discard(LONELINER_GROUP)
+            nearest = _nearest_groups(lonely_chunks, named, group_chunks, meta_labels, embeddings)
+            for chunk_id, parent in zip(lonely_chunks, nearest):
+                node = f"group_loneliner_{chunk_id}"
+                unique_groups.add(node)
+                group_chunks[node] = [chunk_id]
+                nearest_parents[node] = [parent]
+
+    # 3. Group-name embeddings, computed (batched) only if a caller reads them
+    group_embeddings = LazyGroupEmbeddings(unique_groups, client, model=embedding_model, cache=cache)
     
     # Count how many loneliners we have (groups with only one chunk)
     loneliner_count = sum(1 for group, chunks in group_chunks.items() if len(chunks) == 1)
     print(f"Found {loneliner_count} loneliner groups (groups with only one chunk)")
+
+    # Groups each loneliner is "part of" (other groups sharing its chunk, or the nearest named group)
+    loneliner_parents = {}
+    for group, chunks in group_chunks.items():
+        if len(chunks) == 1:
+            related = meta_labels.get(chunks[0], {}).get("meta", {}).get("groups_related", [])
+            loneliner_parents[group] = nearest_parents.get(group) or [
+                g for g in related if g != group and g in group_chunks
+            ]
+
+    # Loneliners hidden behind their first parent until expanded
+    collapsed = {}
+    if collapse_loneliners:
+        for loneliner, parents in sorted(loneliner_parents.items()):
+            if parents and len(group_chunks[parents[0]]) > 1:
+                collapsed.setdefault(parents[0], []).append(loneliner)
+    hidden_nodes = {loneliner for children in collapsed.values() for loneliner in children}
+
+    positions = None
+    if static_layout:
+        positions = _static_positions(unique_groups, group_chunks, relations, loneliner_parents, collapsed,
+                                      meta_labels, embeddings)
     
     # 4. Create PyVis network
     net = Network(
@@ -61,8 +227,8 @@ def generate_kgraph(relations, meta_labels, client, group_labels, save_path="kgr
     )
     
     # Configure network options with special settings for loneliners
-    net.toggle_physics(True)
-    net.set_options("""
+    net.toggle_physics(not static_layout)
+    net.set_options(STATIC_OPTIONS if static_layout else """
     {
         "nodes": {
             "font": {
@@ -93,6 +259,7 @@ def generate_kgraph(relations, meta_labels, client, group_labels, save_path="kgr
     
     # 5. Add nodes directly to PyVis - including loneliners
     added_nodes = set()  # Track which nodes have been added
+    node_type_counts = {"loneliner": 0, "multi-chunk": 0}
     
     for group_name in unique_groups:
         try:
@@ -107,6 +274,8 @@ def generate_kgraph(relations, meta_labels, client, group_labels, save_path="kgr
                 tooltip += f"<br>Sample IDs: {', '.join(map(str, sample_chunks))}"
                 if len(chunk_ids) > 5:
                     tooltip += f" (+ {len(chunk_ids) - 5} more)"
+            if group_name in collapsed:
+                tooltip += f"<br>+ {len(collapsed[group_name])} loneliners (double-click to expand)"
             
             # Node size based on number of chunks - make sure loneliners aren't too small
             size = max(15, 10 + len(chunk_ids) * 2)
@@ -123,6 +292,12 @@ def generate_kgraph(relations, meta_labels, client, group_labels, save_path="kgr
                 color_id = (hash(group_name) % 19) + 1  # 1-19 range (keep 0 for loneliners)
                 shape = "dot"  # Regular shape for normal groups
             
+            # Precomputed position (static layout) or physics in the browser
+            layout_options = {"physics": True}
+            if positions is not None:
+                x, y = positions[group_name]
+                layout_options = {"x": x, "y": y, "physics": False}
+
             # Add the node with appropriate styling
             net.add_node(
                 group_name,
@@ -131,20 +306,23 @@ def generate_kgraph(relations, meta_labels, client, group_labels, save_path="kgr
                 value=size,
                 group=color_id,
                 shape=shape,
-                physics=True,  # Enable physics for better layout
                 borderWidth=2,
-                borderWidthSelected=4
+                borderWidthSelected=4,
+                hidden=group_name in hidden_nodes,
+                **layout_options
             )
             
             added_nodes.add(group_name)
             
             # Track different types of nodes
             node_type = "loneliner" if is_loneliner else "multi-chunk"
-            print(f"Added {node_type} node: {group_name} with {len(chunk_ids)} chunks")
+            node_type_counts[node_type] += 1
             
         except Exception as e:
             print(f"Error adding node '{group_name}': {e}")
     
+    print(f"Added {node_type_counts['multi-chunk']} multi-chunk nodes and {node_type_counts['loneliner']} loneliner nodes")
+
     # 6. Add edges from the relations dictionary
     edge_count = 0
     
@@ -160,13 +338,15 @@ def generate_kgraph(relations, meta_labels, client, group_labels, save_path="kgr
                 
             try:
                 # Add the edge
-                net.add_edge(
+                _append_edge(
+                    net,
+                    added_nodes,
                     group_a,
                     group_b,
                     title=relation_type,
                     label=relation_type,
                     arrows="to",
-                    smooth={"enabled": True, "type": "dynamic"}
+                    smooth=False if static_layout else {"enabled": True, "type": "dynamic"}
                 )
                 edge_count += 1
                 
@@ -177,46 +357,44 @@ def generate_kgraph(relations, meta_labels, client, group_labels, save_path="kgr
     # This is optional but helps integrate loneliners into the graph structure
     loneliner_edge_count = 0
     
-    # Identify loneliners
-    loneliners = [group for group, chunks in group_chunks.items() if len(chunks) == 1]
-    
-    # For each loneliner, try to find connections to other groups based on 
-    # chunk co-occurrence in the meta_labels
-    for loneliner in loneliners:
-        loneliner_chunks = group_chunks[loneliner]
-        if not loneliner_chunks:
+    # For each loneliner, connect it to the other groups that share its chunk
+    # (chunk co-occurrence in the meta_labels)
+    collapsed_edges = {parent: [] for parent in collapsed}
+    for loneliner, related_groups in loneliner_parents.items():
+        if loneliner not in added_nodes:
             continue
-        
-        # Get the single chunk ID for this loneliner
-        chunk_id = loneliner_chunks[0]
-        
-        # Find other groups that share this chunk
-        if chunk_id in meta_labels and "meta" in meta_labels[chunk_id] and "groups_related" in meta_labels[chunk_id]["meta"]:
-            related_groups = meta_labels[chunk_id]["meta"]["groups_related"]
-            
-            # Connect to other groups (not self)
-            for related_group in related_groups:
-                if related_group != loneliner and related_group in added_nodes:
-                    try:
-                        # Add edge from loneliner to related group with "part of" relationship
-                        net.add_edge(
-                            loneliner,
-                            related_group,
-                            title="part of",
-                            label="part of",
-                            arrows="to",
-                            dashes=True,  # Use dashed line for these implicit relations
-                            color={"color": "#cccccc"}  # Light gray to distinguish from explicit relations
-                        )
-                        loneliner_edge_count += 1
-                    except Exception as e:
-                        print(f"Error adding loneliner edge '{loneliner}' -> '{related_group}': {e}")
+        for related_group in related_groups:
+            if related_group not in added_nodes:
+                continue
+            try:
+                # Add edge from loneliner to related group with "part of" relationship
+                edge_id = f"part_of:{loneliner}->{related_group}"
+                _append_edge(
+                    net,
+                    added_nodes,
+                    loneliner,
+                    related_group,
+                    id=edge_id,
+                    title="part of",
+                    label="part of",
+                    arrows="to",
+                    dashes=True,  # Use dashed line for these implicit relations
+                    color={"color": "#cccccc"},  # Light gray to distinguish from explicit relations
+                    hidden=loneliner in hidden_nodes
+                )
+                if loneliner in hidden_nodes:
+                    collapsed_edges[loneliner_parents[loneliner][0]].append(edge_id)
+                loneliner_edge_count += 1
+            except Exception as e:
+                print(f"Error adding loneliner edge '{loneliner}' -> '{related_group}': {e}")
     
     print(f"Added {edge_count} explicit edges and {loneliner_edge_count} implicit loneliner connections")
     
     # 8. Save the graph
     try:
         net.save_graph(save_path)
+        if collapsed:
+            _inject_expand_script(save_path, collapsed, collapsed_edges)
         print(f"Knowledge graph saved as '{save_path}'")
     except Exception as e:
         print(f"Error saving graph: {e}")
@@ -234,5 +412,90 @@ def generate_kgraph(relations, meta_labels, client, group_labels, save_path="kgr
         "group_embeddings": group_embeddings,
         "nodes_added": len(added_nodes),
         "edges_added": edge_count + loneliner_edge_count,
-        "loneliner_count": loneliner_count
+        "loneliner_count": loneliner_count,
+        "positions": positions
+    }
+
+
+def _nearest_groups(chunk_ids, groups, group_chunks, meta_labels, embeddings):
+    """Group of `groups` whose centroid is most cosine-similar to each chunk, scored in row blocks."""
+    X = np.asarray(embeddings, dtype=np.float32)
+
+    def rows(chunks):
+        return [int(meta_labels[c].get("embedding_row", c)) for c in chunks]
+
+    centroids = normalize_rows(np.stack([X[rows(group_chunks[g])].mean(axis=0) for g in groups]))
+    chunk_rows = rows(chunk_ids)
+    step = block_rows_for(len(groups))
+    nearest = []
+    for start in range(0, len(chunk_rows), step):
+        block = normalize_rows(X[chunk_rows[start:start + step]]) @ centroids.T
+        nearest.extend(groups[k] for k in np.argmax(block, axis=1))
+    return nearest
+
+
+def _append_edge(net, node_ids, source, to, **options):
+    """
+    Adds an edge without pyvis' per-edge node lookup (linear in the number of nodes):
+    both endpoints are checked against `node_ids`, the set of ids already added to `net`.
+    """
+    for node in (source, to):
+        if node not in node_ids:
+            raise ValueError(f"non existent node '{node}'")
+    net.edges.append(Edge(source, to, net.directed, **options).options)
+
+
+def _static_positions(unique_groups, group_chunks, relations, loneliner_parents, collapsed, meta_labels,
+                      embeddings=None):
+    """
+    Pixel position of every group: force layout of the visible groups seeded from the PCA
+    projection of their centroids (or a fixed random seed without embeddings), and collapsed
+    loneliners on a ring around their parent.
+    """
+    hidden = {loneliner: parent for parent, children in collapsed.items() for loneliner in children}
+    visible = sorted(g for g in unique_groups if g not in hidden)
+    index = {g: k for k, g in enumerate(visible)}
+
+    if embeddings is not None and len(visible):
+        X = np.asarray(embeddings, dtype=np.float32)
+        centroids = np.zeros((len(visible), X.shape[1]), dtype=np.float32)
+        for g, k in index.items():
+            rows = [int(meta_labels[c].get("embedding_row", c)) for c in group_chunks.get(g, [])]
+            if rows:
+                centroids[k] = X[rows].mean(axis=0)
+        seed = pca_projection(centroids)
+    else:
+        seed = np.random.default_rng(0).normal(size=(len(visible), 2)).astype(np.float32)
+
+    edges = [
+        (index[a], index[b])
+        for a, targets in relations.items() if a in index
+        for b in targets if b in index
+    ]
+    edges += [
+        (index[l], index[p])
+        for l, parents in loneliner_parents.items() if l in index
+        for p in parents if p in index
+    ]
+    layout = force_layout(seed, np.array(edges, dtype=np.int64).reshape(-1, 2)) * NODE_SPACING
+
+    positions = {g: (float(layout[k, 0]), float(layout[k, 1])) for g, k in index.items()}
+    for parent, children in collapsed.items():
+        ring = ring_positions(positions[parent], len(children), LONELINER_RING_RADIUS)
+        for loneliner, (x, y) in zip(children, ring):
+            positions[loneliner] = (float(x), float(y))
+    return positions
+
+
+def _inject_expand_script(save_path, collapsed, collapsed_edges):
+    """Adds the expand-on-double-click / expand-on-zoom handlers to the saved HTML."""
+    with open(save_path, "r", encoding="utf-8") as f:
+        html = f.read()
+    script = EXPAND_SCRIPT % {
+        "children": json.dumps(collapsed).replace("</", "<\\/"),
+        "child_edges": json.dumps(collapsed_edges).replace("</", "<\\/"),
+        "expand_scale": EXPAND_ZOOM_SCALE,
     }
+    html = html.replace("</body>", script + "</body>", 1)
+    with open(save_path, "w", encoding="utf-8") as f:
+        f.write(html)
@@ -1,64 +1,281 @@
+"""
+Pipeline completo: chunking y embeddings → agrupamiento → nombrado → meta etiquetas →
+relaciones → grafo → índice del retriever. Cada etapa se salta si sus artefactos están
+al día con sus entradas y parámetros (ver pipeline_runner.py), así que tras un fallo
+basta con volver a lanzarlo.
+
+Uso:
+    python generate_kg_main.py                         # ejecuta solo lo que haya cambiado
+    python generate_kg_main.py --from-stage relations  # fuerza una etapa y las posteriores
+    python generate_kg_main.py --force                 # rehace todo
+    python generate_kg_main.py --status                # muestra qué etapas están al día
+    python generate_kg_main.py --instrument            # informe de tiempos y tokens en models/runs/
+
+Para indexar muchos contratos a la vez, ver corpus_build.py.
+"""
+import argparse
 import json
 import os
 from dotenv import load_dotenv
 from openai import OpenAI
 
 from generate_embeddings import extracting_and_chunking, calculate_chunk_embeddings
+from embedding_store import load_embedding_store
+from distance_engine import clear_distance_cache
 from generate_semantic_groups import calculate_distances, agrupamiento_semantico
 from naming_semantic_groups import generate_titles
 from generate_meta_labels import construir_meta_etiqueta
 from generate_relations import definir_relaciones
 from generate_kg import generate_kgraph
+from kg_graph import build_knowledge_graph
+from retriever_index import build_retriever_index, INDEX_FILE
+import instrumentation
+from pipeline_runner import Stage, PipelineRunner
 
 # === CONFIGURACIÓN ===
 EMBEDDING_MODEL = "text-embedding-3-small"
 NAMING_MODEL = "o4-mini-2025-04-16"
+NEIGHBORS_PER_CHUNK = 10
+NAMING_BATCH_TOKENS = 6000  # varios grupos por petición de nombrado; None = una petición por grupo
+RELATIONS_BATCH_TOKENS = 6000  # varios pares por petición de relaciones; None = una petición por par
+RELATIONS_TOP_K = 5  # vecinos por grupo candidatos a relación (además del umbral); None = solo umbral
+SIMILARITY_THRESHOLD = 0.75
+STATIC_LAYOUT = True  # posiciones calculadas en Python; False = física en el navegador
+CLUSTERING_BACKEND = "dense"  # "knn" para corpus grandes (grafo de vecinos aproximados)
+MIN_CLUSTER_SIZE = 2
+MIN_SAMPLES = 1
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONTRACT_PATH = os.path.join(BASE_DIR, "Listado de párrafos EPC.txt")
 BASE_DIR = os.path.join(BASE_DIR, "models")
-EMBEDDINGS_PATH = os.path.join(BASE_DIR, "embeddings.json")
-DISTANCES_PATH = os.path.join(BASE_DIR, "distances.json")
+EMBEDDINGS_PATH = os.path.join(BASE_DIR, "embeddings.npy")
+DISTANCES_PATH = os.path.join(BASE_DIR, "distances.jsonl")
 SEMANTIC_GROUPS_PATH = os.path.join(BASE_DIR, "semantic_groups.json")
 META_LABELS_PATH = os.path.join(BASE_DIR, "meta_labels.json")
 RELATIONS_PATH = os.path.join(BASE_DIR, "relations.json")
 KG_HTML_PATH = os.path.join(BASE_DIR, "kgraph.html")
+KG_GRAPH_PATH = os.path.join(BASE_DIR, "kg_graph.npz")
+RETRIEVER_INDEX_PATH = os.path.join(BASE_DIR, INDEX_FILE)
+PIPELINE_STATE_PATH = os.path.join(BASE_DIR, "pipeline_state.json")
+
+
+def artifact_paths(base_dir=None, contract_path=None):
+    """
+    Rutas de los artefactos de un contrato. Sin argumentos son las de models/ (un solo
+    contrato); corpus_build.py da a cada contrato su propio directorio.
+    """
+    if base_dir is None:
+        return {
+            "base": BASE_DIR, "contract": contract_path or CONTRACT_PATH,
+            "embeddings": EMBEDDINGS_PATH, "distances": DISTANCES_PATH,
+            "semantic_groups": SEMANTIC_GROUPS_PATH, "meta_labels": META_LABELS_PATH,
+            "relations": RELATIONS_PATH, "kg_html": KG_HTML_PATH, "kg_graph": KG_GRAPH_PATH,
+            "retriever_index": RETRIEVER_INDEX_PATH, "state": PIPELINE_STATE_PATH,
+        }
+    return {
+        "base": base_dir, "contract": contract_path or CONTRACT_PATH,
+        "embeddings": os.path.join(base_dir, "embeddings.npy"),
+        "distances": os.path.join(base_dir, "distances.jsonl"),
+        "semantic_groups": os.path.join(base_dir, "semantic_groups.json"),
+        "meta_labels": os.path.join(base_dir, "meta_labels.json"),
+        "relations": os.path.join(base_dir, "relations.json"),
+        "kg_html": os.path.join(base_dir, "kgraph.html"),
+        "kg_graph": os.path.join(base_dir, "kg_graph.npz"),
+        "retriever_index": os.path.join(base_dir, INDEX_FILE),
+        "state": os.path.join(base_dir, "pipeline_state.json"),
+    }
+
+
+def _load_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _offload(ctx, fn, *args):
+    """
+    Ejecuta una tarea de CPU en el pool de procesos de ctx["process_pool"] si lo hay
+    (corpus_build.CpuPool) o en este mismo proceso. `fn` y `args` deben ser serializables.
+    """
+    pool = ctx.get("process_pool")
+    if pool is None:
+        return fn(*args)
+    return pool.run(fn, *args)
+
+
+# === Tareas de CPU (funciones de módulo para poder mandarlas a otro proceso) ===
+def cluster_contract(paths, min_cluster_size, min_samples, backend):
+    store = load_embedding_store(paths["embeddings"])
+    try:
+        agrupamiento_semantico(store.matrix, list(store.texts), min_cluster_size=min_cluster_size,
+                               min_samples=min_samples, save_path=paths["semantic_groups"], backend=backend)
+    finally:
+        # La matriz n×n cacheada no se vuelve a usar: se libera en vez de dejarla viva hasta
+        # el final del proceso (o del worker del pool). La etapa de distancias va por bloques.
+        clear_distance_cache()
+
 
+def distances_contract(paths, top_k):
+    store = load_embedding_store(paths["embeddings"])
+    try:
+        calculate_distances(store.matrix, list(store.texts), save_path=paths["distances"], top_k=top_k)
+    finally:
+        clear_distance_cache()
 
-load_dotenv()
 
-# === INICIALIZAR CLIENTE OPENAI ===
-client = OpenAI()
+def render_graph_contract(paths, static_layout):
+    # Grafo CSR compacto que usa el retriever para la expansión de vecinos
+    build_knowledge_graph(paths["relations"], paths["meta_labels"], paths["semantic_groups"],
+                          save_path=paths["kg_graph"])
+    # Render offline: group-name embeddings are not needed for the visualization
+    # Layout precalculado (sin física en el navegador) y loneliners plegados bajo su grupo
+    meta_labels = {int(k): v for k, v in _load_json(paths["meta_labels"]).items()}
+    generate_kgraph(_load_json(paths["relations"]), meta_labels, save_path=paths["kg_html"],
+                    static_layout=static_layout, embeddings=load_embedding_store(paths["embeddings"]).matrix)
+
+
+def index_contract(paths):
+    build_retriever_index(paths["base"], save_path=paths["retriever_index"])
+
 
 # === PASO 1: Chunking y Embeddings ===
-print("[1/6] Extrayendo y embebiendo chunks...")
-buffer = extracting_and_chunking()
-embedding_dicts = calculate_chunk_embeddings(buffer, client, model=EMBEDDING_MODEL, save_path=EMBEDDINGS_PATH)
-embeddings = [item["embedding"] for item in embedding_dicts]
+def run_embeddings(ctx):
+    paths = ctx["paths"]
+    buffer = _offload(ctx, extracting_and_chunking, paths["contract"])
+    calculate_chunk_embeddings(buffer, ctx["client"], model=EMBEDDING_MODEL, save_path=paths["embeddings"],
+                               cache=ctx.get("embedding_cache"))
+    load_embeddings(ctx)
+
+
+def load_embeddings(ctx):
+    # Matriz float32 (n, d) abierta con mmap; todas las etapas trabajan sobre ella
+    store = load_embedding_store(ctx["paths"]["embeddings"])
+    ctx["buffer"] = list(store.texts)
+    ctx["embeddings"] = store.matrix
+
 
 # === PASO 2: Agrupamiento semántico ===
-print("[2/6] Calculando distancias y agrupando semánticamente...")
-calculate_distances(embeddings, buffer, save_path=DISTANCES_PATH)
-dist_matrix, semantic_groups, neighbor_groups = agrupamiento_semantico(
-    embeddings, buffer, save_path=SEMANTIC_GROUPS_PATH
-)
+def run_clustering(ctx):
+    _offload(ctx, cluster_contract, ctx["paths"], MIN_CLUSTER_SIZE, MIN_SAMPLES, CLUSTERING_BACKEND)
+    load_clustering(ctx)
+
+
+def load_clustering(ctx):
+    ctx["neighbor_groups"] = {frozenset(g["indices"]) for g in _load_json(ctx["paths"]["semantic_groups"])}
+
+
+def run_distances(ctx):
+    _offload(ctx, distances_contract, ctx["paths"], NEIGHBORS_PER_CHUNK)
+
+
+# === PASO 3: Nombrado de grupos (solo si >1 chunks) ===
+def run_naming(ctx):
+    ctx["group_labels"] = generate_titles(
+        ctx["neighbor_groups"], ctx["client"], ctx["buffer"], model=NAMING_MODEL, max_workers=10,
+        semantic_groups_path=ctx["paths"]["semantic_groups"], batch_token_budget=NAMING_BATCH_TOKENS,
+        label_cache=ctx.get("label_cache")
+    )
+
+
+def load_naming(ctx):
+    # generate_titles escribe la etiqueta de cada grupo nombrado en semantic_groups.json
+    ctx["group_labels"] = {
+        frozenset(g["indices"]): g["group_name"]
+        for g in _load_json(ctx["paths"]["semantic_groups"]) if len(g["indices"]) > 1
+    }
 
-# === PASO 3: Nombrado de grupos (solo si >2 chunks) ===
-print("[3/6] Generando nombres de grupos relevantes...")
-group_labels = generate_titles(neighbor_groups, client, buffer, model=NAMING_MODEL, max_workers=10)
 
 # === PASO 4: Meta etiquetas por párrafo ===
-print("[4/6] Generando meta etiquetas para cada chunk...")
-meta_labels = construir_meta_etiqueta(buffer, embeddings, group_labels, save_path=META_LABELS_PATH)
+def run_meta_labels(ctx):
+    ctx["meta_labels"] = construir_meta_etiqueta(ctx["buffer"], ctx["embeddings"], ctx["group_labels"],
+                                                 save_path=ctx["paths"]["meta_labels"])
+
+
+def load_meta_labels(ctx):
+    # En JSON las claves son str; en memoria construir_meta_etiqueta usa int
+    ctx["meta_labels"] = {int(k): v for k, v in _load_json(ctx["paths"]["meta_labels"]).items()}
+
 
 # === PASO 5: Relaciones entre grupos ===
-print("[5/6] Generando relaciones entre grupos semánticos...")
-definir_relaciones(meta_labels, embeddings, buffer, client, max_workers=10, output_file=RELATIONS_PATH, min_chunks=4, similarity_threshold=0.75)
+def run_relations(ctx):
+    ctx["relations"] = definir_relaciones(
+        ctx["meta_labels"], ctx["embeddings"], ctx["buffer"], ctx["client"], max_workers=10,
+        output_file=ctx["paths"]["relations"], similarity_threshold=SIMILARITY_THRESHOLD,
+        batch_token_budget=RELATIONS_BATCH_TOKENS, top_k_neighbors=RELATIONS_TOP_K,
+        relation_cache=ctx.get("relation_cache")
+    )
+
+
+def load_relations(ctx):
+    ctx["relations"] = _load_json(ctx["paths"]["relations"])
+
 
 # === PASO 6: Grafo de conocimiento ===
-print("[6/6] Generando visualización del grafo de conocimiento...")
-with open(RELATIONS_PATH, "r", encoding="utf-8") as f:
-    relations = json.load(f)
+def run_graph(ctx):
+    _offload(ctx, render_graph_contract, ctx["paths"], STATIC_LAYOUT)
+
+
+# === PASO 7: Índice del retriever (un único fichero con mmap para run_query) ===
+def run_index(ctx):
+    _offload(ctx, index_contract, ctx["paths"])
+
+
+def build_stages(paths=None):
+    paths = paths or artifact_paths()
+    return [
+        Stage("embeddings", run_embeddings, load_embeddings,
+              params={"model": EMBEDDING_MODEL}, inputs=[paths["contract"]], outputs=[paths["embeddings"]]),
+        Stage("clustering", run_clustering, load_clustering, deps=["embeddings"],
+              params={"backend": CLUSTERING_BACKEND, "min_cluster_size": MIN_CLUSTER_SIZE, "min_samples": MIN_SAMPLES},
+              outputs=[paths["semantic_groups"]]),
+        Stage("distances", run_distances, deps=["embeddings"],
+              params={"top_k": NEIGHBORS_PER_CHUNK}, outputs=[paths["distances"]]),
+        Stage("naming", run_naming, load_naming, deps=["embeddings", "clustering"],
+              params={"model": NAMING_MODEL, "batch_tokens": NAMING_BATCH_TOKENS}, outputs=[paths["semantic_groups"]]),
+        Stage("meta_labels", run_meta_labels, load_meta_labels, deps=["embeddings", "naming"],
+              outputs=[paths["meta_labels"]]),
+        Stage("relations", run_relations, load_relations, deps=["embeddings", "meta_labels"],
+              params={"similarity_threshold": SIMILARITY_THRESHOLD,
+                      "top_k": RELATIONS_TOP_K, "batch_tokens": RELATIONS_BATCH_TOKENS},
+              outputs=[paths["relations"]]),
+        Stage("graph", run_graph, deps=["embeddings", "naming", "meta_labels", "relations"],
+              params={"static_layout": STATIC_LAYOUT}, outputs=[paths["kg_graph"], paths["kg_html"]]),
+        Stage("index", run_index, deps=["embeddings", "naming", "meta_labels", "relations", "graph"],
+              outputs=[paths["retriever_index"]]),
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera el grafo de conocimiento del contrato.")
+    parser.add_argument("--from-stage", help="fuerza esta etapa y las posteriores")
+    parser.add_argument("--force", action="store_true", help="ejecuta todas las etapas")
+    parser.add_argument("--status", action="store_true", help="muestra qué etapas están al día y sale")
+    parser.add_argument("--instrument", action="store_true",
+                        help="guarda un informe de tiempos, memoria y tokens por etapa (también con CLM_INSTRUMENT=1)")
+    args = parser.parse_args(argv)
+
+    paths = artifact_paths()
+    os.makedirs(paths["base"], exist_ok=True)
+    runner = PipelineRunner(build_stages(paths), paths["state"])
+    if args.status:
+        for name, current in runner.status().items():
+            print(f"{name:12s} {'al día' if current else 'pendiente'}")
+        return
+
+    load_dotenv()
+    if args.instrument:
+        instrumentation.enable("generate_kg")
+    else:
+        instrumentation.enable_from_env("generate_kg")
+
+    # === INICIALIZAR CLIENTE OPENAI ===
+    ctx = {"client": instrumentation.instrument_client(OpenAI()), "paths": paths}
+    try:
+        runner.run(from_stage=args.from_stage, force=args.force, ctx=ctx)
+    finally:
+        instrumentation.save_report()
+
+    print("\n✅ Proceso completo. Grafo generado en:", paths["kg_html"])
 
-generate_kgraph(relations, meta_labels, client, group_labels, save_path=KG_HTML_PATH)
 
-print("\n✅ Proceso completo. Grafo generado en:", KG_HTML_PATH)
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,11 @@ import numpy as np
 def construir_meta_etiqueta(buffer, embeddings, group_labels, save_path="meta_labels.json"):
     """
     Construye etiquetas meta para todos los chunks, incluyendo loneliners como un grupo especial.
+    Los vectores no se copian: cada chunk guarda la fila que le corresponde en el embedding store.
     
     Args:
         buffer: List[str] - textos originales
-        embeddings: List[List[float]] - lista de embeddings
+        embeddings: List[List[float]] o np.ndarray - embeddings (solo se usa para validar la alineación)
         group_labels: Dict[frozenset, str] - grupos con etiquetas generadas
         save_path: str - ruta de guardado
     
@@ -16,6 +17,8 @@ def construir_meta_etiqueta(buffer, embeddings, group_labels, save_path="meta_la
     try:
         id_contract = np.random.randint(1, 1000)
         meta_labels = {}
+        if len(embeddings) != len(buffer):
+            print(f"Warning: {len(embeddings)} embeddings for {len(buffer)} chunks")
 
         # Construir un índice inverso: chunk_id → lista de grupos con nombre
         chunk_to_groups = {i: [] for i in range(len(buffer))}
@@ -27,7 +30,7 @@ def construir_meta_etiqueta(buffer, embeddings, group_labels, save_path="meta_la
             try:
                 paragraph_data = {
                     "id_contract": id_contract + i,
-                    "embedding": embeddings[i],
+                    "embedding_row": i,
                     "meta": {
                         "groups_related": chunk_to_groups[i] if chunk_to_groups[i] else ["loneliners"],
                         "text": text
@@ -1,21 +1,145 @@
 import numpy as np
 import concurrent.futures
-import itertools
 import os
 import json
 from tqdm import tqdm
 import time
-from sklearn.metrics.pairwise import cosine_similarity
+
+from distance_engine import normalize_rows, block_rows_for
+from ann_index import RandomProjectionForest
+from fingerprints import content_hash, member_hashes
+from naming_semantic_groups import parse_batch_labels, is_valid_label, request_batch
+from text_utils import estimate_tokens
+from relation_cache import RelationCache, resolve_relation_cache
+from journal import resolve_journal
+
+RELATION_MODEL = "o4-mini-2025-04-16"
+REPRESENTATIVES_FILE = "representatives.json"
+RELATION_ERRORS_FILE = "relation_errors.json"
+
+# Presupuesto del modo por lotes (tokens estimados como ~4 caracteres por token)
+BATCH_TOKEN_BUDGET = 6000
+MAX_PAIRS_PER_BATCH = 15
+
+
+def build_group_index(meta_labels):
+    """
+    Índice invertido grupo → chunk ids a partir de meta_labels, en una sola pasada.
+    Excluye el pseudo-grupo "loneliners" y conserva el orden de aparición de los grupos.
+
+    Returns:
+        Dict[str, List[int]]
+    """
+    group_index = {}
+    for i, d in meta_labels.items():
+        for g in d["meta"].get("groups_related", []):
+            if g != "loneliners":
+                group_index.setdefault(g, []).append(int(i))
+    return group_index
+
+
+def embedding_matrix(embeddings):
+    """Matriz float32 (n, d) a partir de una matriz, lista de vectores o lista de dicts con 'embedding'."""
+    if len(embeddings) and isinstance(embeddings[0], dict):
+        embeddings = [e["embedding"] for e in embeddings]
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def group_centroids(group_index, embeddings):
+    """
+    Matriz de centroides (media de los embeddings de cada grupo).
+
+    Returns:
+        group_names: List[str], fila k ↔ group_names[k]
+        centroids: np.ndarray (G, d) float32
+    """
+    X = embedding_matrix(embeddings)
+    group_names = list(group_index.keys())
+    centroids = np.empty((len(group_names), X.shape[1]), dtype=np.float32)
+    for k, g in enumerate(group_names):
+        centroids[k] = X[group_index[g]].mean(axis=0)
+    return group_names, centroids
+
+
+def candidate_pairs_by_threshold(centroids, similarity_threshold, allowed=None):
+    """
+    Pares (i, j), i < j, de centroides con similitud coseno >= similarity_threshold.
+    La matriz G×G se recorre por bloques de filas con un único producto matricial por bloque.
+
+    Args:
+        centroids: np.ndarray (G, d)
+        similarity_threshold: float (obligatorio)
+        allowed: np.ndarray (G,) bool opcional; si se da, al menos uno de los dos grupos debe estar marcado
+
+    Returns:
+        List[Tuple[int, int]] ordenada por (i, j)
+    """
+    if similarity_threshold is None:
+        raise ValueError("candidate_pairs_by_threshold requires a similarity_threshold")
+    C = normalize_rows(centroids)
+    G = C.shape[0]
+    pairs = []
+    step = block_rows_for(G)
+    for start in range(0, G, step):
+        end = min(start + step, G)
+        sims = C[start:end] @ C.T
+        rows = np.arange(start, end)[:, None]
+        cols = np.arange(G)[None, :]
+        mask = (sims >= similarity_threshold) & (cols > rows)
+        if allowed is not None:
+            mask &= allowed[start:end, None] | allowed[None, :]
+        i, j = np.nonzero(mask)
+        pairs.extend(zip((i + start).tolist(), j.tolist()))
+    return pairs
+
+
+def candidate_pairs_by_knn(centroids, k, similarity_threshold=None, allowed=None):
+    """
+    Pares (i, j), i < j, formados por cada centroide y sus k vecinos más similares según un
+    índice aproximado (RandomProjectionForest). Como mucho hay G·k pares, así que el coste
+    del etiquetado crece linealmente con el número de grupos.
+
+    Args:
+        centroids: np.ndarray (G, d)
+        k: int, vecinos por grupo
+        similarity_threshold: float opcional; descarta además los pares por debajo de esta similitud
+        allowed: np.ndarray (G,) bool opcional; si se da, al menos uno de los dos grupos debe estar marcado
+
+    Returns:
+        List[Tuple[int, int]] ordenada por (i, j)
+    """
+    G = centroids.shape[0]
+    indices, distances = RandomProjectionForest().fit(centroids).knn_graph(k)
+    rows = np.repeat(np.arange(G), indices.shape[1])
+    cols = indices.ravel()
+    keep = cols >= 0
+    if similarity_threshold is not None:
+        keep &= (1.0 - distances.ravel()) >= similarity_threshold
+    i, j = np.minimum(rows, cols)[keep], np.maximum(rows, cols)[keep]
+    if allowed is not None:
+        mask = allowed[i] | allowed[j]
+        i, j = i[mask], j[mask]
+    pairs = np.unique(np.stack([i, j], axis=1), axis=0) if len(i) else np.empty((0, 2), dtype=np.int64)
+    return [tuple(p) for p in pairs.tolist()]
 
 
 def get_representative_chunks(group_name, meta_labels, embeddings, buffer, top_k=2):
     # Obtener índices del grupo
     group_indices = [int(i) for i, d in meta_labels.items()
                      if group_name in d["meta"].get("groups_related", [])]
+    return [buffer[i] for i in representative_indices(group_indices, embedding_matrix(embeddings), buffer, top_k)]
+
 
+def representative_indices(group_indices, X, buffer, top_k=2):
+    """
+    Chunks representativos de un grupo: de los top_k*3 más cercanos al centroide,
+    los top_k más largos.
+
+    Returns:
+        List[int] con los ids de chunk seleccionados
+    """
     # Extraer embeddings del grupo
-    group_embs = [embeddings[i] for i in group_indices]
-    group_matrix = np.array(group_embs)
+    group_matrix = X[group_indices]
 
     # Calcular centroide
     centroid = np.mean(group_matrix, axis=0)
@@ -31,27 +155,124 @@ def get_representative_chunks(group_name, meta_labels, embeddings, buffer, top_k
         reverse=True
     )[:top_k]
 
-    # Devolver los textos seleccionados
-    return [text for _, text in top_sorted]
+    # Devolver los chunks seleccionados
+    return [group_indices[i] for i, _ in top_sorted]
+
+
+def compute_representatives(group_index, embeddings, buffer, top_k=2, max_workers=10, save_path=None):
+    """
+    Calcula una sola vez los chunks representativos de cada grupo, en paralelo.
+
+    Si `save_path` existe, se reutilizan las entradas de grupos cuya composición (huella de
+    sus textos) no ha cambiado, y el resultado se vuelve a guardar ahí para próximas
+    ejecuciones y para el retriever.
+
+    Returns:
+        Dict[str, Dict] grupo → {"membership": huella, "indices": [ids], "texts": [textos]}
+    """
+    previous = {}
+    if save_path and os.path.exists(save_path):
+        try:
+            with open(save_path, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+            if stored.get("top_k") == top_k:
+                previous = stored.get("groups", {})
+        except Exception as e:
+            print(f"Error loading representatives from '{save_path}': {e}")
+
+    X = embedding_matrix(embeddings)
+    representatives = {}
+    pending = {}
+    for group, indices in group_index.items():
+        membership = content_hash(top_k, *sorted(member_hashes(buffer[i] for i in indices)))
+        cached = previous.get(group)
+        if cached is not None and cached.get("membership") == membership:
+            representatives[group] = cached
+        else:
+            pending[group] = (indices, membership)
+
+    def compute(group):
+        indices, membership = pending[group]
+        chosen = representative_indices(indices, X, buffer, top_k)
+        return group, {"membership": membership, "indices": chosen, "texts": [buffer[i] for i in chosen]}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for group, entry in executor.map(compute, pending):
+            representatives[group] = entry
+    print(f"Representative chunks: {len(pending)} groups computed, {len(group_index) - len(pending)} reused.")
+
+    if save_path:
+        try:
+            with open(save_path, 'w', encoding='utf-8') as f:
+                json.dump({"top_k": top_k, "groups": representatives}, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            print(f"Error saving representatives: {e}")
+    return representatives
+
+
+def build_relationship_prompt(group_a, group_b, text_a, text_b):
+    return (
+        "You are an EPC legal assistant. Below are excerpts from two groups of contract clauses.\n"
+        "Each group consists of semantically similar legal content.\n"
+        "Identify and describe the key legal or functional relationship between the two groups,\n"
+        "using a short, ontological label.\n\n"
+        f"Group A – '{group_a}':\n" + "\n".join(f"- {chunk}" for chunk in text_a) + "\n\n"
+        f"Group B – '{group_b}':\n" + "\n".join(f"- {chunk}" for chunk in text_b) + "\n\n"
+        "Return only the relationship as a concise phrase (e.g., 'Contractual Dependency', 'Shared Trigger Event')."
+    )
+
 
+def build_relationship_batch_prompt(keyed_pairs):
+    """Prompt que pide una relación por par, indexada por id de par, como objeto JSON."""
+    blocks = []
+    for key, (group_a, group_b, text_a, text_b) in keyed_pairs:
+        blocks.append(
+            f"### Pair {key}\n"
+            f"Group A – '{group_a}':\n" + "\n".join(f"- {chunk}" for chunk in text_a) + "\n"
+            f"Group B – '{group_b}':\n" + "\n".join(f"- {chunk}" for chunk in text_b)
+        )
+
+    example = ", ".join(f'"{key}": "..."' for key, _ in keyed_pairs[:2])
+    return (
+        "You are an EPC legal assistant. Below are several pairs of groups of contract clauses.\n"
+        "Each group consists of semantically similar legal content.\n"
+        "For each pair, identify the key legal or functional relationship from Group A to Group B,\n"
+        "using a short, ontological label (e.g., 'Contractual Dependency', 'Shared Trigger Event').\n\n"
+        "Return only a JSON object whose keys are the pair ids and whose values are the relationships, "
+        f"e.g. {{{example}}}. No explanation.\n\n"
+        "Here are the pairs:\n\n"
+        + "\n\n".join(blocks)
+    )
+
+
+def make_pair_batches(pairs, representatives, token_budget=BATCH_TOKEN_BUDGET, max_pairs=MAX_PAIRS_PER_BATCH):
+    """
+    Agrupa pares en lotes cuyo prompt estimado no supera `token_budget`.
+    Un par que por sí solo supera el presupuesto va en un lote propio.
+    """
+    batches, current, current_tokens = [], [], 0
+    for group_a, group_b in pairs:
+        texts = representatives[group_a]["texts"] + representatives[group_b]["texts"]
+        tokens = sum(estimate_tokens(t) for t in texts) + estimate_tokens(group_a + group_b) + 10
+        if current and (current_tokens + tokens > token_budget or len(current) >= max_pairs):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append((group_a, group_b))
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
 
-def process_relationship(group_a, group_b, text_a, text_b, client):
+
+def process_relationship(group_a, group_b, text_a, text_b, client, model=RELATION_MODEL):
     """
     Procesa la relación entre dos grupos con sus textos representativos.
     """
     try:
-        prompt = (
-            "You are an EPC legal assistant. Below are excerpts from two groups of contract clauses.\n"
-            "Each group consists of semantically similar legal content.\n"
-            "Identify and describe the key legal or functional relationship between the two groups,\n"
-            "using a short, ontological label.\n\n"
-            f"Group A – '{group_a}':\n" + "\n".join(f"- {chunk}" for chunk in text_a) + "\n\n"
-            f"Group B – '{group_b}':\n" + "\n".join(f"- {chunk}" for chunk in text_b) + "\n\n"
-            "Return only the relationship as a concise phrase (e.g., 'Contractual Dependency', 'Shared Trigger Event')."
-        )
+        prompt = build_relationship_prompt(group_a, group_b, text_a, text_b)
 
         response = client.responses.create(
-            model="o4-mini-2025-04-16",
+            model=model,
             input=[
                 {"role": "system", "content": "You are an expert in legal ontology and contract analysis."},
                 {"role": "user", "content": prompt}
@@ -66,73 +287,244 @@ def process_relationship(group_a, group_b, text_a, text_b, client):
         return group_a, group_b, f"Error: {str(e)}"
 
 
-def definir_relaciones(meta_labels, embeddings, buffer, client, max_workers=10, output_file="relations.json", min_chunks=4, similarity_threshold=0.75):
+def process_relationship_batch(pairs, representatives, client, model=RELATION_MODEL):
+    """
+    Etiqueta varios pares con una sola petición, reintentada como una unidad (ver
+    naming_semantic_groups.request_batch). Si la petición falla, todos los pares del lote
+    quedan como "Error:" (y van a relation_errors.json); solo los pares que faltan o vienen
+    mal formados en una respuesta correcta se procesan uno a uno con process_relationship.
+
+    Returns:
+        List[(group_a, group_b, relation)]
+    """
+    keyed = {f"P{k + 1}": pair for k, pair in enumerate(pairs)}
+    prompt = build_relationship_batch_prompt([
+        (key, (a, b, representatives[a]["texts"], representatives[b]["texts"])) for key, (a, b) in keyed.items()
+    ])
+    try:
+        output_text = request_batch(client, model, "You are an expert in legal ontology and contract analysis.", prompt)
+    except Exception as e:
+        print(f"Error processing batch of {len(pairs)} relationships: {e}")
+        return [(group_a, group_b, f"Error: {str(e)}") for group_a, group_b in pairs]
+    relations = parse_batch_labels(output_text)
+
+    results = []
+    for key, (group_a, group_b) in keyed.items():
+        relation = relations.get(key)
+        if is_valid_label(relation):
+            results.append((group_a, group_b, relation.strip()))
+        else:
+            results.append(process_relationship(group_a, group_b, representatives[group_a]["texts"],
+                                                representatives[group_b]["texts"], client, model))
+    return results
+
+
+def definir_relaciones(meta_labels, embeddings, buffer, client, max_workers=10, output_file="relations.json", min_chunks=4, similarity_threshold=0.75,
+                       only_groups=None, model=RELATION_MODEL, relation_cache=None, batch_token_budget=None,
+                       retry_failed=False, top_k_neighbors=None, journal=None):
+    """
+    Etiqueta con el LLM las relaciones entre pares de grupos cuyos centroides son similares.
+
+    Si se pasa `only_groups`, solo se procesan los pares en los que interviene alguno de esos
+    grupos y el resultado se fusiona con el `output_file` existente (se descartan las relaciones
+    antiguas de esos grupos y se conservan las demás).
+
+    Los pares que fallan no se escriben en `output_file`: se registran en relation_errors.json
+    (junto a él); con `only_groups` se conservan los fallos anteriores de los demás pares.
+    Con `retry_failed=True` solo se reenvían esos pares y sus resultados se
+    fusionan con las relaciones existentes.
+
+    relation_cache: RelationCache de ejecuciones anteriores (None usa models/relation_cache.json,
+        False la desactiva); los pares con los mismos textos representativos no se reenvían
+    batch_token_budget: si se indica, se etiquetan varios pares por petición hasta este tamaño
+        estimado de prompt (ver process_relationship_batch); None envía una petición por par
+    top_k_neighbors: si se indica, cada grupo se empareja solo con sus k grupos más similares
+        (índice aproximado sobre los centroides); `similarity_threshold`, si no es None, filtra
+        además esos pares. Sin él se usan todos los pares por encima del umbral; si faltan
+        los dos se lanza ValueError.
+    min_chunks: sin efecto; se mantiene por compatibilidad con llamadas anteriores
+    journal: Journal donde se añade cada relación en cuanto llega, para que una ejecución
+        interrumpida se reanude sin volver a pagarlas (None usa `<output_file>.journal.jsonl`,
+        False lo desactiva)
+    """
 
-    def group_embedding(group_name):
-        indices = [i for i, d in meta_labels.items() if group_name in d["meta"].get("groups_related", [])]
-        if not indices:
-            return None
-        group_embs = [embeddings[i]["embedding"] if isinstance(embeddings[i], dict) else embeddings[i] for i in indices]
-        return np.mean(group_embs, axis=0)
+    if similarity_threshold is None and not top_k_neighbors:
+        raise ValueError("definir_relaciones needs similarity_threshold and/or top_k_neighbors to select candidate pairs")
 
     start_time = time.time()
     relations = {}
-    relationship_pairs = set()
+    errors_path = os.path.join(os.path.dirname(os.path.abspath(output_file)), RELATION_ERRORS_FILE)
 
-    # Recolectar grupos con nombre (excluye loneliners)
-    group_sizes = {}
-    for d in meta_labels.values():
-        for g in d["meta"].get("groups_related", []):
-            if g != "loneliners":
-                group_sizes[g] = group_sizes.get(g, 0) + 1
+    # Índice invertido grupo → chunks (excluye loneliners) y matriz de centroides
+    group_index = build_group_index(meta_labels)
 
-    all_groups = sorted(group_sizes.keys())
+    if retry_failed:
+        relationship_pairs = [
+            (e["group_a"], e["group_b"]) for e in _load_relation_errors(errors_path)
+            if e["group_a"] in group_index and e["group_b"] in group_index
+        ]
+    else:
+        group_names, centroids = group_centroids(group_index, embeddings)
 
-    # Calcular embeddings promedio por grupo (filtrando por tamaño mínimo)
-    group_vectors = {
-        #g: group_embedding(g) for g, size in group_sizes.items() if size >= min_chunks
-        g: group_embedding(g) for g in group_sizes.keys()
+        allowed = None
+        if only_groups is not None:
+            allowed = np.array([g in only_groups for g in group_names], dtype=bool)
+        if top_k_neighbors:
+            # k vecinos por grupo: número de pares acotado por G·k
+            candidates = candidate_pairs_by_knn(centroids, top_k_neighbors, similarity_threshold, allowed)
+        else:
+            # Todos los pares candidatos de una vez: producto matricial por bloques + máscara de umbral
+            candidates = candidate_pairs_by_threshold(centroids, similarity_threshold, allowed)
+        relationship_pairs = [(group_names[i], group_names[j]) for i, j in candidates]
 
-    }
+    print(f"Found {len(relationship_pairs)} relevant group relationships to process")
 
-    # Generar combinaciones únicas y filtrar por similitud
-    group_names = list(group_vectors.keys())
-    for a, b in itertools.combinations(group_names, 2):
-        emb_a, emb_b = group_vectors[a], group_vectors[b]
-        if emb_a is None or emb_b is None:
-            continue
-        sim = cosine_similarity([emb_a], [emb_b])[0][0]
-        if sim >= similarity_threshold:
-            relationship_pairs.add((a, b))
+    # Representativos de cada grupo calculados una vez (y reutilizados entre ejecuciones)
+    representatives_path = os.path.join(os.path.dirname(os.path.abspath(output_file)), REPRESENTATIVES_FILE)
+    representatives = compute_representatives(group_index, embeddings, buffer, max_workers=max_workers,
+                                              save_path=representatives_path)
 
-    print(f"Found {len(relationship_pairs)} relevant group relationships to process")
+    # Pares ya etiquetados en ejecuciones anteriores con los mismos representativos
+    relation_cache = resolve_relation_cache(relation_cache)
+    pending = []
+    for group_a, group_b in relationship_pairs:
+        cached = None
+        if relation_cache is not None:
+            cached = relation_cache.get(representatives[group_a]["texts"], representatives[group_b]["texts"], model)
+        if cached is not None:
+            relations.setdefault(group_a, {})[group_b] = cached
+        else:
+            pending.append((group_a, group_b))
+    if relation_cache is not None:
+        print(f"Reused {len(relationship_pairs) - len(pending)} relationships from cache. {len(pending)} pairs to label.")
+
+    # Relaciones ya pagadas por una ejecución interrumpida (mismos representativos y modelo)
+    def pair_key(group_a, group_b):
+        return RelationCache.key(representatives[group_a]["texts"], representatives[group_b]["texts"], model)
 
+    journal = resolve_journal(journal, output_file, signature=content_hash("relations", model))
+    if journal is not None:
+        journaled = {(r["group_a"], r["group_b"], r["key"]): r["relation"] for r in journal.replay()}
+        still_pending = []
+        for group_a, group_b in pending:
+            relation = journaled.get((group_a, group_b, pair_key(group_a, group_b)))
+            if relation is None:
+                still_pending.append((group_a, group_b))
+                continue
+            relations.setdefault(group_a, {})[group_b] = relation
+            if relation_cache is not None:
+                relation_cache.put(representatives[group_a]["texts"], representatives[group_b]["texts"], model, relation)
+        pending = still_pending
+
+    # Número de peticiones conocido antes de llamar al LLM
+    batches = make_pair_batches(pending, representatives, token_budget=batch_token_budget) if batch_token_budget else None
+    print(f"Labeling {len(pending)} pairs in {len(batches) if batches is not None else len(pending)} requests.")
+
+    errors = []
     with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_pair = {}
-        for group_a, group_b in relationship_pairs:
-            text_a = get_representative_chunks(group_a, meta_labels, embeddings, buffer)
-            text_b = get_representative_chunks(group_b, meta_labels, embeddings, buffer)
-            future = executor.submit(process_relationship, group_a, group_b, text_a, text_b, client)
-            future_to_pair[future] = (group_a, group_b)
-
-        for future in tqdm(concurrent.futures.as_completed(future_to_pair), total=len(future_to_pair), desc="Processing relationships"):
+        future_to_pairs = {}
+        if batch_token_budget:
+            for batch in batches:
+                future = executor.submit(process_relationship_batch, batch, representatives, client, model)
+                future_to_pairs[future] = batch
+        else:
+            for group_a, group_b in pending:
+                text_a = representatives[group_a]["texts"]
+                text_b = representatives[group_b]["texts"]
+                future = executor.submit(process_relationship, group_a, group_b, text_a, text_b, client, model)
+                future_to_pairs[future] = [(group_a, group_b)]
+
+        for future in tqdm(concurrent.futures.as_completed(future_to_pairs), total=len(future_to_pairs), desc="Processing relationships"):
             try:
-                group_a, group_b, relation = future.result()
-                if group_a not in relations:
-                    relations[group_a] = {}
-                relations[group_a][group_b] = relation
+                result = future.result()
+                for group_a, group_b, relation in (result if batch_token_budget else [result]):
+                    if relation.startswith("Error:"):
+                        errors.append({"group_a": group_a, "group_b": group_b, "error": relation[len("Error:"):].strip()})
+                        continue
+                    relations.setdefault(group_a, {})[group_b] = relation
+                    if journal is not None:
+                        journal.append({"group_a": group_a, "group_b": group_b,
+                                        "key": pair_key(group_a, group_b), "relation": relation})
+                    if relation_cache is not None:
+                        relation_cache.put(representatives[group_a]["texts"], representatives[group_b]["texts"],
+                                           model, relation)
             except Exception as e:
-                a, b = future_to_pair[future]
-                print(f"Error retrieving result for pair ({a}, {b}): {e}")
+                for a, b in future_to_pairs[future]:
+                    print(f"Error retrieving result for pair ({a}, {b}): {e}")
+                    errors.append({"group_a": a, "group_b": b, "error": str(e)})
 
     elapsed_time = time.time() - start_time
     print(f"Processed {sum(len(v) for v in relations.values())} relationships in {elapsed_time:.2f} seconds.")
 
+    if relation_cache is not None:
+        relation_cache.save()
+        print(f"Relation cache: {relation_cache.stats()}")
+
+    if errors:
+        print(f"{len(errors)} relationships failed; see '{errors_path}' and rerun with retry_failed=True.")
+    if only_groups is not None and not retry_failed:
+        errors = _merge_relation_errors(errors_path, errors, only_groups)
+    _save_relation_errors(errors_path, errors)
+
+    if retry_failed:
+        relations = _merge_relations(output_file, relations, set())
+    elif only_groups is not None:
+        relations = _merge_relations(output_file, relations, only_groups)
+
     try:
         with open(output_file, 'w', encoding='utf-8') as f:
             json.dump(relations, f, ensure_ascii=False, indent=2)
         print(f"Saved relationships to '{output_file}'")
+        if journal is not None:
+            journal.discard()
     except Exception as e:
         print(f"Error saving relationships: {e}")
 
     return relations
+
+
+def _load_relation_errors(errors_path):
+    try:
+        with open(errors_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def _save_relation_errors(errors_path, errors):
+    """Guarda los pares fallidos; si no hay ninguno, elimina el fichero de una ejecución anterior."""
+    try:
+        if errors:
+            with open(errors_path, 'w', encoding='utf-8') as f:
+                json.dump(errors, f, ensure_ascii=False, indent=2)
+        elif os.path.exists(errors_path):
+            os.remove(errors_path)
+    except Exception as e:
+        print(f"Error saving relation errors: {e}")
+
+
+def _merge_relation_errors(errors_path, new_errors, only_groups):
+    """Fallos previos de pares que no tocan `only_groups` (no se han reintentado), más los nuevos."""
+    kept = [e for e in _load_relation_errors(errors_path)
+            if e["group_a"] not in only_groups and e["group_b"] not in only_groups]
+    return kept + new_errors
+
+
+def _merge_relations(output_file, new_relations, only_groups):
+    """Relaciones de `output_file` sin las que tocan `only_groups`, más las nuevas."""
+    try:
+        with open(output_file, 'r', encoding='utf-8') as f:
+            existing = json.load(f)
+    except FileNotFoundError:
+        existing = {}
+
+    merged = {}
+    for group_a, targets in existing.items():
+        if group_a in only_groups:
+            continue
+        kept = {b: rel for b, rel in targets.items() if b not in only_groups}
+        if kept:
+            merged[group_a] = kept
+    for group_a, targets in new_relations.items():
+        merged.setdefault(group_a, {}).update(targets)
+    return merged
@@ -1,43 +1,60 @@
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import normalize
-from sklearn.metrics.pairwise import cosine_distances
-
-
 import numpy as np
 import json
 import os
 import hdbscan
+from scipy.sparse.csgraph import connected_components
+
+# Funciones internas de hdbscan (probadas con 0.8.x): sus firmas han cambiado entre versiones,
+# así que si no se pueden importar se recurre a hdbscan.HDBSCAN(metric='precomputed').
+try:
+    from hdbscan._hdbscan_linkage import label as hdbscan_label
+    from hdbscan.hdbscan_ import _tree_to_labels as hdbscan_tree_to_labels
+except ImportError:
+    hdbscan_label = hdbscan_tree_to_labels = None
 
+from distance_engine import block_rows_for, get_distance_matrix, iter_distance_blocks
+from ann_index import RandomProjectionForest, knn_distance_matrix
 
 
-def calculate_distances(embeddings, buffer, save_path="distances.json"):
+def calculate_distances(embeddings, buffer, save_path="distances.json", top_k=None, max_distance=None, block_size=1024):
     """
     Calcula distancias basadas en cosine similarity entre pares de embeddings y guarda los resultados.
+
+    Si se indica `top_k` y/o `max_distance` se usa el modo streaming: las similitudes se calculan
+    por bloques de filas y solo se conservan, para cada chunk, sus `top_k` vecinos más cercanos
+    (y/o los que estén a distancia <= `max_distance`). Se escribe un JSONL con una línea por chunk
+    y sin copiar los textos, así que la memoria no depende del número de pares.
+
+    Las distancias salen del motor compartido (distance_engine): si la matriz de estos
+    embeddings ya se calculó para el agrupamiento, se reutiliza en vez de recalcularla.
     
     Args:
         embeddings: List[List[float]] - lista de vectores de embedding.
         buffer: List[str] - textos originales correspondientes a cada embedding.
-        save_path: str - ruta del archivo JSON de salida.
+        save_path: str - ruta del archivo JSON de salida (JSONL en modo streaming).
+        top_k: int - vecinos a conservar por chunk (modo streaming).
+        max_distance: float - distancia coseno máxima de los pares a conservar (modo streaming).
+        block_size: int - filas por bloque en modo streaming.
         
     Returns:
-        List[Dict] con pares de texto y su distancia semántica.
+        List[Dict] con pares de texto y su distancia semántica, o en modo streaming
+        el número de pares (chunk, vecino) escritos.
     """
     if isinstance(embeddings[0], dict):
         embeddings = [e["embedding"] for e in embeddings]
 
-    # Convertimos la lista de listas a matriz numpy para eficiencia
-    X = np.array(embeddings)
-    
-    # Calculamos la matriz de similitud coseno
-    similarity_matrix = cosine_similarity(X)
+    if top_k is not None or max_distance is not None:
+        return _stream_neighbor_distances(embeddings, save_path, top_k, max_distance, block_size)
+
+    # Matriz de distancias coseno compartida (float32, calculada por bloques)
+    distance_matrix = get_distance_matrix(embeddings)
     
     results = []
     n = len(buffer)
     
     for i in range(n):
         for j in range(i + 1, n):
-            sim = similarity_matrix[i, j]
-            distance = 1 - sim  # entre 0 (idéntico) y 2 (opuesto)
+            distance = float(distance_matrix[i, j])  # entre 0 (idéntico) y 2 (opuesto)
             results.append({
                 "text_pair": [buffer[i], buffer[j]],
                 "distance": round(distance, 5)
@@ -51,11 +68,189 @@ def calculate_distances(embeddings, buffer, save_path="distances.json"):
     return results
 
 
+def _stream_neighbor_distances(embeddings, save_path, top_k, max_distance, block_size):
+    """
+    Escribe en `save_path` una línea JSON por chunk: {"id": i, "neighbors": [j, ...], "distances": [d, ...]}
+    con los vecinos ordenados por distancia creciente.
+    """
+    n = len(embeddings)
+    k = min(top_k, n - 1) if top_k is not None else None
+
+    written = 0
+    with open(save_path, 'w', encoding='utf-8') as f:
+        for start, end, block in iter_distance_blocks(embeddings, block_size):
+            # Copia del bloque (puede ser una vista de la matriz compartida) y exclusión del propio chunk
+            distances = np.array(block, dtype=np.float32)
+            distances[np.arange(end - start), np.arange(start, end)] = np.inf
+
+            if k is not None and k > 0:
+                candidates = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            else:
+                candidates = np.broadcast_to(np.arange(n), (end - start, n))
+
+            for row in range(end - start):
+                cols = candidates[row]
+                dists = distances[row, cols]
+                keep = np.isfinite(dists)
+                if max_distance is not None:
+                    keep &= dists <= max_distance
+                cols, dists = cols[keep], dists[keep]
+                order = np.argsort(dists, kind="stable")
+                f.write(json.dumps({
+                    "id": start + row,
+                    "neighbors": cols[order].tolist(),
+                    "distances": np.round(dists[order].astype(np.float64), 5).tolist()
+                }) + "\n")
+                written += len(cols)
+
+    print(f"Guardados {written} pares (chunk, vecino) de {n} chunks en '{save_path}'")
+    return written
+
+
+def cluster_labels(embeddings, min_cluster_size=2, min_samples=1, cluster_selection_epsilon=0.0,
+                   cluster_selection_method='eom', backend="dense", n_neighbors=15):
+    """
+    Etiqueta cada embedding con su cluster HDBSCAN (-1 = ruido / loneliner).
+
+    - backend="dense": HDBSCAN sobre la matriz de distancias n×n completa (distance_engine).
+    - backend="knn": HDBSCAN sobre un grafo disperso de `n_neighbors` vecinos aproximados
+      (ann_index.RandomProjectionForest); memoria O(n·k) en lugar de O(n²).
+
+    Returns:
+        labels: np.ndarray (n,) de enteros
+        dist_matrix: matriz densa float32 (dense) o CSR dispersa con las aristas kNN (knn)
+    """
+    if backend == "dense":
+        # Matriz de distancias coseno compartida: float32, por bloques, diagonal 0 y valores >= 0.
+        # Se calcula una vez por conjunto de embeddings y la reutilizan los demás consumidores.
+        dist_matrix = get_distance_matrix(embeddings)
+        labels = _dense_hdbscan_labels(dist_matrix, min_cluster_size, min_samples, cluster_selection_epsilon,
+                                       cluster_selection_method)
+        return labels, dist_matrix
+
+    if backend == "knn":
+        return _knn_cluster_labels(embeddings, min_cluster_size, min_samples, cluster_selection_epsilon,
+                                   cluster_selection_method, n_neighbors)
+
+    raise ValueError(f"Unknown clustering backend '{backend}' (expected 'dense' or 'knn')")
+
+
+def _dense_hdbscan_labels(dist_matrix, min_cluster_size, min_samples, cluster_selection_epsilon,
+                          cluster_selection_method):
+    """
+    HDBSCAN 'precomputed' sobre la matriz float32 compartida sin ninguna copia n×n.
+
+    hdbscan.HDBSCAN(metric='precomputed') exige float64 y además copia la matriz para
+    transformarla en la de alcanzabilidad mutua: 16n² bytes extra sobre los 4n² de la matriz
+    (y 24n² de pico al calcular las distancias núcleo). Aquí se reproducen sus mismos pasos
+    con memoria O(n) adicional:
+      1. distancias núcleo por bloques de filas (np.partition, igual que hdbscan);
+      2. árbol de expansión mínima con Prim sobre la alcanzabilidad mutua, calculando cada
+         fila max(d(i, j), core(i), core(j)) al vuelo (mismo nodo inicial y desempates que
+         mst_linkage_core);
+      3. árbol de enlace simple, condensado y selección de clusters con las funciones de hdbscan.
+    El resultado coincide con el de fit_predict sobre la misma matriz. Si la versión instalada
+    de hdbscan no expone esas funciones internas se usa fit_predict directamente (con la copia).
+    """
+    n = dist_matrix.shape[0]
+    if n < 2:
+        return np.full(n, -1, dtype=np.int64)
+
+    if hdbscan_label is None:
+        clusterer = hdbscan.HDBSCAN(
+            metric='precomputed',
+            min_cluster_size=min_cluster_size,
+            min_samples=min_samples,
+            cluster_selection_epsilon=cluster_selection_epsilon,
+            cluster_selection_method=cluster_selection_method,
+            allow_single_cluster=False,  # Evita que todo se agrupe en un solo cluster
+        )
+        return clusterer.fit_predict(dist_matrix.astype(np.float64)).astype(np.int64)
+
+    # 1. Distancia núcleo: distancia al min_samples-ésimo vecino (contando el propio punto)
+    min_points = min(n - 1, min_samples)
+    core = np.empty(n, dtype=np.float32)
+    step = block_rows_for(n)
+    for start in range(0, n, step):
+        end = min(start + step, n)
+        core[start:end] = np.partition(dist_matrix[start:end], min_points, axis=1)[:, min_points]
+
+    # 2. Prim sobre la alcanzabilidad mutua, empezando en el nodo 0
+    in_tree = np.zeros(n, dtype=bool)
+    current_distances = np.full(n, np.inf, dtype=np.float32)
+    current_sources = np.zeros(n, dtype=np.intp)
+    row = np.empty(n, dtype=np.float32)
+    mst = np.empty((n - 1, 3), dtype=np.float64)
+    current = 0
+    for i in range(n - 1):
+        in_tree[current] = True
+        current_distances[current] = np.inf
+        np.maximum(dist_matrix[current], core, out=row)
+        np.maximum(row, core[current], out=row)
+        row[in_tree] = np.inf
+        closer = row < current_distances
+        current_distances[closer] = row[closer]
+        current_sources[closer] = current
+        new = int(np.argmin(current_distances))
+        mst[i] = (current_sources[new], new, current_distances[new])
+        current = new
+
+    # 3. Jerarquía y selección de clusters (mismas funciones que usa hdbscan internamente)
+    mst = mst[np.argsort(mst.T[2]), :]
+    single_linkage_tree = hdbscan_label(mst)
+    labels = hdbscan_tree_to_labels(
+        None, single_linkage_tree, min_cluster_size, cluster_selection_method,
+        allow_single_cluster=False,  # Evita que todo se agrupe en un solo cluster
+        cluster_selection_epsilon=cluster_selection_epsilon,
+    )[0]
+    return labels.astype(np.int64)
+
+
+def _knn_cluster_labels(embeddings, min_cluster_size, min_samples, cluster_selection_epsilon,
+                        cluster_selection_method, n_neighbors):
+    n = len(embeddings)
+    indices, distances = RandomProjectionForest().fit(embeddings).knn_graph(max(n_neighbors, min_samples))
+    graph = knn_distance_matrix(indices, distances, n)
+
+    # El HDBSCAN disperso exige un grafo conexo: se agrupa cada componente por separado.
+    # Con varias componentes, una componente compacta puede ser un cluster por sí sola
+    # (igual que en el modo denso, donde quedaría separada del resto).
+    n_components, component = connected_components(graph, directed=False)
+    labels = np.full(n, -1, dtype=np.int64)
+    next_label = 0
+    for c in range(n_components):
+        members = np.flatnonzero(component == c)
+        if len(members) < min_cluster_size:
+            continue
+        clusterer = hdbscan.HDBSCAN(
+            metric='precomputed',
+            min_cluster_size=min_cluster_size,
+            min_samples=min_samples,
+            cluster_selection_epsilon=cluster_selection_epsilon,
+            cluster_selection_method=cluster_selection_method,
+            allow_single_cluster=n_components > 1,
+        )
+        try:
+            component_labels = clusterer.fit_predict(graph[members][:, members])
+        except ValueError as e:
+            # Componente demasiado pequeña o dispersa para construir el árbol: sus chunks quedan
+            # como ruido (loneliners) en vez de inventar un grupo que HDBSCAN no ha encontrado
+            print(f"Componente {c} ({len(members)} chunks) sin agrupar, se marca como ruido: {e}")
+            component_labels = np.full(len(members), -1, dtype=np.int64)
+        clustered = component_labels >= 0
+        if clustered.any():
+            labels[members[clustered]] = component_labels[clustered] + next_label
+            next_label += component_labels.max() + 1
+    return labels, graph
+
+
 def agrupamiento_semantico(embeddings, buffer, min_cluster_size=2, min_samples=1, 
                          cluster_selection_epsilon=0.0, cluster_selection_method='eom',
-                         save_path="semantic_groups.json"):
+                         save_path="semantic_groups.json", backend="dense", n_neighbors=15):
     """
     Agrupa semánticamente los embeddings usando HDBSCAN con parámetros optimizados.
+    Con backend="knn" el agrupamiento se hace sobre un grafo de vecinos aproximados en lugar
+    de la matriz densa (ver cluster_labels); la salida tiene el mismo formato.
     
     Args:
         embeddings: List[List[float]], lista de embeddings.
@@ -65,35 +260,26 @@ def agrupamiento_semantico(embeddings, buffer, min_cluster_size=2, min_samples=1
         cluster_selection_epsilon: float, umbral de epsilon para selección de clusters.
         cluster_selection_method: str, método de selección ('eom' o 'leaf').
         save_path: str, ruta del archivo JSON de salida.
+        backend: str, 'dense' (matriz completa) o 'knn' (grafo de vecinos aproximados).
+        n_neighbors: int, vecinos por chunk del grafo en el backend 'knn'.
     
     Returns:
-        dist_matrix: np.ndarray de similitud coseno normalizada
+        dist_matrix: np.ndarray float32 de distancias coseno (buffer compartido de solo lectura),
+            o matriz CSR dispersa con las distancias del grafo kNN en el backend 'knn'.
         groups_text: List[List[str]] con los textos agrupados
         neighbor_groups: Set[frozenset] de índices agrupados
     """
-    print("Realizando agrupamiento semántico con HDBSCAN...")
+    print(f"Realizando agrupamiento semántico con HDBSCAN (backend '{backend}')...")
 
-    # Preparamos los embeddings y calculamos matriz de distancias coseno
-    X = np.array(embeddings)
-    X_norm = normalize(X)  # Normalizar para cosine similarity
-    
-    # Calcular matriz de distancias coseno manualmente
-    cosine_distances = 1 - np.dot(X_norm, X_norm.T)
-    # Asegurar que la diagonal sea 0 y valores sean no negativos
-    np.fill_diagonal(cosine_distances, 0)
-    cosine_distances = np.maximum(cosine_distances, 0)
-
-    # Configuración optimizada de HDBSCAN para más grupos
-    clusterer = hdbscan.HDBSCAN(
-        metric='precomputed',  # Usar matriz precomputada
+    labels, dist_matrix = cluster_labels(
+        embeddings,
         min_cluster_size=min_cluster_size,
         min_samples=min_samples,
         cluster_selection_epsilon=cluster_selection_epsilon,
         cluster_selection_method=cluster_selection_method,
-        allow_single_cluster=False,  # Evita que todo se agrupe en un solo cluster
+        backend=backend,
+        n_neighbors=n_neighbors,
     )
-    
-    labels = clusterer.fit_predict(cosine_distances)
 
     # Analizar la calidad del clustering
     n_clusters = len(set(labels)) - (1 if -1 in labels else 0)
@@ -129,7 +315,6 @@ def agrupamiento_semantico(embeddings, buffer, min_cluster_size=2, min_samples=1
     print(f"Número de grupos con más de 2 chunks: {len([g for g in groups_with_indices if len(g['indices']) > 2])}")
     
     # Devolvemos estructuras útiles para pasos siguientes
-    dist_matrix = 1 - np.dot(X_norm, X_norm.T)  # matriz de "distancias" coseno
     groups_text = [group["paragraphs"] for group in groups_with_indices]
     neighbor_groups = {frozenset(group["indices"]) for group in groups_with_indices}
 
@@ -0,0 +1,111 @@
+import numpy as np
+
+# Por encima de este número de nodos la repulsión se calcula contra una muestra aleatoria
+EXACT_REPULSION_MAX_NODES = 1000
+# Tope de elementos de los tensores intermedios (float32) al calcular repulsiones
+MAX_WORK_ELEMENTS = 2 ** 24
+
+
+def pca_projection(vectors, dims=2):
+    """
+    Proyección de las filas de `vectors` sobre sus `dims` componentes principales,
+    escalada a desviación típica 1 por eje.
+
+    Returns:
+        np.ndarray (n, dims) float32
+    """
+    X = np.asarray(vectors, dtype=np.float32)
+    n = X.shape[0]
+    if n == 0:
+        return np.zeros((0, dims), dtype=np.float32)
+    centered = X - X.mean(axis=0)
+    _, _, vt = np.linalg.svd(centered, full_matrices=False)
+    proj = np.zeros((n, dims), dtype=np.float32)
+    k = min(dims, vt.shape[0])
+    proj[:, :k] = centered @ vt[:k].T
+    std = proj.std(axis=0)
+    std[std == 0] = 1.0
+    return proj / std
+
+
+def force_layout(initial_positions, edges, iterations=50, seed=0, sample_size=EXACT_REPULSION_MAX_NODES):
+    """
+    Layout de fuerzas (Fruchterman-Reingold) vectorizado con NumPy.
+
+    Todos los nodos se repelen (k²/d) y los extremos de cada arista se atraen (d²/k). Con más
+    de `sample_size` nodos, en cada iteración la repulsión se calcula contra una muestra
+    aleatoria de nodos y se reescala, de modo que el coste por iteración es lineal.
+
+    Args:
+        initial_positions: np.ndarray (n, 2), posiciones de partida (p. ej. pca_projection)
+        edges: np.ndarray (m, 2) int con pares de posiciones de nodo
+        iterations: int, número de iteraciones (la temperatura decrece linealmente)
+
+    Returns:
+        np.ndarray (n, 2) float32, con distancia ideal entre nodos vecinos ≈ 1
+    """
+    pos = np.array(initial_positions, dtype=np.float32)
+    n = pos.shape[0]
+    if n < 2:
+        return pos
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    rng = np.random.default_rng(seed)
+
+    # Área proporcional al número de nodos: distancia ideal k = 1
+    spread = float(np.sqrt(n))
+    pos -= pos.mean(axis=0)
+    scale = np.abs(pos).max()
+    pos = pos / scale * spread / 2 if scale > 0 else rng.uniform(-spread / 2, spread / 2, (n, 2)).astype(np.float32)
+    pos += rng.normal(scale=1e-3, size=pos.shape).astype(np.float32)
+
+    temperature = spread / 10
+    for it in range(iterations):
+        disp = _repulsion(pos, rng, sample_size)
+
+        if len(edges):
+            delta = pos[edges[:, 0]] - pos[edges[:, 1]]
+            dist = np.maximum(np.linalg.norm(delta, axis=1, keepdims=True), 1e-3)
+            pull = delta * dist  # (d²/k) · delta/d con k = 1
+            np.add.at(disp, edges[:, 0], -pull)
+            np.add.at(disp, edges[:, 1], pull)
+
+        # Ligera gravedad hacia el origen para que los componentes desconectados no se alejen
+        disp -= pos * (1.0 / spread)
+
+        length = np.maximum(np.linalg.norm(disp, axis=1, keepdims=True), 1e-9)
+        step = temperature * (1.0 - it / iterations)
+        pos += disp / length * np.minimum(length, step)
+    return pos
+
+
+def _repulsion(pos, rng, sample_size):
+    n = pos.shape[0]
+    if n > sample_size:
+        sample = rng.choice(n, size=sample_size, replace=False)
+        factor = n / sample_size
+    else:
+        sample = np.arange(n)
+        factor = 1.0
+    others = pos[sample]
+    others_sq = np.einsum("ij,ij->i", others, others)
+
+    disp = np.empty_like(pos)
+    step = max(1, MAX_WORK_ELEMENTS // len(others))
+    for start in range(0, n, step):
+        end = min(start + step, n)
+        block = pos[start:end]
+        # |p - o|² = |p|² + |o|² - 2 p·o, sin tensores (bloque, muestra, 2)
+        dist2 = np.einsum("ij,ij->i", block, block)[:, None] + others_sq[None, :] - 2.0 * (block @ others.T)
+        weight = 1.0 / np.maximum(dist2, 1e-4)
+        # El propio nodo no se repele a sí mismo
+        weight[np.arange(start, end)[:, None] == sample[None, :]] = 0.0
+        # Σ_o (p - o) / |p - o|²  (k²/d · unitario con k = 1)
+        disp[start:end] = (block * weight.sum(axis=1, keepdims=True) - weight @ others) * factor
+    return disp
+
+
+def ring_positions(center, count, radius):
+    """`count` posiciones repartidas en una circunferencia de `radius` alrededor de `center`."""
+    angles = np.linspace(0, 2 * np.pi, count, endpoint=False)
+    return np.asarray(center, dtype=np.float32) + radius * np.stack([np.cos(angles), np.sin(angles)], axis=1)
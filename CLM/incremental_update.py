@@ -0,0 +1,200 @@
+"""
+Actualización incremental del grafo: añade párrafos nuevos (p. ej. una enmienda) a un
+modelo ya construido por generate_kg_main.py sin rehacer todo el pipeline.
+
+1. Embebe solo los chunks nuevos (con la caché de embeddings).
+2. Los asigna al grupo existente de centroide más cercano, o los marca como loneliners
+   si caen fuera del radio de todos los grupos.
+3. Renombra y recalcula relaciones solo para los grupos cuya composición ha cambiado.
+
+Uso:
+    python incremental_update.py "enmienda.txt"
+"""
+import os
+import sys
+import json
+import numpy as np
+from dotenv import load_dotenv
+from openai import OpenAI
+
+from generate_embeddings import chunk_lines, embed_texts
+from embedding_store import load_embedding_store, save_embedding_store
+from distance_engine import normalize_rows
+from naming_semantic_groups import generate_titles
+from generate_meta_labels import construir_meta_etiqueta
+from generate_relations import definir_relaciones
+from kg_graph import build_knowledge_graph
+from retriever_index import build_retriever_index, INDEX_FILE
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+NAMING_MODEL = "o4-mini-2025-04-16"
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+
+
+def group_centroids(semantic_groups, matrix, min_size=2):
+    """
+    Centroides normalizados y radios de los grupos con al menos `min_size` chunks.
+    El radio es la mayor distancia coseno de un miembro a su centroide.
+
+    Returns:
+        positions: List[int] posiciones en semantic_groups de los grupos considerados
+        centroids: np.ndarray (G, d) float32
+        radii: np.ndarray (G,) float32
+    """
+    positions, centroids, radii = [], [], []
+    for pos, group in enumerate(semantic_groups):
+        if len(group["indices"]) < min_size:
+            continue
+        members = normalize_rows(matrix[group["indices"]])
+        centroid = normalize_rows(members.mean(axis=0, keepdims=True))[0]
+        positions.append(pos)
+        centroids.append(centroid)
+        radii.append(float(np.max(1.0 - members @ centroid)))
+    d = matrix.shape[1]
+    return positions, np.array(centroids, dtype=np.float32).reshape(-1, d), np.array(radii, dtype=np.float32)
+
+
+def assign_to_groups(new_embeddings, centroids, radii, radius_factor=1.0, max_distance=None):
+    """
+    Grupo (índice en `centroids`) del centroide más cercano para cada embedding nuevo,
+    o -1 si está más lejos que radius_factor × radio del grupo (o que `max_distance`).
+    """
+    if len(centroids) == 0:
+        return np.full(len(new_embeddings), -1, dtype=np.int64)
+    distances = 1.0 - normalize_rows(new_embeddings) @ centroids.T
+    nearest = np.argmin(distances, axis=1)
+    nearest_distance = distances[np.arange(len(nearest)), nearest]
+    accepted = nearest_distance <= radii[nearest] * radius_factor
+    if max_distance is not None:
+        accepted &= nearest_distance <= max_distance
+    return np.where(accepted, nearest, -1)
+
+
+def _labels_by_members(meta_labels):
+    """Índice frozenset(chunks) → etiqueta reconstruido a partir de los groups_related de meta_labels."""
+    members = {}
+    for chunk_id, entry in meta_labels.items():
+        for label in entry["meta"].get("groups_related", []):
+            if label != "loneliners":
+                members.setdefault(label, set()).add(int(chunk_id))
+    return {frozenset(indices): label for label, indices in members.items()}
+
+
+def _group_label(group, labels_by_members):
+    """
+    Etiqueta del grupo buscada por su conjunto de chunks (un chunk puede estar en varios grupos,
+    así que la etiqueta de uno de sus chunks no identifica el grupo).
+    """
+    return labels_by_members.get(frozenset(group["indices"]))
+
+
+def add_paragraphs(new_chunks, client, base_path=BASE_DIR, embedding_model=EMBEDDING_MODEL, naming_model=NAMING_MODEL,
+                   radius_factor=1.0, max_distance=None, max_workers=10, similarity_threshold=0.75,
+                  top_k_neighbors=None):
+    """
+    Añade chunks nuevos a los artefactos de `base_path` (embeddings, semantic_groups.json,
+    meta_labels.json y relations.json) tocando solo los grupos afectados.
+
+    Args:
+        new_chunks: List[str], chunks nuevos (ya troceados, ver chunk_lines)
+        client: instancia de OpenAI client
+        radius_factor: float, tolerancia sobre el radio de cada grupo para aceptar un chunk
+        max_distance: float, distancia coseno máxima absoluta al centroide (opcional)
+        similarity_threshold: float, umbral de definir_relaciones para los grupos cambiados
+        top_k_neighbors: int, vecinos por grupo candidatos a relación (ver definir_relaciones)
+
+    Returns:
+        Dict con los ids nuevos, los grupos modificados y los nuevos loneliners
+    """
+    embeddings_path = os.path.join(base_path, "embeddings.npy")
+    semantic_groups_path = os.path.join(base_path, "semantic_groups.json")
+    meta_labels_path = os.path.join(base_path, "meta_labels.json")
+    relations_path = os.path.join(base_path, "relations.json")
+
+    store = load_embedding_store(embeddings_path)
+    with open(semantic_groups_path, "r", encoding="utf-8") as f:
+        semantic_groups = json.load(f)
+    with open(meta_labels_path, "r", encoding="utf-8") as f:
+        meta_labels = json.load(f)
+
+    # 1. Embeddings solo de los chunks nuevos
+    print(f"Embebiendo {len(new_chunks)} chunks nuevos...")
+    new_embeddings = np.asarray(embed_texts(new_chunks, client, model=embedding_model, max_workers=max_workers),
+                                dtype=np.float32)
+    first_id = max(store.ids) + 1 if len(store) else 0
+    new_ids = list(range(first_id, first_id + len(new_chunks)))
+
+    # 2. Asignación por centroide más cercano
+    positions, centroids, radii = group_centroids(semantic_groups, store.matrix)
+    assignment = assign_to_groups(new_embeddings, centroids, radii, radius_factor, max_distance)
+
+    labels_by_members = _labels_by_members(meta_labels)
+    old_labels = {pos: _group_label(semantic_groups[pos], labels_by_members) for pos in positions}
+    changed_positions = set()
+    new_loneliners = []
+    for chunk_id, text, target in zip(new_ids, new_chunks, assignment):
+        if target >= 0:
+            pos = positions[target]
+            semantic_groups[pos]["indices"].append(chunk_id)
+            semantic_groups[pos]["paragraphs"].append(text)
+            changed_positions.add(pos)
+        else:
+            name = f"group_loneliner_{chunk_id}"
+            semantic_groups.append({"group_name": name, "indices": [chunk_id], "paragraphs": [text]})
+            new_loneliners.append(name)
+    print(f"{len(new_chunks) - len(new_loneliners)} chunks asignados a {len(changed_positions)} grupos existentes, "
+          f"{len(new_loneliners)} nuevos loneliners")
+
+    save_embedding_store(
+        embeddings_path,
+        list(store.ids) + new_ids,
+        list(store.texts) + list(new_chunks),
+        np.vstack([np.asarray(store.matrix), new_embeddings])
+    )
+    store = load_embedding_store(embeddings_path)
+    buffer = store.texts
+    with open(semantic_groups_path, "w", encoding="utf-8") as f:
+        json.dump(semantic_groups, f, ensure_ascii=False, indent=2)
+
+    # 3. Renombrar solo los grupos cambiados; el resto conserva su etiqueta
+    group_labels = {
+        frozenset(semantic_groups[pos]["indices"]): old_labels[pos]
+        for pos in positions if pos not in changed_positions and old_labels[pos]
+    }
+    changed_groups = [frozenset(semantic_groups[pos]["indices"]) for pos in changed_positions]
+    if changed_groups:
+        new_labels = generate_titles(changed_groups, client, buffer, model=naming_model, max_workers=max_workers,
+                                     semantic_groups_path=semantic_groups_path)
+        group_labels.update(new_labels)
+
+    meta_labels = construir_meta_etiqueta(buffer, store.matrix, group_labels, save_path=meta_labels_path)
+
+    # 4. Relaciones: se descartan las de las etiquetas antiguas y se recalculan las de los grupos cambiados
+    stale = {old_labels[pos] for pos in changed_positions if old_labels[pos]}
+    updated = {group_labels[g] for g in changed_groups if g in group_labels}
+    if stale or updated:
+        definir_relaciones(meta_labels, store.matrix, buffer, client, max_workers=max_workers,
+                           output_file=relations_path, similarity_threshold=similarity_threshold,
+                           only_groups=stale | updated, top_k_neighbors=top_k_neighbors)
+
+    build_knowledge_graph(relations_path, meta_labels_path, semantic_groups_path,
+                          save_path=os.path.join(base_path, "kg_graph.npz"))
+    build_retriever_index(base_path, save_path=os.path.join(base_path, INDEX_FILE))
+
+    print("Actualización incremental completa. Regenera la visualización (paso 6) si la necesitas.")
+    return {
+        "new_ids": new_ids,
+        "changed_groups": sorted(updated),
+        "new_loneliners": new_loneliners,
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print(__doc__)
+        sys.exit(1)
+    with open(sys.argv[1], "r", encoding="utf-8") as f:
+        chunks = chunk_lines(f.read().splitlines())
+
+    load_dotenv()
+    add_paragraphs(chunks, OpenAI())
@@ -0,0 +1,406 @@
+"""
+Instrumentación ligera del pipeline: tiempo de pared, tiempo de CPU y pico de RSS por etapa,
+y latencia, reintentos y tokens de cada llamada a OpenAI. El resultado es un informe JSON
+por ejecución que se puede comparar con otro.
+
+Desactivada por defecto: `stage()` devuelve un contexto vacío y `instrument_client()` el
+cliente original, así que el coste sin activarla es una comprobación de None.
+
+Uso:
+    python generate_kg_main.py --instrument            # informe en models/runs/
+    CLM_INSTRUMENT=1 python run_query.py
+    python instrumentation.py show models/runs/generate_kg_20250101-120000.json
+    python instrumentation.py compare models/runs/a.json models/runs/b.json
+"""
+import os
+import sys
+import json
+import time
+import platform
+import threading
+import contextlib
+
+try:
+    import resource
+except ImportError:  # Windows: sin getrusage, no se mide el RSS
+    resource = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RUNS_DIR = os.path.join(BASE_DIR, "models", "runs")
+ENV_VAR = "CLM_INSTRUMENT"
+# USD por millón de tokens (entrada, salida); modelos sin precio cuentan como 0
+MODEL_PRICES = {
+    "text-embedding-3-small": (0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.0),
+    "o4-mini-2025-04-16": (1.10, 4.40),
+}
+
+_recorder = None
+_NULL_STAGE = contextlib.nullcontext()
+
+
+class RunRecorder:
+    """
+    Registro de una ejecución: etapas (anidables) y llamadas a la API.
+
+    Cada llamada se atribuye a la etapa abierta más reciente. En Linux el pico de RSS de
+    cada etapa se mide reiniciando la marca de agua del proceso (/proc/self/clear_refs) al
+    empezarla; si no se puede, se informa del pico del proceso hasta ese momento. Con etapas
+    concurrentes (corpus_build.py) la atribución de llamadas y el RSS son aproximados.
+    """
+
+    def __init__(self, name="run"):
+        self.name = name
+        self.started_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._open = []
+        self._next_id = 0
+        self.stages = []
+        self.calls = []
+        self.rss_scope = "stage" if _reset_peak_rss() else "process"
+
+    def stage(self, name, **tags):
+        return _StageTimer(self, name, tags)
+
+    def current_stage(self):
+        with self._lock:
+            return self._open[-1] if self._open else None
+
+    def record_call(self, endpoint, model, latency, input_tokens=0, output_tokens=0, retries=0, error=None):
+        stage = self.current_stage()
+        record = {
+            "stage": stage["name"] if stage else None, "stage_id": stage["id"] if stage else None,
+            "endpoint": endpoint, "model": model,
+            "latency": round(latency, 4), "input_tokens": input_tokens, "output_tokens": output_tokens,
+            "retries": retries, "error": error,
+        }
+        with self._lock:
+            self.calls.append(record)
+
+    def report(self):
+        """Informe serializable: etapas, llamadas agregadas por endpoint/modelo y totales."""
+        with self._lock:
+            stages = [dict(s) for s in self.stages]
+            calls = list(self.calls)
+
+        for s in stages:
+            own = [c for c in calls if c["stage_id"] == s["id"]]
+            s.update(_call_totals(own))
+
+        by_model = {}
+        for c in calls:
+            by_model.setdefault(f"{c['endpoint']}:{c['model']}", []).append(c)
+        models = {}
+        for key, group in sorted(by_model.items()):
+            latencies = sorted(c["latency"] for c in group)
+            models[key] = {
+                **_call_totals(group),
+                "latency_p50": _percentile(latencies, 50),
+                "latency_p95": _percentile(latencies, 95),
+                "latency_max": latencies[-1],
+            }
+
+        return {
+            "name": self.name,
+            "started_at": self.started_at,
+            "wall_seconds": round(time.perf_counter() - self._start, 3),
+            "argv": sys.argv,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "rss_scope": self.rss_scope,
+            "stages": stages,
+            "models": models,
+            "totals": _call_totals(calls),
+        }
+
+    def save(self, path=None):
+        if path is None:
+            path = os.path.join(RUNS_DIR, f"{self.name}_{time.strftime('%Y%m%d-%H%M%S')}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+        print(f"Run report saved to '{path}'")
+        return path
+
+
+class _StageTimer:
+    def __init__(self, recorder, name, tags):
+        self.recorder = recorder
+        self.record = {"name": name, "parent": None, **tags}
+
+    def __enter__(self):
+        self._child_peak = 0.0
+        with self.recorder._lock:
+            self.record["id"] = self.recorder._next_id
+            self.recorder._next_id += 1
+            self._parent = self.recorder._open[-1] if self.recorder._open else None
+            self.recorder._open.append(self.record)
+        self.record["_timer"] = self
+        if self.recorder.rss_scope == "stage":
+            _reset_peak_rss()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self._children_cpu = _children_cpu()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record = self.record
+        record["wall_seconds"] = round(time.perf_counter() - self._wall, 4)
+        record["cpu_seconds"] = round(time.process_time() - self._cpu, 4)
+        record["children_cpu_seconds"] = round(_children_cpu() - self._children_cpu, 4)
+        # La marca de agua se reinició al entrar en las etapas hijas: su pico cuenta también aquí
+        peak = max(_peak_rss_mb(), self._child_peak)
+        record["peak_rss_mb"] = round(peak, 1)
+        record["status"] = "ok" if exc_type is None else f"error: {exc_type.__name__}"
+        if self._parent is not None:
+            parent_timer = self._parent.get("_timer")
+            if parent_timer is not None:
+                parent_timer._child_peak = max(parent_timer._child_peak, peak)
+            record["parent"] = self._parent["id"]
+        del record["_timer"]
+        with self.recorder._lock:
+            self.recorder._open.remove(record)
+            self.recorder.stages.append(record)
+        return False
+
+
+class InstrumentedClient:
+    """
+    Envoltorio de un cliente OpenAI que registra cada `embeddings.create` y
+    `responses.create` en el RunRecorder: latencia, tokens de entrada/salida, reintentos
+    internos del SDK (vía with_raw_response) y errores. El resto se delega en el cliente.
+    """
+
+    def __init__(self, client, recorder):
+        self.client = client
+        for endpoint in ("embeddings", "responses"):
+            if hasattr(client, endpoint):
+                setattr(self, endpoint, _InstrumentedEndpoint(recorder, endpoint, getattr(client, endpoint)))
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+class _InstrumentedEndpoint:
+    def __init__(self, recorder, endpoint, target):
+        self._recorder = recorder
+        self._endpoint = endpoint
+        self._target = target
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+    def create(self, *args, **kwargs):
+        model = kwargs.get("model", "")
+        start = time.perf_counter()
+        retries = 0
+        try:
+            raw_api = getattr(self._target, "with_raw_response", None)
+            if raw_api is not None:
+                raw = raw_api.create(*args, **kwargs)
+                retries = getattr(raw, "retries_taken", 0)
+                response = raw.parse()
+            else:
+                response = self._target.create(*args, **kwargs)
+        except Exception as e:
+            self._recorder.record_call(self._endpoint, model, time.perf_counter() - start,
+                                       retries=retries, error=f"{type(e).__name__}: {e}")
+            raise
+        input_tokens, output_tokens = _usage_tokens(getattr(response, "usage", None))
+        self._recorder.record_call(self._endpoint, model, time.perf_counter() - start,
+                                   input_tokens, output_tokens, retries)
+        return response
+
+
+# === API del módulo ===
+
+def enable(name="run"):
+    """Activa la instrumentación y devuelve el RunRecorder de esta ejecución."""
+    global _recorder
+    _recorder = RunRecorder(name)
+    return _recorder
+
+
+def enable_from_env(name="run"):
+    """Activa la instrumentación si CLM_INSTRUMENT está definida (y no es "0")."""
+    if os.environ.get(ENV_VAR, "0") not in ("", "0"):
+        return enable(name)
+    return None
+
+
+def disable():
+    global _recorder
+    _recorder = None
+
+
+def get_recorder():
+    return _recorder
+
+
+def stage(name, **tags):
+    """Contexto que mide una etapa; no hace nada si la instrumentación está desactivada."""
+    if _recorder is None:
+        return _NULL_STAGE
+    return _recorder.stage(name, **tags)
+
+
+def instrument_client(client):
+    """El cliente envuelto en un InstrumentedClient, o el propio cliente si está desactivada."""
+    if _recorder is None:
+        return client
+    return InstrumentedClient(client, _recorder)
+
+
+def save_report(path=None):
+    """Guarda el informe de la ejecución en curso (en models/runs/ por defecto)."""
+    if _recorder is None:
+        return None
+    return _recorder.save(path)
+
+
+def load_report(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare_reports(before, after):
+    """
+    Compara dos informes (dicts o rutas) etapa a etapa. Las etapas repetidas (p. ej. una
+    por query) se suman por nombre; del RSS se toma el máximo.
+
+    Returns:
+        lista de filas {"stage", "metric", "before", "after", "change"} con el cambio
+        relativo (after / before - 1), o None si alguno falta o es 0
+    """
+    before = load_report(before) if isinstance(before, str) else before
+    after = load_report(after) if isinstance(after, str) else after
+    metrics = ("wall_seconds", "cpu_seconds", "peak_rss_mb", "calls", "input_tokens", "output_tokens", "cost_usd")
+
+    def by_stage(report):
+        stages = {}
+        for s in sorted(report["stages"], key=lambda s: s["id"]):
+            total = stages.setdefault(s["name"], {})
+            for metric in metrics:
+                if metric in s:
+                    merge = max if metric == "peak_rss_mb" else (lambda x, y: round(x + y, 6))
+                    total[metric] = merge(total[metric], s[metric]) if metric in total else s[metric]
+        stages["TOTAL"] = {"wall_seconds": report["wall_seconds"], **report["totals"]}
+        return stages
+
+    stages_before, stages_after = by_stage(before), by_stage(after)
+    rows = []
+    for name in [*stages_before, *(n for n in stages_after if n not in stages_before)]:
+        a, b = stages_before.get(name, {}), stages_after.get(name, {})
+        for metric in metrics:
+            if metric not in a and metric not in b:
+                continue
+            x, y = a.get(metric), b.get(metric)
+            change = round(y / x - 1, 4) if x and y is not None else None
+            rows.append({"stage": name, "metric": metric, "before": x, "after": y, "change": change})
+    return rows
+
+
+def print_comparison(rows):
+    print(f"{'stage':24s} {'metric':16s} {'before':>12s} {'after':>12s} {'change':>8s}")
+    for r in rows:
+        change = f"{r['change']:+.1%}" if r["change"] is not None else "-"
+        print(f"{r['stage']:24s} {r['metric']:16s} {_fmt(r['before']):>12s} {_fmt(r['after']):>12s} {change:>8s}")
+
+
+def print_report(report):
+    report = load_report(report) if isinstance(report, str) else report
+    print(f"{report['name']} ({report['started_at']}): {report['wall_seconds']:.2f}s, "
+          f"{report['totals']['calls']} calls, ${report['totals']['cost_usd']:.4f}")
+    print(f"{'stage':24s} {'wall s':>9s} {'cpu s':>9s} {'rss MB':>8s} {'calls':>6s} {'tok in':>9s} {'tok out':>8s}")
+    for s in report["stages"]:
+        print(f"{s['name']:24s} {s['wall_seconds']:9.2f} {s['cpu_seconds']:9.2f} {s['peak_rss_mb']:8.1f} "
+              f"{s['calls']:6d} {s['input_tokens']:9d} {s['output_tokens']:8d}")
+    for key, m in report["models"].items():
+        print(f"  {key}: {m['calls']} calls ({m['errors']} errors, {m['retries']} retries), "
+              f"p50 {m['latency_p50']:.2f}s, p95 {m['latency_p95']:.2f}s")
+
+
+# === Auxiliares ===
+
+def _call_totals(calls):
+    input_tokens = sum(c["input_tokens"] for c in calls)
+    output_tokens = sum(c["output_tokens"] for c in calls)
+    cost = 0.0
+    for c in calls:
+        price_in, price_out = MODEL_PRICES.get(c["model"], (0.0, 0.0))
+        cost += (c["input_tokens"] * price_in + c["output_tokens"] * price_out) / 1e6
+    return {
+        "calls": len(calls),
+        "errors": sum(c["error"] is not None for c in calls),
+        "retries": sum(c["retries"] for c in calls),
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "cost_usd": round(cost, 6),
+    }
+
+
+def _usage_tokens(usage):
+    """(entrada, salida) del objeto usage de embeddings, responses o chat."""
+    if usage is None:
+        return 0, 0
+    input_tokens = getattr(usage, "input_tokens", None)
+    if input_tokens is None:
+        input_tokens = getattr(usage, "prompt_tokens", 0)
+    output_tokens = getattr(usage, "output_tokens", None)
+    if output_tokens is None:
+        output_tokens = getattr(usage, "completion_tokens", 0)
+    return int(input_tokens or 0), int(output_tokens or 0)
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    k = min(len(sorted_values) - 1, max(0, round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+def _reset_peak_rss():
+    """Reinicia la marca de agua de RSS del proceso (Linux >= 4.0); False si no es posible."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _children_cpu():
+    """CPU de los procesos hijos ya terminados (o esperados), p. ej. el pool de corpus_build.py."""
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+def _fmt(value):
+    if value is None:
+        return "-"
+    return f"{value:.4f}" if isinstance(value, float) else str(value)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) == 2 and argv[0] == "show":
+        print_report(argv[1])
+    elif len(argv) == 3 and argv[0] == "compare":
+        print_comparison(compare_reports(argv[1], argv[2]))
+    else:
+        print("Uso: python instrumentation.py show <informe.json> | compare <antes.json> <después.json>")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import base64
+import threading
+import numpy as np
+
+# Como mucho un fsync por este intervalo (segundos); cada registro se escribe y se hace flush al momento
+FSYNC_INTERVAL = 1.0
+
+
+class Journal:
+    """
+    Diario de escritura anticipada (write-ahead) en JSONL para etapas con muchas llamadas
+    de pago al LLM o a la API de embeddings.
+
+    Cada resultado terminado se añade como una línea JSON en cuanto llega, así que una caída,
+    una tormenta de rate limits o un Ctrl-C solo pierden las llamadas en curso. Al reiniciar,
+    `replay()` devuelve los registros ya hechos para enviar solo el trabajo pendiente. La
+    primera línea guarda una firma del trabajo (modelo, etc.): si no coincide, el diario es
+    de otro trabajo y se descarta. Es seguro usarlo desde varios hilos.
+    """
+
+    def __init__(self, path, signature=""):
+        self.path = path
+        self.signature = signature
+        self._lock = threading.Lock()
+        self._file = None
+        self._last_sync = 0.0
+
+    def replay(self):
+        """Registros del diario si pertenece a este trabajo; [] si no existe o es de otro."""
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for n, line in enumerate(f):
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Última línea a medio escribir durante una caída
+                    break
+                if n == 0:
+                    if record.get("_journal") != self.signature:
+                        print(f"Journal '{self.path}' belongs to a different job; discarding it")
+                        self.discard()
+                        return []
+                    continue
+                records.append(record)
+        if records:
+            print(f"Replaying {len(records)} results from journal '{self.path}'")
+        return records
+
+    def append(self, record):
+        with self._lock:
+            if self._file is None:
+                self._open()
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            now = time.time()
+            if now - self._last_sync >= FSYNC_INTERVAL:
+                os.fsync(self._file.fileno())
+                self._last_sync = now
+
+    def _open(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        if os.path.exists(self.path):
+            self._truncate_partial_line()
+        new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self._file = open(self.path, "a", encoding="utf-8")
+        if new:
+            self._file.write(json.dumps({"_journal": self.signature}) + "\n")
+
+    def _truncate_partial_line(self):
+        """Recorta una última línea incompleta para no pegarle el siguiente registro."""
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if data.endswith(b"\n"):
+                return
+            f.truncate(data.rfind(b"\n") + 1)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
+
+    def discard(self):
+        """Cierra y borra el diario (la etapa terminó y su artefacto ya está guardado)."""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def encode_vector(vector):
+    """Vector float32 como base64 (más compacto en el diario que una lista JSON de floats)."""
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def decode_vector(encoded):
+    return np.frombuffer(base64.b64decode(encoded), dtype=np.float32).tolist()
+
+
+def journal_path_for(artifact_path):
+    return artifact_path + ".journal.jsonl"
+
+
+def resolve_journal(journal, artifact_path, signature=""):
+    """None → diario junto a `artifact_path`, False → sin diario, o la instancia recibida."""
+    if journal is False:
+        return None
+    if journal is None:
+        return Journal(journal_path_for(artifact_path), signature)
+    return journal
@@ -0,0 +1,286 @@
+import json
+import numpy as np
+
+PART_OF = "part of"
+LONELINERS_GROUP = "loneliners"
+
+
+class KnowledgeGraph:
+    """
+    Grafo de grupos semánticos con nodos indexados por enteros y adyacencia CSR en los dos
+    sentidos (salientes y entrantes), de modo que vecinos, expansión k-hop y caminos se
+    resuelven con lecturas de arrays en O(grado) en lugar de recorrer dicts por nombre.
+
+    Las aristas son las relaciones de relations.json más los enlaces "part of" de cada
+    loneliner (grupo de un solo chunk) hacia los otros grupos que contienen su chunk.
+    También guarda la pertenencia grupo → chunks en CSR.
+    """
+
+    def __init__(self, nodes, sources, targets, edge_relations, relation_types, member_indptr, member_chunks):
+        self.nodes = list(nodes)
+        self.node_index = {name: k for k, name in enumerate(self.nodes)}
+        self.relation_types = list(relation_types)
+        self.part_of_id = self.relation_types.index(PART_OF) if PART_OF in self.relation_types else -1
+        self.member_indptr = np.asarray(member_indptr, dtype=np.int64)
+        self.member_chunks = np.asarray(member_chunks, dtype=np.int64)
+
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        edge_relations = np.asarray(edge_relations, dtype=np.int32)
+        n = len(self.nodes)
+        self.out_indptr, self.out_indices, self.out_relations = _csr(sources, targets, edge_relations, n)
+        self.in_indptr, self.in_indices, self.in_relations = _csr(targets, sources, edge_relations, n)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    @property
+    def n_edges(self):
+        return len(self.out_indices)
+
+    # === Construcción ===
+
+    @classmethod
+    def from_artifacts(cls, relations, meta_labels, semantic_groups=None):
+        """
+        Construye el grafo a partir de relations.json, meta_labels.json y (opcionalmente)
+        semantic_groups.json, cuya pertenencia grupo → chunks se une a la de meta_labels.
+        """
+        members = {}
+        if semantic_groups is not None:
+            for group in semantic_groups:
+                members.setdefault(group["group_name"], set()).update(int(i) for i in group["indices"])
+        for chunk_id, data in meta_labels.items():
+            row = int(data.get("embedding_row", chunk_id))
+            for group in data.get("meta", {}).get("groups_related", []):
+                if group != LONELINERS_GROUP:
+                    members.setdefault(group, set()).add(row)
+
+        nodes = list(members)
+        for group_a, targets in relations.items():
+            for group_b in [group_a, *targets]:
+                if group_b not in members:
+                    members[group_b] = set()
+                    nodes.append(group_b)
+        index = {name: k for k, name in enumerate(nodes)}
+
+        relation_types = [PART_OF]
+        relation_ids = {PART_OF: 0}
+        sources, targets, edge_relations = [], [], []
+        for group_a, related in relations.items():
+            for group_b, relation in related.items():
+                sources.append(index[group_a])
+                targets.append(index[group_b])
+                if relation not in relation_ids:
+                    relation_ids[relation] = len(relation_types)
+                    relation_types.append(relation)
+                edge_relations.append(relation_ids[relation])
+
+        # Loneliners: enlace "part of" hacia los demás grupos que contienen su chunk
+        chunk_groups = {}
+        for group, chunks in members.items():
+            for c in chunks:
+                chunk_groups.setdefault(c, []).append(group)
+        for group, chunks in members.items():
+            if len(chunks) != 1:
+                continue
+            for parent in chunk_groups[next(iter(chunks))]:
+                if parent != group:
+                    sources.append(index[group])
+                    targets.append(index[parent])
+                    edge_relations.append(0)
+
+        member_lists = [sorted(members[name]) for name in nodes]
+        member_indptr = np.concatenate([[0], np.cumsum([len(m) for m in member_lists])])
+        member_chunks = np.fromiter((c for m in member_lists for c in m), dtype=np.int64, count=int(member_indptr[-1]))
+        return cls(nodes, sources, targets, edge_relations, relation_types, member_indptr, member_chunks)
+
+    # === Consultas ===
+
+    def ids(self, names):
+        """Índices de nodo de una lista de nombres (ignora los que no existen)."""
+        return np.array([self.node_index[n] for n in names if n in self.node_index], dtype=np.int64)
+
+    def names(self, ids):
+        return [self.nodes[i] for i in ids]
+
+    def neighbors(self, node, direction="both", include_part_of=True):
+        """
+        Índices de los vecinos de un nodo (nombre o índice), sin repetir.
+        direction: "out" (a → b), "in" (b → a) o "both".
+        """
+        node = self.node_index[node] if isinstance(node, str) else node
+        return self._expand(np.array([node], dtype=np.int64), direction, include_part_of)
+
+    def relation(self, group_a, group_b):
+        """Etiqueta de la arista group_a → group_b, o None si no existe."""
+        a, b = self.node_index.get(group_a), self.node_index.get(group_b)
+        if a is None or b is None:
+            return None
+        start, end = self.out_indptr[a], self.out_indptr[a + 1]
+        hit = np.nonzero(self.out_indices[start:end] == b)[0]
+        return self.relation_types[self.out_relations[start + hit[0]]] if len(hit) else None
+
+    def k_hop(self, seeds, k=1, direction="both", include_part_of=True):
+        """
+        Nodos a distancia <= k de alguno de `seeds` (nombres o índices), incluidos los propios seeds.
+        Cada salto es una lectura vectorizada de las filas CSR de la frontera.
+        """
+        frontier = self._as_ids(seeds)
+        visited = np.zeros(len(self.nodes), dtype=bool)
+        visited[frontier] = True
+        for _ in range(k):
+            if len(frontier) == 0:
+                break
+            reached = self._expand(frontier, direction, include_part_of)
+            frontier = reached[~visited[reached]]
+            visited[frontier] = True
+        return np.nonzero(visited)[0]
+
+    def shortest_path(self, source, target, direction="both", include_part_of=True):
+        """Camino más corto (BFS) entre dos grupos como lista de nombres, o None si no hay."""
+        s, t = self.node_index.get(source), self.node_index.get(target)
+        if s is None or t is None:
+            return None
+        parent = np.full(len(self.nodes), -1, dtype=np.int64)
+        parent[s] = s
+        frontier = np.array([s], dtype=np.int64)
+        while len(frontier) and parent[t] < 0:
+            rows, reached = self._expand_pairs(frontier, direction, include_part_of)
+            new = parent[reached] < 0
+            rows, reached = rows[new], reached[new]
+            # Un nodo alcanzado desde varios de la frontera se queda con el primero
+            reached, first = np.unique(reached, return_index=True)
+            parent[reached] = rows[first]
+            frontier = reached
+        if parent[t] < 0:
+            return None
+        path = [t]
+        while path[-1] != s:
+            path.append(int(parent[path[-1]]))
+        return self.names(reversed(path))
+
+    def subgraph(self, nodes):
+        """Subgrafo inducido por `nodes` (nombres o índices), con sus aristas y pertenencias."""
+        keep = self._as_ids(nodes)
+        new_index = np.full(len(self.nodes), -1, dtype=np.int64)
+        new_index[keep] = np.arange(len(keep))
+        sources = np.repeat(np.arange(len(self.nodes)), np.diff(self.out_indptr))
+        mask = (new_index[sources] >= 0) & (new_index[self.out_indices] >= 0)
+        member_lists = [self.member_chunks[self.member_indptr[i]:self.member_indptr[i + 1]] for i in keep]
+        member_indptr = np.concatenate([[0], np.cumsum([len(m) for m in member_lists])])
+        return KnowledgeGraph(
+            self.names(keep),
+            new_index[sources[mask]],
+            new_index[self.out_indices[mask]],
+            self.out_relations[mask],
+            self.relation_types,
+            member_indptr,
+            np.concatenate(member_lists) if member_lists else np.empty(0, dtype=np.int64),
+        )
+
+    def members(self, nodes):
+        """Chunk ids (únicos, ordenados) de los grupos indicados."""
+        ids = self._as_ids(nodes)
+        return np.unique(_gather(self.member_indptr, self.member_chunks, ids))
+
+    # === Serialización ===
+
+    def save(self, path):
+        """Guarda el grafo en un .npz (arrays enteros + nombres como UTF-8 concatenado, sin pickle)."""
+        sources = np.repeat(np.arange(len(self.nodes), dtype=np.int64), np.diff(self.out_indptr))
+        node_bytes, node_offsets = _pack_strings(self.nodes)
+        relation_bytes, relation_offsets = _pack_strings(self.relation_types)
+        np.savez_compressed(
+            path,
+            node_bytes=node_bytes, node_offsets=node_offsets,
+            relation_bytes=relation_bytes, relation_offsets=relation_offsets,
+            sources=sources, targets=self.out_indices, edge_relations=self.out_relations,
+            member_indptr=self.member_indptr, member_chunks=self.member_chunks,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                _unpack_strings(data["node_bytes"], data["node_offsets"]),
+                data["sources"], data["targets"], data["edge_relations"],
+                _unpack_strings(data["relation_bytes"], data["relation_offsets"]),
+                data["member_indptr"], data["member_chunks"],
+            )
+
+    # === Auxiliares ===
+
+    def _as_ids(self, nodes):
+        nodes = list(nodes)
+        if nodes and isinstance(nodes[0], str):
+            return np.unique(self.ids(nodes))
+        return np.unique(np.asarray(nodes, dtype=np.int64))
+
+    def _expand(self, rows, direction, include_part_of):
+        return np.unique(self._expand_pairs(rows, direction, include_part_of)[1])
+
+    def _expand_pairs(self, rows, direction, include_part_of):
+        """(fila de origen, vecino) de todas las aristas de `rows` en el sentido pedido."""
+        parts = []
+        if direction in ("out", "both"):
+            parts.append((self.out_indptr, self.out_indices, self.out_relations))
+        if direction in ("in", "both"):
+            parts.append((self.in_indptr, self.in_indices, self.in_relations))
+        origins, reached = [], []
+        for indptr, indices, relations in parts:
+            neighbors = _gather(indptr, indices, rows)
+            origin = np.repeat(rows, indptr[rows + 1] - indptr[rows])
+            if not include_part_of and self.part_of_id >= 0:
+                keep = _gather(indptr, relations, rows) != self.part_of_id
+                neighbors, origin = neighbors[keep], origin[keep]
+            origins.append(origin)
+            reached.append(neighbors)
+        return np.concatenate(origins), np.concatenate(reached)
+
+
+def build_knowledge_graph(relations_path, meta_labels_path, semantic_groups_path=None, save_path=None):
+    """Construye el KnowledgeGraph desde los JSON del pipeline y, si se indica, lo guarda en `save_path`."""
+    with open(relations_path, "r", encoding="utf-8") as f:
+        relations = json.load(f)
+    with open(meta_labels_path, "r", encoding="utf-8") as f:
+        meta_labels = json.load(f)
+    semantic_groups = None
+    if semantic_groups_path:
+        with open(semantic_groups_path, "r", encoding="utf-8") as f:
+            semantic_groups = json.load(f)
+
+    graph = KnowledgeGraph.from_artifacts(relations, meta_labels, semantic_groups)
+    if save_path:
+        graph.save(save_path)
+        print(f"Grafo guardado en '{save_path}' ({len(graph)} nodos, {graph.n_edges} aristas)")
+    return graph
+
+
+def _csr(rows, cols, values, n):
+    order = np.lexsort((cols, rows))
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+    return indptr, cols[order], values[order]
+
+
+def _gather(indptr, values, rows):
+    """Concatenación de values[indptr[r]:indptr[r+1]] para cada r de `rows`, sin bucle en Python."""
+    starts = indptr[rows]
+    counts = indptr[rows + 1] - starts
+    total = int(counts.sum())
+    if total == 0:
+        return values[:0]
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(total)
+    return values[offsets]
+
+
+def _pack_strings(strings):
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.concatenate([[0], np.cumsum([len(b) for b in encoded])]).astype(np.int64)
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _unpack_strings(data, offsets):
+    raw = data.tobytes()
+    return [raw[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
@@ -0,0 +1,105 @@
+import os
+import json
+import threading
+
+from fingerprints import content_hash, member_hashes
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_LABEL_CACHE_PATH = os.path.join(BASE_DIR, "models", "label_cache.json")
+
+
+class LabelCache:
+    """
+    Caché persistente de etiquetas de grupo.
+
+    Cada entrada guarda el modelo, las huellas de los textos del grupo y la etiqueta.
+    Un grupo idéntico (mismas huellas, mismo modelo) reutiliza su etiqueta directamente;
+    uno casi idéntico la reutiliza si su solapamiento de Jaccard con un grupo cacheado
+    alcanza `min_jaccard`. Es seguro usarla desde los hilos de generate_titles.
+    """
+
+    def __init__(self, path=DEFAULT_LABEL_CACHE_PATH):
+        self.path = path
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = {}     # key → {"model", "members", "label"}
+        self._by_member = {}   # huella de texto → set de keys
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for entry in json.load(f):
+                    self._index(entry["key"], entry["model"], frozenset(entry["members"]), entry["label"])
+
+    @staticmethod
+    def key(members, model):
+        return content_hash(model, *sorted(members))
+
+    def _index(self, key, model, members, label):
+        self._entries[key] = {"model": model, "members": members, "label": label}
+        for m in members:
+            self._by_member.setdefault(m, set()).add(key)
+
+    def lookup(self, texts, model, min_jaccard=1.0):
+        """
+        Etiqueta cacheada para un grupo con estos textos, o None.
+        Con min_jaccard < 1 acepta el grupo cacheado (del mismo modelo) con mayor solapamiento.
+        """
+        members = member_hashes(texts)
+        with self._lock:
+            entry = self._entries.get(self.key(members, model))
+            if entry is not None:
+                self.hits += 1
+                return entry["label"]
+
+            best_label, best_score = None, 0.0
+            if min_jaccard < 1.0:
+                candidates = set()
+                for m in members:
+                    candidates |= self._by_member.get(m, set())
+                for key in candidates:
+                    cached = self._entries[key]
+                    if cached["model"] != model:
+                        continue
+                    score = len(members & cached["members"]) / len(members | cached["members"])
+                    if score > best_score:
+                        best_label, best_score = cached["label"], score
+
+            if best_label is not None and best_score >= min_jaccard:
+                self.near_hits += 1
+                return best_label
+            self.misses += 1
+            return None
+
+    def put(self, texts, model, label):
+        if not label or label.startswith("Error:"):
+            return
+        members = member_hashes(texts)
+        with self._lock:
+            self._index(self.key(members, model), model, members, label)
+
+    def save(self):
+        # El lock cubre también la escritura: varios contratos pueden compartir la instancia
+        with self._lock:
+            entries = [
+                {"key": k, "model": e["model"], "members": sorted(e["members"]), "label": e["label"]}
+                for k, e in self._entries.items()
+            ]
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "near_hits": self.near_hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+def resolve_label_cache(cache):
+    """None → caché en models/label_cache.json, False → sin caché, o la instancia recibida."""
+    if cache is False:
+        return None
+    if cache is None:
+        return LabelCache()
+    return cache
@@ -0,0 +1,280 @@
+"""
+Clientes locales deterministas que imitan la parte de las APIs de OpenAI y de Bedrock que
+usa el proyecto, para ejecutar el pipeline, las consultas y la Lambda de anonimización sin
+red (benchmarks, pruebas manuales, desarrollo sin credenciales).
+
+- Embeddings: hashing de palabras (feature hashing con signo) normalizado, de modo que
+  textos que comparten vocabulario quedan cerca y el mismo texto da siempre el mismo vector.
+- Respuestas: etiquetas de grupo, relaciones, eventos y extracciones de datos sensibles
+  construidas a partir del propio prompt, en el formato que espera cada etapa. Se pueden
+  añadir respuestas enlatadas por expresión regular.
+- Latencia y fallos configurables. La decisión de cada llamada depende del contenido de la
+  petición y del número de intento, no del orden de los hilos, así que dos ejecuciones con
+  la misma semilla inyectan los mismos fallos.
+
+Ejemplo:
+    from local_clients import LocalOpenAIClient
+    client = LocalOpenAIClient(latency=0.05, failure_rate=0.02)
+"""
+import io
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from collections import Counter
+from functools import lru_cache
+from types import SimpleNamespace
+
+import numpy as np
+
+from text_utils import estimate_tokens
+
+DEFAULT_DIM = 256
+RELATION_TYPES = ["Contractual Dependency", "Shared Trigger Event", "Payment Consequence",
+                  "Procedural Prerequisite", "Liability Allocation", "Scope Refinement"]
+STOPWORDS = {
+    "the", "and", "for", "that", "this", "with", "shall", "such", "from", "which", "under", "any", "all",
+    "are", "its", "not", "have", "has", "been", "will", "may", "other", "into", "upon", "than", "each",
+    "los", "las", "del", "que", "por", "para", "con", "una", "sus", "como", "este", "esta",
+}
+_WORD = re.compile(r"[^\W\d_]{3,}", re.UNICODE)
+
+
+class LocalServiceError(RuntimeError):
+    """Fallo inyectado por un cliente local (equivalente a un 5xx o a un rate limit)."""
+
+
+class _CallPolicy:
+    """Latencia y fallos inyectados, deterministas por (contenido de la petición, intento)."""
+
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0, seed=0, sleep=True):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self.sleep = sleep
+        self.calls = 0
+        self.failures = 0
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    def before_call(self, payload):
+        key = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        with self._lock:
+            attempt = self._attempts.get(key, 0)
+            self._attempts[key] = attempt + 1
+            self.calls += 1
+        rng = random.Random(f"{self.seed}:{key}:{attempt}")
+        delay = max(0.0, self.latency + (rng.uniform(-self.jitter, self.jitter) if self.jitter else 0.0))
+        if delay and self.sleep:
+            time.sleep(delay)
+        if self.failure_rate and rng.random() < self.failure_rate:
+            with self._lock:
+                self.failures += 1
+            raise LocalServiceError(f"Injected failure (attempt {attempt + 1})")
+        return delay
+
+
+@lru_cache(maxsize=200_000)
+def _token_slot(token, dim):
+    digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+    value = int.from_bytes(digest, "little")
+    return value % dim, 1.0 if (value >> 63) & 1 else -1.0
+
+
+def hash_embedding(text, dim=DEFAULT_DIM):
+    """
+    Embedding determinista de `text`: suma con signo de las palabras (y bigramas) en `dim`
+    posiciones por hashing, normalizada a norma 1. Un texto sin palabras recibe un vector
+    aleatorio fijo derivado de su hash.
+    """
+    words = [w.lower() for w in _WORD.findall(text)]
+    vector = np.zeros(dim, dtype=np.float32)
+    for token in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+        slot, sign = _token_slot(token, dim)
+        vector[slot] += sign
+    norm = float(np.linalg.norm(vector))
+    if norm == 0.0:
+        seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+        vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+        norm = float(np.linalg.norm(vector))
+    return vector / norm
+
+
+def keyword_label(text, words=3):
+    """Etiqueta en Title Case con las palabras más frecuentes de `text` (sin stopwords)."""
+    counts = Counter(w.lower() for w in _WORD.findall(text) if w.lower() not in STOPWORDS)
+    top = [w for w, _ in sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))[:words]]
+    return " ".join(w.capitalize() for w in top) or "General Provisions"
+
+
+def _pick(options, text):
+    return options[int(hashlib.sha256(text.encode("utf-8")).hexdigest(), 16) % len(options)]
+
+
+class _LocalEmbeddings:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, model, input, **kwargs):
+        texts = [input] if isinstance(input, str) else list(input)
+        self._owner.policy.before_call("embeddings:" + model + "\x00" + "\x00".join(texts))
+        data = [SimpleNamespace(object="embedding", index=k, embedding=hash_embedding(t, self._owner.dim).tolist())
+                for k, t in enumerate(texts)]
+        tokens = sum(estimate_tokens(t) for t in texts)
+        return SimpleNamespace(object="list", model=model, data=data,
+                               usage=SimpleNamespace(prompt_tokens=tokens, total_tokens=tokens))
+
+
+class _LocalResponses:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, model, input, **kwargs):
+        messages = [{"role": "user", "content": input}] if isinstance(input, str) else list(input)
+        prompt = "\n\n".join(str(m.get("content", "")) for m in messages)
+        self._owner.policy.before_call("responses:" + model + "\x00" + prompt)
+        output_text = self._owner.respond(messages)
+        input_tokens, output_tokens = estimate_tokens(prompt), estimate_tokens(output_text)
+        return SimpleNamespace(
+            object="response", model=model, output_text=output_text,
+            usage=SimpleNamespace(input_tokens=input_tokens, output_tokens=output_tokens,
+                                  total_tokens=input_tokens + output_tokens),
+        )
+
+
+class LocalOpenAIClient:
+    """
+    Sustituto local de `openai.OpenAI` para `embeddings.create` y `responses.create`.
+
+    Args:
+        dim: dimensión de los embeddings
+        latency, jitter: segundos de espera por llamada (latency ± jitter uniforme)
+        failure_rate: probabilidad de que una llamada lance LocalServiceError
+        seed: semilla de la latencia y de los fallos
+        canned: lista de (regex, respuesta) evaluada antes que las respuestas por defecto;
+            la respuesta es un str o un callable(prompt) -> str
+    """
+
+    def __init__(self, dim=DEFAULT_DIM, latency=0.0, jitter=0.0, failure_rate=0.0, seed=0, canned=None):
+        self.dim = dim
+        self.policy = _CallPolicy(latency, jitter, failure_rate, seed)
+        self.canned = [(re.compile(pattern, re.DOTALL), reply) for pattern, reply in (canned or [])]
+        self.embeddings = _LocalEmbeddings(self)
+        self.responses = _LocalResponses(self)
+
+    def stats(self):
+        return {"calls": self.policy.calls, "failures": self.policy.failures}
+
+    def respond(self, messages):
+        """Texto de respuesta para una lista de mensajes {"role", "content"}."""
+        prompt = str(messages[-1].get("content", ""))
+        system = " ".join(str(m.get("content", "")) for m in messages if m.get("role") == "system")
+        for pattern, reply in self.canned:
+            if pattern.search(prompt):
+                return reply(prompt) if callable(reply) else reply
+
+        if "structured events" in system:
+            return json.dumps(_canned_events(prompt), ensure_ascii=False)
+        if "### Group " in prompt:
+            blocks = _keyed_blocks(prompt, "Group")
+            return json.dumps({key: keyword_label(text) for key, text in blocks.items()}, ensure_ascii=False)
+        if "### Pair " in prompt:
+            blocks = _keyed_blocks(prompt, "Pair")
+            return json.dumps({key: _pick(RELATION_TYPES, text) for key, text in blocks.items()}, ensure_ascii=False)
+        if "Group A" in prompt and "Group B" in prompt:
+            return _pick(RELATION_TYPES, prompt)
+        if "Here are the paragraphs:" in prompt:
+            return keyword_label(prompt.split("Here are the paragraphs:", 1)[1])
+        return keyword_label(prompt)
+
+
+def _keyed_blocks(prompt, kind):
+    """{id: texto} de los bloques "### Group G1" / "### Pair P1" de un prompt por lotes."""
+    parts = re.split(rf"^### {kind} (\w+)\s*$", prompt, flags=re.MULTILINE)
+    return {parts[k]: parts[k + 1] for k in range(1, len(parts) - 1, 2)}
+
+
+def _canned_events(prompt):
+    """Un evento por cada uno de los dos primeros chunks del contexto del prompt de generate_event."""
+    chunks = re.findall(r"Chunk \d+ \(Groups: [^)]*\):\n(.+)", prompt)
+    events = []
+    for k, text in enumerate(chunks[:2] or [prompt[:200]]):
+        clause = re.search(r"\b(?:Clause|Section|Cláusula)\s+\d+(?:\.\d+)*(?:\([a-z]\))?", text)
+        events.append({
+            "type": "Deadline",
+            "name": keyword_label(text),
+            "deadline": f"2023-07-{7 * (k + 1):02d}",
+            "relative_to_notice": f"Within {7 * (k + 1)} days after Notice to Proceed (30 June 2023)",
+            "description": text[:200],
+            "clause_reference": clause.group(0) if clause else "",
+        })
+    return events
+
+
+# === Bedrock (Lambda de anonimización) ===
+
+SENSITIVE_PATTERNS = {
+    "DNI": r"\b\d{8}[A-Z]\b",
+    "NIE": r"\b[XYZ]\d{7}[A-Z]\b",
+    "Emails": r"\b[\w.+-]+@[\w-]+\.[\w.]+\b",
+    "IBAN": r"\bES\d{2}(?:\s?\d{4}){5}\b",
+    "Numero_telefonico": r"(?<!\d)(?:\+34\s?)?[6789]\d{2}\s?\d{3}\s?\d{3}(?!\d)",
+    "Identificador_fiscal": r"\b[ABCDEFGHJNPQRSUVW]\d{8}\b",
+}
+CONTEXT_PATTERNS = {
+    "Fechas": r"\b\d{1,2}/\d{1,2}/\d{2,4}\b|\b\d{1,2} de [a-z]+ de \d{4}\b",
+    "Valores_monetarios": r"\b\d{1,3}(?:\.\d{3})*(?:,\d+)?\s?(?:€|euros|EUR)",
+    "Porcentajes": r"\b\d+(?:[.,]\d+)?\s?%",
+    "Codigos_postales": r"(?<=C\.P\.\s)\d{5}\b|\b\d{5}(?=\s[A-ZÁÉÍÓÚ][a-záéíóú]+)",
+    "Direcciones": r"\b(?:C/|Calle|Avda\.|Avenida|Plaza)\s[^,\n]+(?:,\s*\d+)?",
+    "Nombres_Empresas": r"\b[A-ZÁÉÍÓÚÑ][\wÁÉÍÓÚÑáéíóúñ&.\- ]+?,?\s(?:S\.A\.|S\.L\.|S\.L\.U\.)",
+}
+_PERSON = re.compile(r"\b(?:D\.|Dña\.|Don|Doña)\s+([A-ZÁÉÍÓÚÑ][a-záéíóúñ]+)((?:\s+[A-ZÁÉÍÓÚÑ][a-záéíóúñ]+){1,2})")
+
+
+class LocalBedrockClient:
+    """
+    Sustituto local del cliente `bedrock-runtime` de boto3 para `invoke_model` con modelos
+    de Mistral (respuesta {"choices": [{"message": {"content": ...}}]}).
+
+    Los prompts de anonimización se responden con lo que encuentran unas expresiones
+    regulares en el texto de <data>; cualquier otro prompt recibe una respuesta de chat fija.
+    Acepta los mismos parámetros de latencia y fallos que LocalOpenAIClient.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0, seed=0, chat_reply=None):
+        self.policy = _CallPolicy(latency, jitter, failure_rate, seed)
+        self.chat_reply = chat_reply or "Respuesta local de ClaudIA: consulta recibida."
+
+    def stats(self):
+        return {"calls": self.policy.calls, "failures": self.policy.failures}
+
+    def invoke_model(self, modelId, body, contentType="application/json", accept="application/json", **kwargs):
+        request = json.loads(body)
+        prompt = request.get("prompt", "")
+        self.policy.before_call(f"bedrock:{modelId}\x00{prompt}")
+        data = re.search(r"<data>(.*?)</data>", prompt, re.DOTALL)
+        text = data.group(1) if data else prompt
+        if "DATOS PERSONALES" in prompt:
+            content = json.dumps(_extract_personal(text), ensure_ascii=False)
+        elif "DATOS CONTEXTUALES" in prompt:
+            content = json.dumps(_extract(text, CONTEXT_PATTERNS), ensure_ascii=False)
+        else:
+            content = self.chat_reply
+        payload = {"choices": [{"message": {"role": "assistant", "content": content}}]}
+        return {"body": io.BytesIO(json.dumps(payload, ensure_ascii=False).encode("utf-8")), "contentType": accept}
+
+
+def _extract(text, patterns):
+    return {key: list(dict.fromkeys(m.strip() for m in re.findall(pattern, text))) for key, pattern in patterns.items()}
+
+
+def _extract_personal(text):
+    result = _extract(text, SENSITIVE_PATTERNS)
+    people = _PERSON.findall(text)
+    result["Nombres"] = list(dict.fromkeys(first for first, _ in people))
+    result["Apellidos"] = list(dict.fromkeys(last.strip() for _, last in people))
+    return result
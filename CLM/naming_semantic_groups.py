@@ -1,10 +1,32 @@
 import os
+import re
 import json
 import time
 import concurrent.futures
 from tqdm import tqdm
 from openai import OpenAI
 
+from label_cache import resolve_label_cache
+from fingerprints import content_hash
+from journal import resolve_journal
+from text_utils import estimate_tokens
+from generate_embeddings import error_kind
+
+LABEL_RULES = (
+    "**Label format rules:**\n"
+    "- Use 2 to 6 words.\n"
+    "- Use formal and specific legal language (e.g., 'Force Majeure Clauses', 'Warranty Obligations', 'Termination Terms').\n"
+    "- Capitalize first letters (Title Case).\n"
+    "- Do not use punctuation at the end.\n"
+)
+
+# Budget of the batched naming mode (tokens estimated as ~4 characters per token)
+BATCH_TOKEN_BUDGET = 6000
+MAX_GROUPS_PER_BATCH = 20
+# A failed batched request is retried as a whole, never fanned out into one request per group
+BATCH_RETRIES = 2
+BATCH_BACKOFF = 1.0  # seconds before the first retry, doubled on each retry
+
 
 def build_prompt(chunk_texts, max_chunks=5):
     sample = chunk_texts if len(chunk_texts) <= max_chunks else chunk_texts[:max_chunks]
@@ -14,17 +36,129 @@ def build_prompt(chunk_texts, max_chunks=5):
         "You are a legal assistant specialized in EPC (Engineering, Procurement and Construction) contracts.\n"
         "Below is a set of paragraphs grouped by semantic similarity, all extracted from the same contract.\n"
         "Please analyze their content and return a concise, single-line label that best summarizes the shared theme.\n\n"
-        "**Label format rules:**\n"
-        "- Use 2 to 6 words.\n"
-        "- Use formal and specific legal language (e.g., 'Force Majeure Clauses', 'Warranty Obligations', 'Termination Terms').\n"
-        "- Capitalize first letters (Title Case).\n"
-        "- Do not use punctuation at the end.\n"
+        f"{LABEL_RULES}"
         "- Return only the label, no explanation.\n\n"
         "Here are the paragraphs:\n\n"
         f"{text_block}\n\n"
         "Label:"
     )
 
+def group_sample(texts, max_chunks=5):
+    return texts if len(texts) <= max_chunks else texts[:max_chunks]
+
+
+def build_batch_prompt(keyed_samples):
+    """Prompt that asks for one label per group, keyed by group id, as a JSON object."""
+    blocks = []
+    for key, sample in keyed_samples:
+        text_block = "\n\n".join(f"{i+1}. {c}" for i, c in enumerate(sample))
+        blocks.append(f"### Group {key}\n{text_block}")
+
+    example = ", ".join(f'"{key}": "..."' for key, _ in keyed_samples[:2])
+    return (
+        "You are a legal assistant specialized in EPC (Engineering, Procurement and Construction) contracts.\n"
+        "Below are several groups of paragraphs; the paragraphs in each group were grouped by semantic similarity, "
+        "all extracted from the same contract.\n"
+        "For each group, analyze its content and write a concise, single-line label that best summarizes its shared theme.\n\n"
+        f"{LABEL_RULES}\n"
+        "Return only a JSON object whose keys are the group ids and whose values are the labels, "
+        f"e.g. {{{example}}}. No explanation.\n\n"
+        "Here are the groups:\n\n"
+        + "\n\n".join(blocks)
+    )
+
+
+def make_group_batches(groups, buffer, token_budget=BATCH_TOKEN_BUDGET, max_groups=MAX_GROUPS_PER_BATCH):
+    """
+    Packs groups into batches whose estimated prompt size stays within `token_budget`.
+    A group that exceeds the budget on its own gets a batch of its own.
+    """
+    batches, current, current_tokens = [], [], 0
+    for group in groups:
+        sample = group_sample([buffer[i] for i in sorted(group)])
+        tokens = sum(estimate_tokens(t) for t in sample) + 10
+        if current and (current_tokens + tokens > token_budget or len(current) >= max_groups):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(group)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def parse_batch_labels(output_text):
+    """Extracts the {group_id: label} object from the model output; {} if it cannot be parsed."""
+    match = re.search(r'\{.*\}', output_text, re.DOTALL)
+    if not match:
+        return {}
+    try:
+        parsed = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
+
+
+def is_valid_label(label):
+    return isinstance(label, str) and label.strip() != "" and "\n" not in label.strip() and len(label) <= 120
+
+
+def request_batch(client, model, system_prompt, prompt, retries=BATCH_RETRIES, backoff=BATCH_BACKOFF):
+    """
+    Sends one batched prompt and returns the output text. Transient errors retry the whole
+    request with exponential backoff; fatal and input errors (see generate_embeddings.error_kind),
+    or the last transient one, are raised.
+    """
+    for attempt in range(retries + 1):
+        try:
+            response = client.responses.create(
+                model=model,
+                input=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+            )
+            return response.output_text
+        except Exception as e:
+            if attempt == retries or error_kind(e) != "transient":
+                raise
+            print(f"Batch request failed ({e}); retrying in {backoff:.0f}s")
+            time.sleep(backoff)
+            backoff *= 2
+
+
+def process_group_batch(groups, buffer, client, model):
+    """
+    Labels several groups with a single request (retried as a unit, see request_batch).
+    If the request fails, the groups of the batch are left out of the result (unlabeled, see
+    generate_titles); only groups missing or malformed in a successful response are labeled
+    one by one with process_single_group.
+
+    Returns:
+    - List of (group, label) tuples for the groups that were labeled
+    """
+    keyed = {f"G{k + 1}": group for k, group in enumerate(groups)}
+    prompt = build_batch_prompt([
+        (key, group_sample([buffer[i] for i in sorted(group)])) for key, group in keyed.items()
+    ])
+    try:
+        output_text = request_batch(client, model, "You are an expert in finding semantic similarities in legal documents.",
+                                    prompt)
+    except Exception as e:
+        print(f"Error processing batch of {len(groups)} groups: {e}")
+        return []
+    labels = parse_batch_labels(output_text)
+
+    results = []
+    for key, group in keyed.items():
+        label = labels.get(key)
+        if is_valid_label(label):
+            results.append((group, label.strip()))
+        else:
+            results.append(process_single_group(group, buffer, client, model))
+    return results
+
+
 def process_single_group(group, buffer, client, model):
     """Process a single group to generate its title"""
     try:
@@ -48,7 +182,8 @@ def process_single_group(group, buffer, client, model):
         print(f"Error processing group {sorted(group)}: {e}")
         return group, f"Error: {str(e)}"
     
-def generate_titles(neighbor_groups, client, buffer, model="o4-mini-2025-04-16", max_workers=10):
+def generate_titles(neighbor_groups, client, buffer, model="o4-mini-2025-04-16", max_workers=10, semantic_groups_path=None,
+                    label_cache=None, reuse_jaccard=0.8, batch_token_budget=None, journal=None):
     """
     Generate titles only for groups with more than 5 chunks using multi-threading.
     
@@ -58,9 +193,18 @@ def generate_titles(neighbor_groups, client, buffer, model="o4-mini-2025-04-16",
     - buffer: List of text chunks indexed by the indices in neighbor_groups
     - model: Model identifier to use
     - max_workers: Maximum number of threads to use
+    - semantic_groups_path: semantic_groups.json to update with the labels (defaults to the one next to this script)
+    - label_cache: LabelCache with labels from previous runs (None uses models/label_cache.json, False disables it)
+    - reuse_jaccard: minimum Jaccard overlap of member texts to reuse the label of a cached group
+      (1.0 reuses only identical groups)
+    - batch_token_budget: if set, several groups are labeled per request, packed up to this
+      estimated prompt size (see process_group_batch); None sends one request per group
+    - journal: Journal where each finished label is appended as it arrives, so an interrupted run
+      resumes without paying for them again (None uses semantic_groups.json.journal.jsonl, False disables it)
     
     Returns:
-    - Dictionary mapping groups to their generated labels
+    - Dictionary mapping groups to their generated labels (groups that could not be labeled map
+      to their current name in semantic_groups.json, e.g. group_3)
     """
     group_labels = {}
     start_time = time.time()
@@ -76,27 +220,91 @@ def generate_titles(neighbor_groups, client, buffer, model="o4-mini-2025-04-16",
     skipped_groups = len(frozen_groups) - len(groups_to_label)
     
     print(f"Generating titles for {len(groups_to_label)} groups (>1 chunks). Skipped {skipped_groups} groups.")
+
+    file_path_semanticgroups = semantic_groups_path
+    if file_path_semanticgroups is None:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        file_path_semanticgroups = os.path.join(base_dir, 'semantic_groups.json')
+
+    # Labels already paid for by an interrupted run. Records are keyed by the member texts too,
+    # so a journal left over from a different contract (same indices, other chunks) is not replayed
+    def group_key(group):
+        return content_hash(*(buffer[i] for i in sorted(group)))
+
+    journal = resolve_journal(journal, file_path_semanticgroups, signature=content_hash("titles", model))
+    if journal is not None:
+        wanted = set(groups_to_label)
+        for record in journal.replay():
+            group = frozenset(record["indices"])
+            if group in wanted and record.get("key") == group_key(group):
+                group_labels[group] = record["label"]
+        groups_to_label = [group for group in groups_to_label if group not in group_labels]
+
+    # Reuse labels of unchanged (or nearly unchanged) groups from previous runs
+    label_cache = resolve_label_cache(label_cache)
+    if label_cache is not None:
+        pending = []
+        used_labels = set(group_labels.values())
+        replayed = len(group_labels)
+        for group, label in group_labels.items():
+            label_cache.put([buffer[i] for i in group], model, label)
+        for group in groups_to_label:
+            texts = [buffer[i] for i in group]
+            label = label_cache.lookup(texts, model, min_jaccard=reuse_jaccard)
+            # A label identifies its group downstream, so it is never reused for two groups
+            if label is None or label in used_labels:
+                pending.append(group)
+            else:
+                group_labels[group] = label
+                used_labels.add(label)
+                label_cache.put(texts, model, label)
+        print(f"Reused {len(group_labels) - replayed} cached labels; {len(pending)} groups sent to the model.")
+        groups_to_label = pending
     
-    # Use thread pool
+    # Use thread pool: one task per group, or one task per batch of groups
+    if batch_token_budget:
+        batches = make_group_batches(groups_to_label, buffer, token_budget=batch_token_budget)
+        print(f"Batched naming: {len(groups_to_label)} groups in {len(batches)} requests.")
+    else:
+        batches = [[group] for group in groups_to_label]
+
+    def label_batch(batch):
+        if batch_token_budget:
+            return process_group_batch(batch, buffer, client, model)
+        return [process_single_group(batch[0], buffer, client, model)]
+
+    failed = set()
     with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_group = {
-            executor.submit(process_single_group, group, buffer, client, model): group
-            for group in groups_to_label
-        }
+        future_to_batch = {executor.submit(label_batch, batch): batch for batch in batches}
 
-        for future in tqdm(concurrent.futures.as_completed(future_to_group), total=len(groups_to_label), desc="Generating titles"):
-            group = future_to_group[future]
+        for future in tqdm(concurrent.futures.as_completed(future_to_batch), total=len(batches), desc="Generating titles"):
+            batch = future_to_batch[future]
+            # Groups of the batch without a label are failures, whatever the reason
+            failed.update(batch)
             try:
-                result_group, label = future.result()
-                group_labels[result_group] = label
+                for result_group, label in future.result():
+                    if label.startswith("Error:"):
+                        continue
+                    failed.discard(result_group)
+                    group_labels[result_group] = label
+                    if journal is not None:
+                        journal.append({"indices": sorted(result_group), "key": group_key(result_group),
+                                        "label": label})
+                    if label_cache is not None:
+                        label_cache.put([buffer[i] for i in result_group], model, label)
             except Exception as e:
-                print(f"Error retrieving result for group {sorted(group)}: {e}")
+                print(f"Error retrieving result for groups {[sorted(g) for g in batch]}: {e}")
+    if failed:
+        print(f"{len(failed)} groups could not be labeled; they keep their current name until the next run.")
+
+    if label_cache is not None:
+        try:
+            label_cache.save()
+        except Exception as e:
+            print(f"Error saving label cache: {e}")
     
     # Update semantic_groups.json
     try:
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        file_path_semanticgroups = os.path.join(base_dir, 'semantic_groups.json')
-        
         with open(file_path_semanticgroups, 'r', encoding='utf-8') as f:
             semantic_groups = json.load(f)
         
@@ -106,11 +314,17 @@ def generate_titles(neighbor_groups, client, buffer, model="o4-mini-2025-04-16",
                 group_data["group_name"] = group_labels[indices_set]
             else:
                 group_data["group_name"] = group_data.get("group_name", None)
+                # A failed group keeps its own name (group_N) downstream instead of a shared error label
+                if indices_set in failed and group_data["group_name"]:
+                    group_labels[indices_set] = group_data["group_name"]
         
         with open(file_path_semanticgroups, 'w', encoding='utf-8') as f:
             json.dump(semantic_groups, f, ensure_ascii=False, indent=2)
         
         print(f"Updated semantic_groups.json with {len(group_labels)} new labels.")
+        # With failures the journal is kept, so the next run only pays for the failed groups
+        if journal is not None and not failed:
+            journal.discard()
     
     except Exception as e:
         print(f"Error updating semantic_groups.json: {e}")
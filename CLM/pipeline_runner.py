@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import hashlib
+
+import instrumentation
+from fingerprints import content_hash
+
+
+class Stage:
+    """
+    Etapa del pipeline.
+
+    Args:
+        name: str, identificador de la etapa
+        run: callable(ctx), ejecuta la etapa y deja sus resultados en el dict `ctx`
+        load: callable(ctx), carga en `ctx` los resultados de la etapa desde sus artefactos
+            (se usa cuando la etapa está al día pero una etapa posterior necesita sus datos)
+        deps: nombres de las etapas cuyos resultados necesita
+        params: dict serializable en JSON con los parámetros que afectan al resultado
+        inputs: ficheros externos que lee (se fingerprintean por contenido)
+        outputs: ficheros que produce (deben existir para considerarla al día)
+    """
+
+    def __init__(self, name, run, load=None, deps=(), params=None, inputs=(), outputs=()):
+        self.name = name
+        self.run = run
+        self.load = load
+        self.deps = list(deps)
+        self.params = params or {}
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+
+
+class PipelineRunner:
+    """
+    Ejecuta un grafo de etapas saltándose las que ya están al día.
+
+    La huella de una etapa combina su nombre, sus parámetros, el contenido de sus ficheros
+    de entrada y las huellas de sus dependencias, de modo que cambiar un parámetro solo
+    invalida esa etapa y las posteriores. Una etapa está al día si su huella coincide con
+    la registrada en `state_path` al terminarla y sus artefactos existen. En cuanto una etapa
+    se ejecuta, las que dependen de ella se ejecutan también: sus huellas no cambian, pero los
+    ficheros que leen (o que comparten, como semantic_groups.json entre el agrupamiento y el
+    nombrado) sí. Por eso, antes de ejecutar una etapa se borran su registro y los de sus
+    dependientes: un fallo a mitad los deja pendientes y la siguiente ejecución reanuda desde
+    ahí. `name` se antepone a los mensajes de progreso (p. ej. el contrato cuando
+    corpus_build.py ejecuta varios a la vez).
+    """
+
+    def __init__(self, stages, state_path, name=None):
+        self.name = name
+        self.stages = _topological_order(stages)
+        self.by_name = {stage.name: stage for stage in self.stages}
+        self.state_path = state_path
+        self.state = self._load_state()
+
+    def _load_state(self):
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"Error loading pipeline state '{self.state_path}': {e}")
+        return {"stages": {}, "files": {}}
+
+    def _save_state(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def file_hash(self, path):
+        """sha256 del fichero, recalculado solo si cambian su tamaño o su mtime."""
+        st = os.stat(path)
+        cached = self.state["files"].get(path)
+        if cached and cached["size"] == st.st_size and cached["mtime_ns"] == st.st_mtime_ns:
+            return cached["sha256"]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        self.state["files"][path] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest.hexdigest()}
+        return digest.hexdigest()
+
+    def fingerprints(self):
+        """Huella actual de cada etapa, en orden topológico."""
+        fingerprints = {}
+        for stage in self.stages:
+            inputs = [self.file_hash(p) if os.path.exists(p) else f"missing:{p}" for p in stage.inputs]
+            fingerprints[stage.name] = content_hash(
+                stage.name,
+                json.dumps(stage.params, sort_keys=True, default=str),
+                *inputs,
+                *(fingerprints[d] for d in stage.deps),
+            )
+        return fingerprints
+
+    def is_current(self, stage, fingerprint):
+        record = self.state["stages"].get(stage.name)
+        return (
+            record is not None
+            and record["fingerprint"] == fingerprint
+            and all(os.path.exists(p) for p in stage.outputs)
+        )
+
+    def status(self):
+        """Dict etapa → True si está al día."""
+        fingerprints = self.fingerprints()
+        return {stage.name: self.is_current(stage, fingerprints[stage.name]) for stage in self.stages}
+
+    def downstream(self, name):
+        """La etapa `name` y todas las que dependen de ella (directa o indirectamente)."""
+        affected = {name}
+        for stage in self.stages:
+            if any(d in affected for d in stage.deps):
+                affected.add(stage.name)
+        return affected
+
+    def run(self, from_stage=None, force=False, ctx=None):
+        """
+        Ejecuta las etapas que no están al día.
+
+        Args:
+            from_stage: str, fuerza la ejecución de esta etapa y de las que dependen de ella
+            force: bool, ejecuta todas las etapas
+            ctx: dict inicial compartido por las etapas (p. ej. el cliente)
+
+        Returns:
+            ctx con los resultados de las etapas ejecutadas o cargadas
+        """
+        if from_stage is not None and from_stage not in self.by_name:
+            raise ValueError(f"Unknown stage '{from_stage}'. Stages: {', '.join(self.by_name)}")
+        ctx = {} if ctx is None else ctx
+        forced = set(self.by_name) if force else (self.downstream(from_stage) if from_stage else set())
+        fingerprints = self.fingerprints()
+        available = set()
+
+        for k, stage in enumerate(self.stages, start=1):
+            prefix = f"[{k}/{len(self.stages)}] {stage.name}"
+            if self.name:
+                prefix = f"{self.name} {prefix}"
+            if stage.name not in forced and self.is_current(stage, fingerprints[stage.name]):
+                print(f"{prefix}: al día, se omite")
+                continue
+
+            for dep in stage.deps:
+                self._ensure_loaded(dep, ctx, available)
+
+            print(f"{prefix}: ejecutando...")
+            # Las etapas que dependen de esta leen o reescriben sus artefactos: dejan de estar al día
+            for name in self.downstream(stage.name):
+                self.state["stages"].pop(name, None)
+            self._save_state()
+            start = time.time()
+            with instrumentation.stage(stage.name, pipeline=self.name):
+                stage.run(ctx)
+            available.add(stage.name)
+            self.state["stages"][stage.name] = {
+                "fingerprint": fingerprints[stage.name],
+                "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "seconds": round(time.time() - start, 3),
+            }
+            self._save_state()
+        return ctx
+
+    def _ensure_loaded(self, name, ctx, available):
+        if name in available:
+            return
+        stage = self.by_name[name]
+        if stage.load is None:
+            raise RuntimeError(f"Stage '{name}' has no loader; rerun it with from_stage='{name}'")
+        stage.load(ctx)
+        available.add(name)
+
+
+def _topological_order(stages):
+    by_name = {stage.name: stage for stage in stages}
+    order, visiting, done = [], set(), set()
+
+    def visit(stage):
+        if stage.name in done:
+            return
+        if stage.name in visiting:
+            raise ValueError(f"Cycle in pipeline stages at '{stage.name}'")
+        visiting.add(stage.name)
+        for dep in stage.deps:
+            if dep not in by_name:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dep}'")
+            visit(by_name[dep])
+        visiting.discard(stage.name)
+        done.add(stage.name)
+        order.append(stage)
+
+    for stage in stages:
+        visit(stage)
+    return order
@@ -0,0 +1,119 @@
+import time
+import threading
+
+from text_utils import estimate_tokens
+
+# Presupuesto por minuto de cada endpoint del cliente (peticiones y tokens estimados)
+DEFAULT_LIMITS = {
+    "embeddings": {"requests_per_minute": 3000, "tokens_per_minute": 1_000_000},
+    "responses": {"requests_per_minute": 500, "tokens_per_minute": 200_000},
+}
+
+
+class TokenBucket:
+    """
+    Cubo de fichas que se rellena a `rate_per_minute` / 60 por segundo hasta `capacity`.
+    `acquire` bloquea hasta que hay fichas suficientes; es seguro entre hilos.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(capacity if capacity is not None else rate_per_minute)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        """Consume `amount` fichas (como mucho la capacidad) y devuelve los segundos esperados."""
+        amount = min(float(amount), self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return waited
+                wait = (amount - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class RateLimitedClient:
+    """
+    Envoltorio de un cliente OpenAI que reparte un mismo presupuesto de peticiones y tokens
+    por minuto entre todos los hilos que lo usan (p. ej. todos los contratos de
+    corpus_build.py). Solo limita `embeddings.create` y `responses.create`; el resto de
+    atributos se delegan en el cliente original.
+
+    Args:
+        client: cliente OpenAI (o compatible)
+        limits: dict endpoint → {"requests_per_minute", "tokens_per_minute"}; None = DEFAULT_LIMITS.
+            Un endpoint sin entrada, o un límite a None, no se limita.
+    """
+
+    def __init__(self, client, limits=None):
+        self.client = client
+        self.limits = DEFAULT_LIMITS if limits is None else limits
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+        for endpoint in ("embeddings", "responses"):
+            if hasattr(client, endpoint):
+                limit = self.limits.get(endpoint, {})
+                setattr(self, endpoint, _LimitedEndpoint(self, endpoint, getattr(client, endpoint),
+                                                         _bucket(limit.get("requests_per_minute")),
+                                                         _bucket(limit.get("tokens_per_minute"))))
+                self._stats[endpoint] = {"requests": 0, "tokens": 0, "waited_seconds": 0.0}
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _record(self, endpoint, tokens, waited):
+        with self._stats_lock:
+            stats = self._stats[endpoint]
+            stats["requests"] += 1
+            stats["tokens"] += tokens
+            stats["waited_seconds"] += waited
+
+    def stats(self):
+        with self._stats_lock:
+            return {endpoint: {**s, "waited_seconds": round(s["waited_seconds"], 3)} for endpoint, s in self._stats.items()}
+
+
+class _LimitedEndpoint:
+    def __init__(self, owner, endpoint, target, requests, tokens):
+        self._owner = owner
+        self._endpoint = endpoint
+        self._target = target
+        self._requests = requests
+        self._tokens = tokens
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+    def create(self, *args, **kwargs):
+        tokens = _request_tokens(kwargs.get("input", args[0] if args else ""))
+        waited = 0.0
+        if self._requests is not None:
+            waited += self._requests.acquire(1)
+        if self._tokens is not None:
+            waited += self._tokens.acquire(tokens)
+        self._owner._record(self._endpoint, tokens, waited)
+        return self._target.create(*args, **kwargs)
+
+
+def _bucket(rate_per_minute):
+    return TokenBucket(rate_per_minute) if rate_per_minute else None
+
+
+def _request_tokens(payload):
+    """Tokens estimados de la entrada de una petición (textos o mensajes del chat)."""
+    if isinstance(payload, str):
+        return estimate_tokens(payload)
+    total = 0
+    for item in payload:
+        if isinstance(item, dict):
+            item = item.get("content", "")
+        total += estimate_tokens(item if isinstance(item, str) else str(item))
+    return total
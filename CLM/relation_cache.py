@@ -0,0 +1,72 @@
+import os
+import json
+import threading
+
+from fingerprints import content_hash, normalize_text
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RELATION_CACHE_PATH = os.path.join(BASE_DIR, "models", "relation_cache.json")
+
+
+class RelationCache:
+    """
+    Caché persistente de relaciones entre pares de grupos.
+
+    La clave combina el modelo y las huellas de los textos representativos de cada grupo
+    (en orden A → B), de modo que un par cuyos representativos no han cambiado nunca se
+    vuelve a enviar al LLM aunque los grupos hayan cambiado de nombre. Es seguro usarla
+    desde los hilos de definir_relaciones.
+    """
+
+    def __init__(self, path=DEFAULT_RELATION_CACHE_PATH):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = {}  # key → relación
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self._entries = json.load(f)
+
+    @staticmethod
+    def key(texts_a, texts_b, model):
+        side_a = content_hash(*(normalize_text(t) for t in texts_a))
+        side_b = content_hash(*(normalize_text(t) for t in texts_b))
+        return content_hash(model, side_a, side_b)
+
+    def get(self, texts_a, texts_b, model):
+        with self._lock:
+            relation = self._entries.get(self.key(texts_a, texts_b, model))
+            if relation is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return relation
+
+    def put(self, texts_a, texts_b, model, relation):
+        if not relation or relation.startswith("Error:"):
+            return
+        with self._lock:
+            self._entries[self.key(texts_a, texts_b, model)] = relation
+
+    def save(self):
+        # El lock cubre también la escritura: varios contratos pueden compartir la instancia
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+def resolve_relation_cache(cache):
+    """None → caché en models/relation_cache.json, False → sin caché, o la instancia recibida."""
+    if cache is False:
+        return None
+    if cache is None:
+        return RelationCache()
+    return cache
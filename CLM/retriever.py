@@ -1,92 +1,110 @@
 import json
 import os
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 from generate_embeddings import get_embedding  # Usa el mismo modelo OpenAI
-from collections import defaultdict
+from distance_engine import normalize_rows
+from retriever_index import resolve_index
+from functools import cached_property
 from openai import OpenAI
 from dotenv import load_dotenv
 
 class HybridRetriever:
-    def __init__(self, model_client, base_path="models/", embedding_model="text-embedding-3-small"):
+    def __init__(self, model_client, base_path="models/", embedding_model="text-embedding-3-small", cache=None,
+                 index=None):
         self.client = model_client
         self.embedding_model = embedding_model
+        # Caché de embeddings compartida (None → caché por defecto, False → sin caché)
+        self.cache = cache
         BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-        base_path = os.path.join(BASE_DIR, base_path)
-        # Cargar datos
-        self.chunk_data = self._load_json(os.path.join(base_path, "embeddings.json"))
-        self.semantic_groups = self._load_json(os.path.join(base_path, "semantic_groups.json"))
-        self.meta_labels = self._load_json(os.path.join(base_path, "meta_labels.json"))
-        self.relations = self._load_json(os.path.join(base_path, "relations.json"))
-
-        # Mapeo chunk → texto
-        self.chunk_texts = {int(entry["id"]): entry["text"] for entry in self.chunk_data}
-        # Mapeo grupo → lista de chunk_ids
-        self.group_to_chunks = {
-            group["group_name"]: group["indices"]
-            for group in self.semantic_groups
-        }
-        # Mapeo grupo → embedding (centroide)
-        self.group_embeddings = self._compute_group_embeddings()
+        self.base_path = os.path.join(BASE_DIR, base_path)
+        # Índice precalculado (retriever_index.bin) abierto con mmap: solo se lee la cabecera.
+        # Centroides normalizados, máscaras de grupos densos/loneliners, miembros, vecinos y textos.
+        # None → el de base_path si está al día (si no, se construye en memoria desde los JSON)
+        self.index = resolve_index(index, self.base_path)
+
+    # Los artefactos originales se cargan solo si alguien los pide
+    @cached_property
+    def semantic_groups(self):
+        return self._load_json(os.path.join(self.base_path, "semantic_groups.json"))
+
+    @cached_property
+    def meta_labels(self):
+        return self._load_json(os.path.join(self.base_path, "meta_labels.json"))
+
+    @cached_property
+    def relations(self):
+        return self._load_json(os.path.join(self.base_path, "relations.json"))
 
     def _load_json(self, path):
         with open(path, "r", encoding="utf-8") as f:
             return json.load(f)
 
-    def _compute_group_embeddings(self):
-        group_embs = {}
-        for group, chunk_ids in self.group_to_chunks.items():
-            vectors = [self.chunk_data[i]["embedding"] for i in chunk_ids]
-            group_embs[group] = np.mean(vectors, axis=0).tolist()
-        return group_embs
-
-    def retrieve_context(self,query, top_k=5, include_neighbors=True, sim_threshold=0.5, force_loneliners=3):
-        query_emb = get_embedding(query, self.client, model=self.embedding_model)
-
-        # Calcular similitud entre query y cada grupo
-        group_scores = []
-        for group, group_emb in self.group_embeddings.items():
-            sim = cosine_similarity([query_emb], [group_emb])[0][0]
-            group_scores.append((group, sim))
+    def score_groups(self, query_emb):
+        """Similitud coseno de la query con cada grupo (np.ndarray (G,), fila k ↔ index.group_name(k))."""
+        return self.index["centroids"] @ normalize_rows([query_emb])[0]
+
+    def _score_rows(self, query_emb, chunk_rows):
+        """Similitud coseno de la query con cada fila de chunk indicada (vectores del embedding store)."""
+        if not len(chunk_rows):
+            return np.zeros(0, dtype=np.float32)
+        return self.index.chunk_vectors(chunk_rows) @ normalize_rows([query_emb])[0]
+
+    def retrieve_context(self,query, top_k=5, include_neighbors=True, sim_threshold=0.5, force_loneliners=3,
+                         chunk_budget=None):
+        """
+        Recupera en dos fases: grupos (densos, loneliners y vecinos en el grafo) y, de sus chunks,
+        los más similares a la query. Devuelve los chunks ordenados por score (similitud coseno
+        con la query), como mucho `chunk_budget` (None = todos los candidatos).
+        """
+        query_emb = get_embedding(query, self.client, model=self.embedding_model, cache=self.cache)
+
+        # Similitud entre query y cada grupo: un producto matriz-vector sobre los centroides
+        scores = self.score_groups(query_emb)
+        index = self.index
 
         # === FASE 1: Recuperar top_k grupos densos ===
-        dense_groups = [
-            (g, s) for g, s in group_scores if len(self.group_to_chunks.get(g, [])) > 1 and s >= sim_threshold
-        ]
-        dense_groups = sorted(dense_groups, key=lambda x: x[1], reverse=True)[:top_k]
-        selected_groups = set(g for g, _ in dense_groups)
+        dense_rows = np.flatnonzero(index["dense_mask"] & (scores >= sim_threshold))
+        selected = _top_k(dense_rows, scores, top_k)
 
         # === FASE 2: Añadir los loneliners más similares ===
-        loneliner_scores = [
-            (g, s) for g, s in group_scores if len(self.group_to_chunks.get(g, [])) == 1
-        ]
-        top_loneliners = sorted(loneliner_scores, key=lambda x: x[1], reverse=True)[:force_loneliners]
-        for loneliner, _ in top_loneliners:
-            selected_groups.add(loneliner)
+        selected = np.concatenate([selected, _top_k(index["loneliner_rows"], scores, force_loneliners)])
 
         # === EXPANSIÓN DE VECINOS EN EL GRAFO ===
         if include_neighbors:
-            neighbors = set()
-            for g in selected_groups:
-                neighbors |= set(self.relations.get(g, {}).keys())
-            selected_groups |= neighbors
+            # Vecinos por relaciones en ambos sentidos (a → b y b → a)
+            selected = np.union1d(selected, index.neighbors(selected))
 
         # === Recuperar chunks asociados ===
-        relevant_chunk_ids = set()
-        for group in selected_groups:
-            chunk_ids = self.group_to_chunks.get(group, [])
-            relevant_chunk_ids.update(chunk_ids)
+        candidate_rows = index.members(selected)
+
+        # === FASE 3: Reordenar los chunks candidatos contra la query ===
+        chunk_scores = self._score_rows(query_emb, candidate_rows)
+        budget = len(candidate_rows) if chunk_budget is None else chunk_budget
+        ranked = _top_k(np.arange(len(candidate_rows)), chunk_scores, budget)
 
         # === Extraer texto y grupos relacionados ===
         results = [{
-            "chunk_id": cid,
-            "text": self.chunk_texts[cid],
-            "groups": self.meta_labels[str(cid)]["meta"].get("groups_related", [])
-        } for cid in sorted(relevant_chunk_ids)]
+            "chunk_id": index.chunk_id(candidate_rows[k]),
+            "text": index.chunk_text(candidate_rows[k]),
+            "groups": index.chunk_labels(candidate_rows[k]),
+            "score": round(float(chunk_scores[k]), 4),
+        } for k in ranked]
 
         return results
 
 
+def _top_k(candidates, scores, k):
+    """Los k índices de `candidates` con mayor score, ordenados de mayor a menor (argpartition + orden de k)."""
+    if k <= 0 or not len(candidates):
+        return candidates[:0]
+    candidate_scores = scores[candidates]
+    if k < len(candidates):
+        top = np.argpartition(-candidate_scores, k - 1)[:k]
+    else:
+        top = np.arange(len(candidates))
+    return candidates[top[np.argsort(-candidate_scores[top], kind="stable")]]
+
+
 #load_dotenv()
 #client = OpenAI()
 #retriever = HybridRetriever(client)
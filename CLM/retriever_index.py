@@ -0,0 +1,296 @@
+"""
+Índice del retriever en un único fichero que se abre con mmap.
+
+Formato de retriever_index.bin:
+    MAGIC (8 bytes) | longitud de la cabecera (uint64 LE) | cabecera JSON | arrays
+La cabecera describe cada array (dtype, shape y offset, alineado a 64 bytes) y los metadatos
+(dimensión, número de grupos y chunks, embedding store del que salen los vectores de chunk).
+
+Arrays:
+    centroids           (G, d) float32, centroides normalizados; fila k ↔ grupo k
+    dense_mask          (G,) bool, grupos con más de un chunk
+    loneliner_rows      filas de los grupos de un solo chunk
+    group_indptr/_members       CSR grupo → filas de chunk
+    group_name_bytes/_offsets   nombres de grupo (UTF-8 concatenado)
+    neighbor_indptr/_rows       CSR grupo → grupos vecinos a un salto en el grafo (ambos sentidos, sin "part of")
+    chunk_ids                   id de cada fila de chunk
+    chunk_group                 (n,) grupo de cada chunk (-1 si no está en ninguno)
+    text_bytes/_offsets         textos de los chunks
+    label_bytes/_offsets, chunk_label_indptr/_ids   grupos relacionados de cada chunk (meta_labels)
+
+Abrir el índice solo lee la cabecera: cada array se mapea la primera vez que se usa, así que
+el coste de arranque no depende del tamaño del corpus. Los vectores de chunk no se copian:
+se leen con mmap del embedding store (embeddings.npy) al reordenar los candidatos.
+
+Uso:
+    python retriever_index.py [directorio de modelos]
+"""
+import os
+import sys
+import json
+import struct
+import numpy as np
+
+from embedding_store import load_embedding_store
+from distance_engine import normalize_rows
+from kg_graph import KnowledgeGraph, _gather, _pack_strings
+
+INDEX_FILE = "retriever_index.bin"
+SOURCE_FILES = ["embeddings.npy", "semantic_groups.json", "meta_labels.json", "relations.json"]
+MAGIC = b"CLMIDX1\n"
+ALIGN = 64
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+
+
+class RetrieverIndex:
+    """
+    Arrays del retriever, en memoria (build_retriever_index) o mapeados desde fichero (open).
+    `index[name]` devuelve el array; los métodos resuelven nombres, textos, miembros y vecinos
+    de filas concretas sin materializar nada más.
+    """
+
+    def __init__(self, meta, arrays=None, path=None, specs=None, matrix=None):
+        self.meta = meta
+        self.path = path
+        self._arrays = dict(arrays or {})
+        self._specs = specs or {}
+        self._matrix = matrix
+
+    @classmethod
+    def open(cls, path):
+        """Lee solo la cabecera; los arrays se mapean bajo demanda."""
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"'{path}' no es un índice del retriever")
+            (length,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(length).decode("utf-8"))
+        return cls(header["meta"], path=path, specs=header["arrays"])
+
+    def __getitem__(self, name):
+        array = self._arrays.get(name)
+        if array is None:
+            spec = self._specs[name]
+            shape = tuple(spec["shape"])
+            if 0 in shape:
+                array = np.zeros(shape, dtype=spec["dtype"])
+            else:
+                array = np.memmap(self.path, dtype=spec["dtype"], mode="r", offset=spec["offset"], shape=shape)
+            self._arrays[name] = array
+        return array
+
+    def names(self):
+        return list(self._specs or self._arrays)
+
+    @property
+    def n_groups(self):
+        return self.meta["n_groups"]
+
+    @property
+    def n_chunks(self):
+        return self.meta["n_chunks"]
+
+    @property
+    def matrix(self):
+        """Matriz de embeddings de los chunks (mmap del embedding store la primera vez que se usa)."""
+        if self._matrix is None:
+            base = os.path.dirname(os.path.abspath(self.path))
+            self._matrix = np.load(os.path.join(base, self.meta["embeddings"]), mmap_mode="r")
+        return self._matrix
+
+    # === Consultas por fila ===
+
+    def group_name(self, row):
+        return _string(self["group_name_bytes"], self["group_name_offsets"], row)
+
+    def chunk_id(self, row):
+        return int(self["chunk_ids"][row])
+
+    def chunk_text(self, row):
+        return _string(self["text_bytes"], self["text_offsets"], row)
+
+    def chunk_labels(self, row):
+        """Grupos relacionados del chunk según meta_labels.json."""
+        indptr = self["chunk_label_indptr"]
+        label_ids = self["chunk_label_ids"][indptr[row]:indptr[row + 1]]
+        return [_string(self["label_bytes"], self["label_offsets"], k) for k in label_ids]
+
+    def members(self, group_rows):
+        """Filas de chunk (únicas, ordenadas) de los grupos indicados."""
+        return np.unique(_gather(self["group_indptr"], self["group_members"], np.asarray(group_rows, dtype=np.int64)))
+
+    def neighbors(self, group_rows):
+        """Grupos a un salto en el grafo de alguno de `group_rows` (sin repetir)."""
+        return np.unique(_gather(self["neighbor_indptr"], self["neighbor_rows"], np.asarray(group_rows, dtype=np.int64)))
+
+    def chunk_vectors(self, chunk_rows):
+        """Embeddings normalizados de las filas de chunk indicadas."""
+        return normalize_rows(self.matrix[np.asarray(chunk_rows, dtype=np.int64)])
+
+
+def build_retriever_index(base_path=BASE_DIR, save_path=None):
+    """
+    Construye el índice del retriever a partir de los artefactos del pipeline en `base_path`
+    (embedding store, semantic_groups.json, meta_labels.json, relations.json y kg_graph.npz
+    si está al día) y, si se indica, lo guarda en `save_path`.
+    """
+    store = load_embedding_store(os.path.join(base_path, "embeddings.npy"))
+    semantic_groups = _load_json(os.path.join(base_path, "semantic_groups.json"))
+    meta_labels = _load_json(os.path.join(base_path, "meta_labels.json"))
+    graph_path = os.path.join(base_path, "kg_graph.npz")
+    relations_path = os.path.join(base_path, "relations.json")
+    if os.path.exists(graph_path) and os.path.getmtime(graph_path) >= os.path.getmtime(relations_path):
+        graph = KnowledgeGraph.load(graph_path)
+    else:
+        graph = KnowledgeGraph.from_artifacts(_load_json(relations_path), meta_labels, semantic_groups)
+
+    # Mismo mapeo grupo → chunks que usaba el retriever (un nombre repetido se queda con el último grupo)
+    group_to_chunks = {group["group_name"]: group["indices"] for group in semantic_groups}
+    group_names = list(group_to_chunks)
+    sizes = np.array([len(c) for c in group_to_chunks.values()], dtype=np.int64)
+    member_lists = [np.sort([store.row_of(cid) for cid in chunk_ids]).astype(np.int64) for chunk_ids in group_to_chunks.values()]
+    group_indptr = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+    group_members = np.concatenate(member_lists) if member_lists else np.empty(0, dtype=np.int64)
+    matrix = store.matrix
+
+    centroids = np.zeros((len(group_names), store.dim), dtype=np.float32)
+    if len(group_members):
+        sums = np.add.reduceat(np.asarray(matrix[group_members], dtype=np.float32), group_indptr[:-1][sizes > 0], axis=0)
+        centroids[sizes > 0] = sums
+    centroids = normalize_rows(centroids)
+
+    n = len(store)
+    chunk_ids = np.asarray(store.ids, dtype=np.int64)
+    chunk_group = np.full(n, -1, dtype=np.int64)
+    chunk_group[group_members] = np.repeat(np.arange(len(group_names), dtype=np.int64), sizes)
+
+    # Grupos relacionados de cada chunk, como ids sobre una tabla de etiquetas
+    labels, label_index, chunk_labels = [], {}, []
+    for cid in store.ids:
+        ids = []
+        for label in meta_labels.get(str(cid), {}).get("meta", {}).get("groups_related", []):
+            if label not in label_index:
+                label_index[label] = len(labels)
+                labels.append(label)
+            ids.append(label_index[label])
+        chunk_labels.append(ids)
+    chunk_label_indptr = np.concatenate([[0], np.cumsum([len(c) for c in chunk_labels])]).astype(np.int64)
+    chunk_label_ids = np.fromiter((k for c in chunk_labels for k in c), dtype=np.int64, count=int(chunk_label_indptr[-1]))
+
+    group_name_bytes, group_name_offsets = _pack_strings(group_names)
+    text_bytes, text_offsets = _pack_strings(store.texts)
+    label_bytes, label_offsets = _pack_strings(labels)
+    neighbor_indptr, neighbor_rows = _neighbor_csr(graph, group_names)
+    arrays = {
+        "centroids": centroids,
+        "dense_mask": sizes > 1,
+        "loneliner_rows": np.flatnonzero(sizes == 1).astype(np.int64),
+        "group_indptr": group_indptr, "group_members": group_members,
+        "group_name_bytes": group_name_bytes, "group_name_offsets": group_name_offsets,
+        "neighbor_indptr": neighbor_indptr, "neighbor_rows": neighbor_rows,
+        "chunk_ids": chunk_ids,
+        "chunk_group": chunk_group,
+        "text_bytes": text_bytes, "text_offsets": text_offsets,
+        "label_bytes": label_bytes, "label_offsets": label_offsets,
+        "chunk_label_indptr": chunk_label_indptr, "chunk_label_ids": chunk_label_ids,
+    }
+    meta = {"version": 1, "dim": store.dim, "n_groups": len(group_names), "n_chunks": n, "embeddings": "embeddings.npy"}
+    index = RetrieverIndex(meta, arrays=arrays, matrix=matrix)
+    if save_path:
+        save_retriever_index(index, save_path)
+        print(f"Índice del retriever guardado en '{save_path}' ({len(group_names)} grupos, {n} chunks)")
+    return index
+
+
+def save_retriever_index(index, path):
+    """Escribe el índice (cabecera JSON + arrays alineados) de forma atómica."""
+    specs, offset = {}, 0
+    for name in index.names():
+        array = np.ascontiguousarray(index[name])
+        offset = _aligned(offset)
+        specs[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += array.nbytes
+    # Los offsets son relativos al final de la cabecera; se fijan cuando se conoce su longitud
+    header_len = 0
+    while True:
+        start = _aligned(len(MAGIC) + 8 + header_len)
+        header = json.dumps({"meta": index.meta, "arrays": {
+            name: {**spec, "offset": spec["offset"] + start} for name, spec in specs.items()
+        }}, ensure_ascii=False).encode("utf-8")
+        if len(header) <= header_len:
+            break
+        header_len = len(header) + 64
+    header = header.ljust(header_len)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<Q", header_len) + header)
+        for name, spec in specs.items():
+            f.write(b"\0" * (spec["offset"] + start - f.tell()))
+            f.write(np.ascontiguousarray(index[name]).tobytes())
+    os.replace(tmp_path, path)
+
+
+def index_is_fresh(base_path, index_path=None):
+    """True si el índice existe y es posterior a todos los artefactos de los que sale."""
+    index_path = index_path or os.path.join(base_path, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return False
+    built = os.path.getmtime(index_path)
+    return all(os.path.getmtime(os.path.join(base_path, name)) <= built
+               for name in SOURCE_FILES if os.path.exists(os.path.join(base_path, name)))
+
+
+def resolve_index(index, base_path):
+    """
+    Traduce el argumento `index` del retriever:
+    None → retriever_index.bin de `base_path` si está al día (si no, se construye en memoria),
+    False → siempre se construye en memoria desde los JSON, str → ruta del índice, o la instancia recibida.
+    """
+    if isinstance(index, RetrieverIndex):
+        return index
+    if isinstance(index, str):
+        return RetrieverIndex.open(index)
+    if index is None and index_is_fresh(base_path):
+        return RetrieverIndex.open(os.path.join(base_path, INDEX_FILE))
+    if index is None:
+        print(f"{INDEX_FILE} no existe o no está al día en '{base_path}': se construye en memoria "
+              f"(python retriever_index.py para guardarlo)")
+    return build_retriever_index(base_path)
+
+
+def _neighbor_csr(graph, group_names):
+    """CSR grupo → grupos vecinos (relaciones en ambos sentidos, sin enlaces "part of")."""
+    G = len(group_names)
+    node_row = np.full(len(graph), -1, dtype=np.int64)
+    for row, name in enumerate(group_names):
+        node = graph.node_index.get(name)
+        if node is not None:
+            node_row[node] = row
+    sources = np.repeat(np.arange(len(graph), dtype=np.int64), np.diff(graph.out_indptr))
+    keep = graph.out_relations != graph.part_of_id
+    a, b = node_row[sources[keep]], node_row[graph.out_indices[keep]]
+    valid = (a >= 0) & (b >= 0)
+    rows = np.concatenate([a[valid], b[valid]])
+    cols = np.concatenate([b[valid], a[valid]])
+    pairs = np.unique(np.stack([rows, cols], axis=1), axis=0) if len(rows) else np.empty((0, 2), dtype=np.int64)
+    indptr = np.zeros(G + 1, dtype=np.int64)
+    np.cumsum(np.bincount(pairs[:, 0], minlength=G), out=indptr[1:])
+    return indptr, pairs[:, 1].astype(np.int64)
+
+
+def _string(data, offsets, k):
+    return bytes(data[offsets[k]:offsets[k + 1]]).decode("utf-8")
+
+
+def _aligned(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _load_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    base = sys.argv[1] if len(sys.argv) > 1 else BASE_DIR
+    build_retriever_index(base, save_path=os.path.join(base, INDEX_FILE))
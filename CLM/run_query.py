@@ -6,6 +6,7 @@ from verifier import verify_event_sources
 from generate_calendar_vis import generate_contractual_calendar_html, load_calendar_from_file
 from openai import OpenAI
 from dotenv import load_dotenv
+import instrumentation
 import json
 import os
 
@@ -14,6 +15,7 @@ TOP_K_GROUPS = 10
 NUM_LONELINERS = 3
 SIM_THRESHOLD = 0.69
 INCLUDE_NEIGHBORS = True
+CHUNK_BUDGET = 20  # chunks de contexto, los más similares a la query; None = todos los de los grupos
 MODEL_NAME = "o4-mini-2025-04-16"
 PROMPT_PATH = "prompts/generate_event_prompt.txt"
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -22,31 +24,60 @@ QUERIES_PATH = "models/queries.json"
 QUERIES_PATH = os.path.join(BASE_DIR, QUERIES_PATH)
 
 
-def run(query: str):
+# Cliente y retriever compartidos entre queries del mismo proceso
+_default_client = None
+_default_retriever = None
+
+
+def get_default_client():
+    """Cliente OpenAI del proceso (se crea la primera vez)."""
+    global _default_client
+    if _default_client is None:
+        load_dotenv()
+        _default_client = instrumentation.instrument_client(OpenAI())
+    return _default_client
+
+
+def get_default_retriever(client):
+    """Retriever sobre models/ del proceso; se vuelve a abrir solo si cambia el cliente."""
+    global _default_retriever
+    if _default_retriever is None or _default_retriever.client is not client:
+        with instrumentation.stage("load_retriever"):
+            _default_retriever = HybridRetriever(client)
+    return _default_retriever
+
+
+def run(query: str, client=None, retriever=None, prompt_path=PROMPT_PATH):
     # === Inicializar cliente y módulos ===
-    load_dotenv()
-    client = OpenAI()
-    retriever = HybridRetriever(client)
+    # client y retriever se pueden inyectar (p. ej. local_clients.LocalOpenAIClient en los benchmarks);
+    # si no, se reutilizan los del proceso en lugar de crearlos en cada query
+    if client is None:
+        client = get_default_client()
+    if retriever is None:
+        retriever = get_default_retriever(client)
 
     print("\n🔍 Recuperando chunks relevantes...")
-    context_chunks = retriever.retrieve_context(
-        query=query,
-        top_k=TOP_K_GROUPS,
-        sim_threshold=SIM_THRESHOLD,
-        force_loneliners=NUM_LONELINERS,
-        include_neighbors=INCLUDE_NEIGHBORS
-    )
+    with instrumentation.stage("retrieval"):
+        context_chunks = retriever.retrieve_context(
+            query=query,
+            top_k=TOP_K_GROUPS,
+            sim_threshold=SIM_THRESHOLD,
+            force_loneliners=NUM_LONELINERS,
+            include_neighbors=INCLUDE_NEIGHBORS,
+            chunk_budget=CHUNK_BUDGET
+        )
     print(f"✅ Recuperados {len(context_chunks)} chunks.\n")
 
     # === Generar evento(s) estructurado(s) ===
     print("🧠 Generando evento(s) a partir del contexto...")
-    events = generate_event(
-        query=query,
-        context_chunks=context_chunks,
-        client=client,
-        model=MODEL_NAME,
-        prompt_path=PROMPT_PATH
-    )
+    with instrumentation.stage("generation"):
+        events = generate_event(
+            query=query,
+            context_chunks=context_chunks,
+            client=client,
+            model=MODEL_NAME,
+            prompt_path=prompt_path
+        )
 
     # Normalizar a lista
     if isinstance(events, dict):
@@ -56,7 +87,8 @@ def run(query: str):
 
     # === Verificar fuentes del/los evento(s) ===
     print("🔍 Extrayendo citas del/los evento(s)...")
-    verified = verify_event_sources(events, context_chunks)
+    with instrumentation.stage("verification"):
+        verified = verify_event_sources(events, context_chunks)
 
     # === Mostrar resultado ===
     print("\n📦 EVENTOS GENERADOS:")
@@ -66,22 +98,27 @@ def run(query: str):
     # === Mostrar contexto fuente ===
     print("\n📚 CHUNKS DE CONTEXTO UTILIZADOS:")
     for c in context_chunks:
-        print(f"\nChunk {c['chunk_id']} (Groups: {', '.join(c['groups'])})")
+        print(f"\nChunk {c['chunk_id']} (score {c['score']:.3f}, Groups: {', '.join(c['groups'])})")
         print(c['text'])
 
     return verified
 
 
 if __name__ == "__main__":
+    # CLM_INSTRUMENT=1 guarda un informe de tiempos y tokens por query en models/runs/
+    load_dotenv()
+    instrumentation.enable_from_env("run_query")
     with open(QUERIES_PATH, "r", encoding="utf-8") as f:
         queries = json.load(f)
     calendar = []
-    for q in queries:
+    for n, q in enumerate(queries):
         query = q["question"]
         print(f"\n\n=== Ejecutando query: {query} ===")
-        events = run(query)
+        with instrumentation.stage("query", index=n):
+            events = run(query)
         for e in events:
             calendar.append(e)
+    instrumentation.save_report()
     # Guardar calendario generado
     output_path = os.path.join(BASE_DIR, "generated_calendar.json")
     with open(output_path, "w", encoding="utf-8") as f:
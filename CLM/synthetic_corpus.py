@@ -0,0 +1,208 @@
+"""
+Generador de corpus EPC sintéticos para pruebas de escala (de 1k a 1M chunks).
+
+Cada chunk es un párrafo tipo cláusula de un tema (plazo de pago, daños por retraso, fuerza
+mayor, garantías...) con referencias a cláusulas, fechas, importes y porcentajes. Los
+embeddings sintéticos siguen la misma asignación de temas: centro aleatorio por tema más
+ruido, y un porcentaje de outliers sin tema, de modo que el agrupamiento tiene una verdad
+conocida (topics.npy, -1 = outlier).
+
+Todo se escribe por bloques: la matriz va a un .npy abierto con open_memmap y los textos
+se vuelcan al sidecar a medida que se generan, así que 1M chunks caben en poca memoria.
+La salida es un embedding store normal (ver embedding_store.py) más un contrato .txt cuyo
+chunking (chunk_lines) reproduce exactamente los mismos chunks.
+
+Uso:
+    python synthetic_corpus.py 100000 /tmp/corpus_100k --dim 256 --topics 4000
+"""
+import os
+import json
+import argparse
+import numpy as np
+
+from embedding_store import store_paths
+
+DEFAULT_DIM = 256
+CHUNKS_PER_TOPIC = 25
+BLOCK_ROWS = 65536
+
+# (título, dos frases con huecos: {clause} {days} {date} {amount} {pct} {party} {scope})
+BASE_TOPICS = [
+    ("Payment Terms", "The Owner shall pay each approved invoice for the {scope} within {days} days of receipt.",
+     "Late payments under Clause {clause} bear interest at {pct}% per annum from {date}."),
+    ("Delay Liquidated Damages", "If the {scope} is not completed by {date}, delay liquidated damages accrue at {pct}% of the Contract Price per week.",
+     "Delay liquidated damages under Clause {clause} are capped at {amount}."),
+    ("Force Majeure", "A Party affected by a Force Majeure Event affecting the {scope} shall notify the other Party within {days} days.",
+     "If the Force Majeure Event continues beyond {date}, either Party may terminate under Clause {clause}."),
+    ("Defects Warranty", "The {party} warrants the {scope} against defects for {days} months after the Taking Over Date.",
+     "Remedial works under Clause {clause} shall start no later than {date}, up to {amount}."),
+    ("Termination for Default", "The Owner may terminate the Agreement on {days} days written notice if the {party} abandons the {scope}.",
+     "Upon termination under Clause {clause}, the {party} shall be paid {pct}% of the value of work performed up to {date}."),
+    ("Insurance Obligations", "The {party} shall maintain construction all-risk insurance covering the {scope} for not less than {amount}.",
+     "Certificates of insurance shall be delivered under Clause {clause} by {date} and renewed every {days} days."),
+    ("Performance Guarantees", "The {scope} shall achieve at least {pct}% of the Guaranteed Capacity during the performance tests.",
+     "Performance liquidated damages under Clause {clause} are payable within {days} days, up to {amount}."),
+    ("Permits and Approvals", "The {party} shall obtain all permits required for the {scope} within {days} days of the Effective Date.",
+     "Delays in permits issued after {date} entitle the {party} to an extension under Clause {clause}."),
+    ("Variations", "The Owner may instruct variations to the {scope}; the {party} shall submit a proposal within {days} days.",
+     "Variations exceeding {amount} or {pct}% of the Contract Price require approval under Clause {clause}."),
+    ("Security and Bonds", "The {party} shall deliver a performance bond for {pct}% of the Contract Price by {date}.",
+     "The bond under Clause {clause} for the {scope} shall remain valid for {days} days after Final Acceptance."),
+    ("Dispute Resolution", "Any dispute concerning the {scope} shall first be referred to the Project Managers for {days} days.",
+     "Disputes above {amount} not settled by {date} shall be finally resolved by arbitration under Clause {clause}."),
+    ("Health Safety and Environment", "The {party} shall comply with the HSE Plan for the {scope} and report incidents within {days} days.",
+     "Breaches of Clause {clause} after {date} entitle the Owner to withhold {pct}% of the next payment."),
+]
+SCOPES = [
+    "Works", "Substation", "Solar Field", "Transmission Line", "Civil Works", "Inverter Station", "Control Building",
+    "Access Roads", "Battery Storage System", "Switchyard", "Water Treatment Plant", "Cooling System",
+    "Turbine Island", "Balance of Plant", "SCADA System", "Foundations", "Cable Trenches", "Commissioning",
+]
+PARTIES = ["Contractor", "Subcontractor", "EPC Contractor", "Supplier"]
+MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October",
+          "November", "December"]
+
+
+def topic_catalog(n_topics):
+    """Temas (título, plantillas, ámbito) combinando los temas base con los ámbitos del proyecto."""
+    topics = []
+    for k in range(n_topics):
+        title, first, second = BASE_TOPICS[k % len(BASE_TOPICS)]
+        scope = SCOPES[(k // len(BASE_TOPICS)) % len(SCOPES)]
+        variant = k // (len(BASE_TOPICS) * len(SCOPES))
+        if variant:
+            scope = f"{scope} Phase {variant + 1}"
+        topics.append({"title": f"{title} - {scope}", "templates": (first, second), "scope": scope})
+    return topics
+
+
+def assign_topics(n_chunks, n_topics, outlier_ratio=0.05, seed=0):
+    """Tema de cada chunk (-1 para los outliers)."""
+    rng = np.random.default_rng(seed)
+    topics = rng.integers(0, n_topics, n_chunks)
+    topics[rng.random(n_chunks) < outlier_ratio] = -1
+    return topics
+
+
+def chunk_lines_for(topics, catalog, start=0, seed=0):
+    """
+    Dos líneas de contrato por chunk (la cláusula y su desarrollo) para los chunks
+    `start .. start + len(topics)`. Las cifras salen de un generador por bloque.
+    """
+    rng = np.random.default_rng([seed, start])
+    n = len(topics)
+    clause_major = rng.integers(1, 40, n)
+    clause_minor = rng.integers(1, 15, n)
+    days = rng.choice([5, 7, 10, 14, 15, 21, 28, 30, 45, 60, 90, 180], n)
+    pcts = rng.choice([0.5, 1, 2, 5, 10, 15, 20, 25, 95, 98], n)
+    amounts = rng.integers(1, 500, n) * 10_000
+    years = rng.integers(2023, 2031, n)
+    months = rng.integers(0, 12, n)
+    month_days = rng.integers(1, 29, n)
+    parties = rng.integers(0, len(PARTIES), n)
+    outlier_topics = rng.integers(0, len(catalog), n)
+    lines = []
+    for k in range(n):
+        topic = catalog[topics[k] if topics[k] >= 0 else outlier_topics[k]]
+        fields = {
+            "clause": f"{clause_major[k]}.{clause_minor[k]}",
+            "days": int(days[k]),
+            "pct": f"{float(pcts[k]):g}",
+            "amount": f"EUR {int(amounts[k]):,}",
+            "date": f"{month_days[k]} {MONTHS[months[k]]} {years[k]}",
+            "party": PARTIES[parties[k]],
+            "scope": topic["scope"],
+        }
+        first, second = topic["templates"]
+        if topics[k] < 0:
+            # Outlier: mezcla la primera frase de un tema con la segunda de otro
+            second = catalog[(outlier_topics[k] + 7) % len(catalog)]["templates"][1]
+        heading = f"Clause {fields['clause']} ({topic['title'] if topics[k] >= 0 else 'Miscellaneous'})."
+        lines.append(f"{heading} {first.format(**fields)}")
+        lines.append(second.format(**fields))
+    return lines
+
+
+def topic_embeddings(topics, n_topics, dim=DEFAULT_DIM, noise=0.35, seed=0, out=None, start=0):
+    """
+    Embeddings normalizados (float32) de los chunks con temas `topics`: centro del tema
+    más ruido gaussiano, o un vector aleatorio para los outliers. Los centros dependen solo
+    de `seed`, así que bloques distintos de un mismo corpus son coherentes.
+    """
+    centers = np.random.default_rng([seed, 0]).standard_normal((n_topics, dim)).astype(np.float32)
+    rng = np.random.default_rng([seed, 1, start])
+    n = len(topics)
+    X = out if out is not None else np.empty((n, dim), dtype=np.float32)
+    outliers = topics < 0
+    X[~outliers] = centers[topics[~outliers]] + noise * rng.standard_normal((int((~outliers).sum()), dim), dtype=np.float32)
+    X[outliers] = rng.standard_normal((int(outliers.sum()), dim), dtype=np.float32)
+    X /= np.linalg.norm(X, axis=1, keepdims=True)
+    return X
+
+
+def generate_corpus(n_chunks, out_dir, n_topics=None, dim=DEFAULT_DIM, noise=0.35, outlier_ratio=0.05, seed=0,
+                    block_rows=BLOCK_ROWS):
+    """
+    Genera un corpus sintético de `n_chunks` chunks en `out_dir`.
+
+    Escribe:
+        contract.txt        dos líneas por chunk (chunk_lines las une en el mismo texto)
+        embeddings.npy      matriz float32 (n_chunks, dim), escrita por bloques con open_memmap
+        embeddings.ids.json sidecar del embedding store (ids y textos)
+        topics.npy          tema de cada chunk (-1 = outlier), la verdad del agrupamiento
+
+    El resultado es determinista para cada (seed, block_rows).
+
+    Returns:
+        dict con las rutas, n_chunks, n_topics y dim
+    """
+    n_topics = n_topics or max(2, n_chunks // CHUNKS_PER_TOPIC)
+    os.makedirs(out_dir, exist_ok=True)
+    catalog = topic_catalog(n_topics)
+    topics = assign_topics(n_chunks, n_topics, outlier_ratio, seed)
+
+    embeddings_path = os.path.join(out_dir, "embeddings.npy")
+    matrix_path, sidecar_path = store_paths(embeddings_path)
+    contract_path = os.path.join(out_dir, "contract.txt")
+    topics_path = os.path.join(out_dir, "topics.npy")
+
+    matrix = np.lib.format.open_memmap(matrix_path + ".tmp", mode="w+", dtype=np.float32, shape=(n_chunks, dim))
+    with open(contract_path, "w", encoding="utf-8") as contract, \
+            open(sidecar_path + ".tmp", "w", encoding="utf-8") as sidecar:
+        sidecar.write('{"ids": ' + json.dumps(list(range(n_chunks))) + ', "texts": [')
+        for start in range(0, n_chunks, block_rows):
+            end = min(start + block_rows, n_chunks)
+            block_topics = topics[start:end]
+            topic_embeddings(block_topics, n_topics, dim, noise, seed, out=matrix[start:end], start=start)
+            lines = chunk_lines_for(block_topics, catalog, start, seed)
+            contract.write("\n".join(lines) + "\n")
+            texts = (f"{lines[2 * k]} {lines[2 * k + 1]}" for k in range(end - start))
+            sidecar.write((", " if start else "") + ", ".join(json.dumps(t, ensure_ascii=False) for t in texts))
+        sidecar.write("]}")
+    matrix.flush()
+    del matrix
+    os.replace(matrix_path + ".tmp", matrix_path)
+    os.replace(sidecar_path + ".tmp", sidecar_path)
+    np.save(topics_path, topics)
+
+    print(f"Synthetic corpus: {n_chunks} chunks, {n_topics} topics, dim {dim} → '{out_dir}'")
+    return {"contract": contract_path, "embeddings": embeddings_path, "topics": topics_path,
+            "n_chunks": n_chunks, "n_topics": n_topics, "dim": dim}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera un corpus EPC sintético con embeddings.")
+    parser.add_argument("n_chunks", type=int)
+    parser.add_argument("out_dir")
+    parser.add_argument("--topics", type=int, help=f"temas (por defecto n_chunks / {CHUNKS_PER_TOPIC})")
+    parser.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    parser.add_argument("--noise", type=float, default=0.35)
+    parser.add_argument("--outliers", type=float, default=0.05, help="proporción de chunks sin tema")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    generate_corpus(args.n_chunks, args.out_dir, n_topics=args.topics, dim=args.dim, noise=args.noise,
+                    outlier_ratio=args.outliers, seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()
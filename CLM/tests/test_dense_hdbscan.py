@@ -0,0 +1,65 @@
+"""
+El HDBSCAN denso por bloques (_dense_hdbscan_labels) debe dar las mismas etiquetas que
+hdbscan.HDBSCAN(metric='precomputed').fit_predict, tanto con las funciones internas de
+hdbscan como con el fallback.
+
+Uso:
+    python -m pytest CLM/tests
+"""
+import os
+import sys
+
+import hdbscan
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import generate_semantic_groups  # noqa: E402
+from distance_engine import get_distance_matrix  # noqa: E402
+
+
+def _fixture_embeddings(seed=0, n_clusters=6, per_cluster=25, dim=32):
+    """Clusters gaussianos sobre direcciones aleatorias más algo de ruido uniforme."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim))
+    points = [center + 0.15 * rng.normal(size=(per_cluster, dim)) for center in centers]
+    points.append(rng.normal(size=(20, dim)))
+    return np.vstack(points).astype(np.float32)
+
+
+def _fit_predict(dist_matrix, min_cluster_size, min_samples, epsilon, method):
+    return hdbscan.HDBSCAN(
+        metric='precomputed',
+        min_cluster_size=min_cluster_size,
+        min_samples=min_samples,
+        cluster_selection_epsilon=epsilon,
+        cluster_selection_method=method,
+        allow_single_cluster=False,
+    ).fit_predict(dist_matrix.astype(np.float64))
+
+
+@pytest.mark.parametrize("min_cluster_size,min_samples,epsilon,method", [
+    (2, 1, 0.0, 'eom'),
+    (5, 3, 0.0, 'eom'),
+    (4, 2, 0.05, 'leaf'),
+])
+def test_dense_labels_match_fit_predict(min_cluster_size, min_samples, epsilon, method):
+    dist_matrix = get_distance_matrix(_fixture_embeddings())
+    expected = _fit_predict(dist_matrix, min_cluster_size, min_samples, epsilon, method)
+
+    labels = generate_semantic_groups._dense_hdbscan_labels(dist_matrix, min_cluster_size, min_samples,
+                                                            epsilon, method)
+
+    assert labels.dtype == np.int64
+    np.testing.assert_array_equal(labels, expected)
+
+
+def test_fallback_without_hdbscan_internals(monkeypatch):
+    monkeypatch.setattr(generate_semantic_groups, "hdbscan_label", None)
+    dist_matrix = get_distance_matrix(_fixture_embeddings(seed=1))
+    expected = _fit_predict(dist_matrix, 3, 2, 0.0, 'eom')
+
+    labels = generate_semantic_groups._dense_hdbscan_labels(dist_matrix, 3, 2, 0.0, 'eom')
+
+    np.testing.assert_array_equal(labels, expected)
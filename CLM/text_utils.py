@@ -0,0 +1,6 @@
+def estimate_tokens(text):
+    """
+    Estimación barata de los tokens de un texto (~4 caracteres por token), sin tokenizador.
+    La usan el empaquetado de lotes (nombrado y relaciones) el limitador de rate_limit.py y el recuento de tokens de local_clients.py.
+    """
+    return len(text) // 4 + 1